@@ -28,7 +28,7 @@ import yaml
 import webbrowser
 from jsonrpc.proxy import JSONRPCException
 from jsonrpc.json import JSONDecodeException
-from flatland import Integer, Form, String, Enum, Boolean
+from flatland import Integer, Float, Form, String, Enum, Boolean
 from pygtkhelpers.ui.extra_widgets import Filepath
 from pygtkhelpers.ui.form_view_dialog import FormViewDialog
 
@@ -39,8 +39,10 @@ from config import Config
 from plugin_manager import (ExtensionPoint, IPlugin, SingletonPlugin,
                             implements, PluginGlobals)
 import plugin_manager
+import plugin_host
 from plugin_helpers import AppDataController, get_plugin_info
-from logger import (logger, CustomHandler, logging, DEBUG, INFO, WARNING,
+from logger import (logger, CustomHandler, QueueHandler,
+                    AsyncRotatingFileHandler, logging, DEBUG, INFO, WARNING,
                     ERROR, CRITICAL)
 from application_repository.application.proxy import AppRepository
 from . import base_path
@@ -118,9 +120,27 @@ INFO:  <Plugin ProtocolGridController 'microdrop.gui.protocol_grid_controller'>
             properties={'action': gtk.FILE_CHOOSER_ACTION_SAVE}),
         Boolean.named('log_enabled').using( #pylint: disable-msg=E1120
             default=False, optional=True),
+        Integer.named('log_max_size_mb').using( #pylint: disable-msg=E1120
+            default=100, optional=True),
+        Integer.named('log_rotate_hours').using( #pylint: disable-msg=E1120
+            default=24, optional=True),
+        Integer.named('log_backup_count').using( #pylint: disable-msg=E1120
+            default=10, optional=True),
+        Float.named('log_flush_interval').using( #pylint: disable-msg=E1120
+            default=1., optional=True),
         Enum.named('log_level').using( #pylint: disable-msg=E1101, E1120
             default='info', optional=True
             ).valued('debug', 'info', 'warning', 'error', 'critical'),
+        Boolean.named('profile_signals').using( #pylint: disable-msg=E1120
+            default=False, optional=True),
+        Integer.named('signal_debounce_ms').using( #pylint: disable-msg=E1120
+            default=0, optional=True,
+            properties=dict(show_in_gui=False)),
+        # Protocol files saved in the 'container' format can not be opened
+        # by previous versions.
+        Enum.named('protocol_format').using( #pylint: disable-msg=E1101, E1120
+            default='pickle', optional=True
+            ).valued('pickle', 'container'),
     )
 
     def __init__(self):
@@ -160,8 +180,18 @@ INFO:  <Plugin ProtocolGridController 'microdrop.gui.protocol_grid_controller'>
         self.realtime_mode = False
         self.running = False
         self.builder = gtk.Builder()
+
+        # Signals fired once per step/form during bulk protocol edits (e.g.,
+        # pasting steps) are delivered once per GTK idle iteration, or before
+        # the next signal that inserts, removes, or swaps steps (see
+        # `plugin_manager.set_flush_before()`).
+        plugin_manager.set_coalescible('on_step_options_changed')
+        plugin_manager.set_coalescible('on_protocol_changed')
         self.signals = {}
         self.plugin_data = {}
+        # Copies of the steps placed on the clipboard by `copy_steps()`, while
+        # the clipboard is owned by the application.
+        self._clipboard_steps = None
 
         # these members are initialized by plugins
         self.experiment_log_controller = None
@@ -170,8 +200,10 @@ INFO:  <Plugin ProtocolGridController 'microdrop.gui.protocol_grid_controller'>
         self.protocol_controller = None
         self.main_window_controller = None
 
-        # Enable custom logging handler
-        logger.addHandler(CustomHandler())
+        # Enable custom logging handler.  Records are delivered to logging
+        # plugins from the main loop, so logging never blocks on a plugin.
+        self.plugin_log_handler = QueueHandler()
+        logger.addHandler(self.plugin_log_handler)
         self.log_file_handler = None
 
         # config model
@@ -299,6 +331,13 @@ INFO:  <Plugin ProtocolGridController 'microdrop.gui.protocol_grid_controller'>
                                            data['log_enabled'])
             if 'log_level' in data:
                 self._set_log_level(data['log_level'])
+            if 'signal_debounce_ms' in data:
+                plugin_manager.set_coalesce_delay(data['signal_debounce_ms'])
+            if 'profile_signals' in data:
+                if data['profile_signals']:
+                    plugin_manager.enable_profiling()
+                else:
+                    plugin_manager.disable_profiling()
             if 'width' in data and 'height' in data:
                 self.main_window_controller.view.set_size_request(
                     data['width'], data['height'])
@@ -417,7 +456,25 @@ Would you like to download the latest version in your browser?''' %
                                  .joinpath('microdrop.log')})
 
         self.update_check()
-        plugin_manager.load_plugins(self.config['plugins']['directory'])
+        # Only import enabled plugins.  Other installed plugins are imported
+        # on demand (e.g., when enabled through the plugin manager dialog).
+        # Plugins listed in `out_of_process` are hosted in a child process
+        # (see `plugin_host`).
+        hosted = [package_name for package_name in
+                  self.config['plugins']['out_of_process']
+                  if package_name in self.config['plugins']['enabled']]
+        plugin_manager.load_plugins(self.config['plugins']['directory'],
+                                    enabled=[package_name for package_name
+                                             in self.config['plugins']
+                                             ['enabled']
+                                             if package_name not in hosted])
+        for package_name in hosted:
+            try:
+                plugin_host.start_plugin_host(self.config['plugins']
+                                              ['directory'], package_name)
+            except Exception:
+                logger.error('Error starting plugin host for %s.' %
+                             package_name, exc_info=True)
         self.update_log_file()
 
         logger.info('User data directory: %s' % self.config['data_dir'])
@@ -508,10 +565,22 @@ Would you like to download the latest version in your browser?''' %
         else:
             raise TypeError
 
-    def _set_log_file_handler(self, log_file):
+    def _get_log_file_options(self, values):
+        '''
+        Returns the `AsyncRotatingFileHandler` options for the specified app
+        values (rotation and flushing are disabled for missing values).
+        '''
+        return dict(max_bytes=(values.get('log_max_size_mb') or 0) << 20,
+                    rotate_interval=3600 * (values.get('log_rotate_hours') or
+                                            0),
+                    backup_count=values.get('log_backup_count') or 0,
+                    flush_interval=values.get('log_flush_interval') or 1.)
+
+    def _set_log_file_handler(self, log_file, options=None):
         if self.log_file_handler:
             self._destroy_log_file_handler()
-        self.log_file_handler = logging.FileHandler(log_file)
+        self.log_file_handler = AsyncRotatingFileHandler(log_file,
+                                                         **(options or {}))
         formatter = logging.Formatter('%(asctime)s %(levelname)s %(message)s')
         self.log_file_handler.setFormatter(formatter)
         logger.addHandler(self.log_file_handler)
@@ -535,16 +604,18 @@ Would you like to download the latest version in your browser?''' %
         # values contains both log_enabled and log_file
         log_file = values['log_file']
         log_enabled = values['log_enabled']
+        options = self._get_log_file_options(values)
         if self.log_file_handler is None:
             if log_enabled:
-                self._set_log_file_handler(log_file)
+                self._set_log_file_handler(log_file, options)
                 logger.info('[App] logging enabled')
         else:
             # Log file handler already exists
             if log_enabled:
-                if log_file != self.log_file_handler.baseFilename:
-                    # Requested log file path has been changed
-                    self._set_log_file_handler(log_file)
+                if log_file != self.log_file_handler.baseFilename or \
+                        options != self.log_file_handler.options:
+                    # Requested log file path or options have been changed
+                    self._set_log_file_handler(log_file, options)
             else:
                 self._destroy_log_file_handler()
 
@@ -572,6 +643,13 @@ Would you like to download the latest version in your browser?''' %
         if step_number is None:
             # Default to pasting after the current step
             step_number = self.protocol.current_step_number + 1
+        if self._clipboard_steps is not None:
+            # Steps were copied from this application, so paste copies of them
+            # (sharing plugin data until it is changed) rather than decoding
+            # the clipboard text.
+            new_steps = [step.copy() for step in self._clipboard_steps]
+            self.protocol.insert_steps(step_number, values=new_steps)
+            return
         clipboard = gtk.clipboard_get()
         try:
             new_steps = yaml.load(clipboard.wait_for_text())
@@ -585,10 +663,25 @@ Would you like to download the latest version in your browser?''' %
         self.protocol.insert_steps(step_number, values=new_steps)
 
     def copy_steps(self, step_ids):
-        steps = [self.protocol.steps[id] for id in step_ids]
+        steps = [self.protocol.steps[id].copy() for id in step_ids]
         if steps:
+            def get_text(clipboard, selection_data, info, steps):
+                # Only serialize the steps if they are pasted in another
+                # application.
+                selection_data.set_text(yaml.dump(steps))
+
+            def clear(clipboard, steps):
+                if self._clipboard_steps is steps:
+                    self._clipboard_steps = None
+
             clipboard = gtk.clipboard_get()
-            clipboard.set_text(yaml.dump(steps))
+            targets = [('UTF8_STRING', 0, 0), ('STRING', 0, 0),
+                       ('TEXT', 0, 0), ('text/plain', 0, 0)]
+            if clipboard.set_with_data(targets, get_text, clear, steps):
+                self._clipboard_steps = steps
+            else:
+                self._clipboard_steps = None
+                clipboard.set_text(yaml.dump(steps))
 
     def delete_steps(self, step_ids):
         self.protocol.delete_steps(step_ids)
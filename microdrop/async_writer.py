@@ -0,0 +1,132 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import atexit
+import threading
+import time
+import traceback
+import weakref
+from Queue import Queue, Empty
+
+
+# Writers that have not been closed yet (closed at exit, see `_close_all()`).
+_writers = weakref.WeakSet()
+
+
+class _FlushRequest(object):
+    def __init__(self, close=False):
+        self.close = close
+        self.done = threading.Event()
+
+
+class AsyncWriter(object):
+    '''
+    Write data from a background thread, so a slow disk does not block the
+    thread producing the data.
+
+    Data passed to `write()` is queued, and passed to the `write` callback by
+    the writer thread.  The `flush` callback is called at most every
+    `flush_interval` seconds after data was written, and when the writer is
+    flushed or closed.  Exceptions raised by the callbacks are passed to
+    `on_error` (by default, the traceback is printed), and do not stop the
+    writer.
+    '''
+    def __init__(self, write, flush, close, flush_interval=1., name=None,
+                 on_error=None):
+        self._write = write
+        self._flush = flush
+        self._close = close
+        self.flush_interval = flush_interval
+        self._on_error = on_error
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._work,
+                                        name=name or 'AsyncWriter')
+        self._thread.daemon = True
+        self._thread.start()
+        _writers.add(self)
+
+    def write(self, data):
+        self._queue.put(data)
+
+    def _work(self):
+        last_flush = time.time()
+        dirty = False
+        while True:
+            try:
+                message = self._queue.get(timeout=self.flush_interval
+                                          if dirty else None)
+            except Empty:
+                message = None
+            try:
+                if isinstance(message, _FlushRequest):
+                    try:
+                        if dirty:
+                            dirty = False
+                            last_flush = time.time()
+                            self._flush()
+                    finally:
+                        if message.close:
+                            self._close()
+                        message.done.set()
+                elif message is not None:
+                    dirty = True
+                    self._write(message)
+                if dirty and time.time() - last_flush >= self.flush_interval:
+                    dirty = False
+                    last_flush = time.time()
+                    self._flush()
+            except Exception:
+                if self._on_error is None:
+                    traceback.print_exc()
+                else:
+                    self._on_error()
+            if isinstance(message, _FlushRequest) and message.close:
+                return
+
+    def _request(self, close=False, timeout=None):
+        request = _FlushRequest(close)
+        self._queue.put(request)
+        request.done.wait(timeout)
+
+    def flush(self, timeout=None):
+        '''
+        Wait (by default, indefinitely) for queued data to be written and
+        flushed.
+        '''
+        if self._thread.is_alive():
+            self._request(timeout=timeout)
+
+    def close(self, timeout=None):
+        '''
+        Write and flush queued data, then close the writer and wait for its
+        thread to stop.
+        '''
+        if self._thread.is_alive():
+            self._request(close=True, timeout=timeout)
+            self._thread.join(timeout)
+        _writers.discard(self)
+
+
+@atexit.register
+def _close_all():
+    # Write queued data and stop writer threads before the interpreter shuts
+    # down (daemon threads still running then fail as module globals are
+    # cleared).
+    for writer in list(_writers):
+        writer.close(timeout=5.)
@@ -0,0 +1,115 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+
+Compare the time taken by `ExperimentLog` queries (using the column index)
+with the previous implementation (scanning every record) on large logs.
+
+Usage:
+
+    python -m microdrop.bin.benchmark_experiment_log [-n <records>] \\
+        [--appends <steps>]
+"""
+import time
+from argparse import ArgumentParser
+
+from ..experiment_log import ExperimentLog
+
+
+def create_log(n_records):
+    log = ExperimentLog()
+    log.add_data({'start time': time.time(), 'software version': '1.0',
+                  'notes': 'benchmark'})
+    log.data.extend([{'core': {'step': i % 100, 'time': 0.1 * i,
+                               'attempt': 0},
+                      'plugin': {'voltage': 100, 'frequency': 1e4}}
+                     for i in xrange(n_records - 1)])
+    return log
+
+
+def get_legacy(log, name, plugin_name='core'):
+    var = []
+    for d in log.data:
+        if plugin_name in d and d[plugin_name].keys().count(name):
+            var.append(d[plugin_name][name])
+        else:
+            var.append(None)
+    return var
+
+
+def add_step_legacy(log, step_number, attempt=0):
+    # `start_time()` scanned the log for each step.
+    for val in get_legacy(log, 'start time'):
+        if val:
+            start_time = val
+            break
+    log.data.append({'core': {'step': step_number,
+                              'time': time.time() - start_time,
+                              'attempt': attempt}})
+
+
+def timeit(f, *args):
+    start = time.time()
+    f(*args)
+    return time.time() - start
+
+
+def run(n_records, n_appends):
+    log = create_log(n_records)
+    start = time.time()
+    log._build_index()
+    print 'Built index of %d records in %.2f s.\n' % (n_records,
+                                                      time.time() - start)
+    print '%-32s %12s %12s' % ('operation', 'legacy (s)', 'indexed (s)')
+
+    def append_legacy():
+        for i in xrange(n_appends):
+            add_step_legacy(log, i)
+        # Restore the log, so the index does not need to be rebuilt.
+        del log.data[-n_appends:]
+
+    def append_indexed():
+        for i in xrange(n_appends):
+            log.add_step(i)
+
+    results = [('add_step x %d' % n_appends, timeit(append_legacy),
+                timeit(append_indexed))]
+    for name, plugin_name in (('step', 'core'), ('voltage', 'plugin'),
+                              ('notes', 'core')):
+        label = 'get(%r, %r)' % (name, plugin_name)
+        results.append((label, timeit(get_legacy, log, name, plugin_name),
+                        timeit(log.get, name, plugin_name)))
+    results.append(("get_values('notes')", timeit(get_legacy, log, 'notes'),
+                    timeit(log.get_values, 'notes')))
+    for label, legacy, indexed in results:
+        print '%-32s %12.4f %12.4f' % (label, legacy, indexed)
+
+
+def parse_args(args=None):
+    """Parses command-line arguments."""
+    parser = ArgumentParser(description='Benchmark experiment log queries.')
+    parser.add_argument('-n', '--records', type=int, default=1000000,
+                        help='number of records in log (default: %(default)s)')
+    parser.add_argument('--appends', type=int, default=100,
+                        help='number of steps to append (default: '
+                        '%(default)s)')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    run(args.records, args.appends)
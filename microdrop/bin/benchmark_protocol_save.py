@@ -0,0 +1,111 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+
+Compare the time and peak memory used to save a large protocol with
+`Protocol.save` and with the previous implementation (deep copy of the
+protocol, then pickle).
+
+Each run is done in a separate process, since peak memory usage (maximum
+resident set size) can not be reset.
+
+Usage:
+
+    python -m microdrop.bin.benchmark_protocol_save [-n <steps>]
+"""
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from copy import deepcopy
+
+import cPickle as pickle
+from path_helpers import path
+
+from ..protocol import Protocol, Step
+
+
+def create_protocol(n_steps, n_plugins=5, n_values=200):
+    protocol = Protocol()
+    protocol.steps = [Step(dict([('plugin_%d' % j,
+                                  {'values': range(i, i + n_values),
+                                   'duration': 100 * i})
+                                 for j in range(n_plugins)]))
+                      for i in range(n_steps)]
+    return protocol
+
+
+def save_legacy(protocol, filename):
+    out = deepcopy(protocol)
+    for step in out.steps:
+        for k, v in step.plugin_data.items():
+            step.plugin_data[k] = pickle.dumps(v)
+    with open(filename, 'wb') as f:
+        pickle.dump(out, f, -1)
+
+
+def max_rss_mb():
+    # `ru_maxrss` is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def run(method, n_steps):
+    protocol = create_protocol(n_steps)
+    baseline = max_rss_mb()
+    filename = path(tempfile.mktemp(prefix='protocol_'))
+    try:
+        start = time.time()
+        if method == 'legacy':
+            save_legacy(protocol, filename)
+        else:
+            protocol.save(filename)
+        duration = time.time() - start
+        size = filename.size / float(1 << 20)
+    finally:
+        if filename.isfile():
+            filename.remove()
+    print '%-10s %8d %10.2f %12.1f %10.1f' % (method, n_steps, duration,
+                                              max_rss_mb() - baseline, size)
+
+
+def parse_args(args=None):
+    """Parses command-line arguments."""
+    parser = ArgumentParser(description='Benchmark saving a protocol.')
+    parser.add_argument('-n', '--steps', type=int, action='append',
+                        help='number of steps (may be specified more than '
+                        'once)')
+    parser.add_argument('--method', choices=('legacy', 'stream'))
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    steps = args.steps or [1000, 5000, 20000]
+    if args.method:
+        for n_steps in steps:
+            run(args.method, n_steps)
+    else:
+        print '%-10s %8s %10s %12s %10s' % ('method', 'steps', 'time (s)',
+                                            'peak (MB)', 'file (MB)')
+        for n_steps in steps:
+            for method in ('legacy', 'stream'):
+                subprocess.check_call([sys.executable, '-m',
+                                       'microdrop.bin.benchmark_protocol_save',
+                                       '--method', method, '-n',
+                                       str(n_steps)])
@@ -0,0 +1,189 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+
+Export the experiment logs in one or more directories (e.g., a device
+directory, or the `logs` directory of a device) to a single table (see
+`ExperimentLog.to_frame()`), with one row per log entry.
+
+The `('log', 'device')`, `('log', 'experiment_id')` and `('log', 'entry')`
+columns identify the log entry of each row.
+
+Output formats:
+
+ - `npy`: a directory containing one `.npy` file per column and an index,
+   `columns.json` (see `load_columns()`).  Numeric columns can be
+   memory-mapped (e.g., `load_columns(directory, mmap_mode='r')`).
+ - `pickle`: a pickled `pandas.DataFrame` (see `pandas.read_pickle`).
+
+Logs are loaded in a pool of worker processes.
+
+Usage:
+
+    python -m microdrop.bin.export_experiment_logs <directory> \\
+        [<directory>...] -o <output> [--format npy|pickle] [-j <processes>]
+"""
+import json
+import logging
+import multiprocessing
+import time
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+from path_helpers import path
+
+from ..experiment_log import ExperimentLog
+from microdrop_utility import is_int
+
+
+def find_logs(directory):
+    '''
+    Returns the experiment log files (i.e., `<log id>/data`) in a directory
+    (recursively).
+    '''
+    return sorted([f for f in path(directory).walkfiles('data')
+                   if is_int(f.parent.name)])
+
+
+def load_frame(filename):
+    '''
+    Returns the table of an experiment log file (see
+    `ExperimentLog.to_frame()`), or an error message.
+    '''
+    filename = path(filename)
+    try:
+        frame = ExperimentLog.load(filename).to_frame()
+    except Exception, why:
+        return filename, '%s: %s' % (why.__class__.__name__, why)
+    log_dir = filename.parent
+    # Device directory layout is `<device name>/logs/<log id>/data`.
+    if log_dir.parent.name == 'logs':
+        device = log_dir.parent.parent.name
+    else:
+        device = None
+    frame.insert(0, ('log', 'entry'), frame.index.values)
+    frame.insert(0, ('log', 'experiment_id'), int(log_dir.name))
+    frame.insert(0, ('log', 'device'), device)
+    return filename, frame
+
+
+def export_frame(directories, processes=None):
+    '''
+    Returns a `pandas.DataFrame` containing the experiment logs in one or more
+    directories, and a list of `(filename, error message)` tuples for logs
+    that could not be loaded.
+    '''
+    filenames = []
+    for directory in directories:
+        filenames.extend(map(str, find_logs(directory)))
+    if not filenames:
+        return pd.DataFrame(), []
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(load_frame, filenames, chunksize=4)
+    finally:
+        pool.close()
+        pool.join()
+    frames = [frame for f, frame in results if not isinstance(frame,
+                                                              basestring)]
+    errors = [(f, frame) for f, frame in results if isinstance(frame,
+                                                               basestring)]
+    if not frames:
+        return pd.DataFrame(), errors
+    columns = []
+    for frame in frames:
+        columns.extend([c for c in frame.columns if c not in columns])
+    frame = pd.concat(frames, ignore_index=True)[columns]
+    frame.columns = pd.MultiIndex.from_tuples(columns)
+    return frame, errors
+
+
+def save_columns(frame, directory):
+    '''
+    Save each column of a table (see `export_frame()`) to a `.npy` file in a
+    directory, and the list of columns to `columns.json`.
+    '''
+    directory = path(directory)
+    if not directory.isdir():
+        directory.makedirs()
+    columns = []
+    for i, column in enumerate(frame.columns):
+        values = frame[column].values
+        filename = '%04d.npy' % i
+        np.save(directory.joinpath(filename), values,
+                allow_pickle=values.dtype == object)
+        columns.append({'name': list(column), 'file': filename,
+                        'dtype': str(values.dtype)})
+    with open(directory.joinpath('columns.json'), 'wb') as f:
+        json.dump({'n_rows': len(frame), 'columns': columns}, f, indent=2)
+
+
+def load_columns(directory, mmap_mode=None):
+    '''
+    Load a table saved by `save_columns()`.
+
+    Args:
+        mmap_mode: see `numpy.load`.  Only applies to numeric columns (object
+            columns are pickled).
+    '''
+    directory = path(directory)
+    with open(directory.joinpath('columns.json'), 'rb') as f:
+        index = json.load(f)
+    data = []
+    for column in index['columns']:
+        if column['dtype'] == 'object':
+            values = np.load(directory.joinpath(column['file']),
+                             allow_pickle=True)
+        else:
+            values = np.load(directory.joinpath(column['file']),
+                             mmap_mode=mmap_mode)
+        data.append((tuple(column['name']), values))
+    frame = pd.DataFrame(dict(data), index=np.arange(index['n_rows']),
+                         columns=[k for k, v in data])
+    if data:
+        frame.columns = pd.MultiIndex.from_tuples([k for k, v in data])
+    return frame
+
+
+def parse_args(args=None):
+    """Parses command-line arguments."""
+    parser = ArgumentParser(description='Export experiment logs to a table.')
+    parser.add_argument('directory', type=path, nargs='+')
+    parser.add_argument('-o', '--output', type=path, required=True)
+    parser.add_argument('--format', choices=('npy', 'pickle'), default='npy')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of worker processes (default: number '
+                        'of CPUs)')
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args()
+    start_time = time.time()
+    frame, errors = export_frame(args.directory, processes=args.processes)
+    for filename, error in errors:
+        print 'Could not load %s: %s' % (filename, error)
+    if args.format == 'npy':
+        save_columns(frame, args.output)
+    else:
+        frame.to_pickle(args.output)
+    print 'Exported %d rows, %d columns in %.2f s.' % (frame.shape[0],
+                                                       frame.shape[1],
+                                                       time.time() -
+                                                       start_time)
@@ -0,0 +1,320 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+
+Upgrade the devices, protocols and experiment logs in a device directory to
+the current file versions, so they do not need to be upgraded each time they
+are opened.
+
+The device directory is expected to have the layout used by the application:
+
+    <device directory>/<device name>/device
+    <device directory>/<device name>/protocols/<protocol name>
+    <device directory>/<device name>/logs/<log id>/data
+    <device directory>/<device name>/logs/<log id>/device
+    <device directory>/<device name>/logs/<log id>/protocol
+
+Files are upgraded in a pool of worker processes.  Each upgraded file is
+written to a temporary file, which then replaces the original file.
+
+Protocol step data serialized as YAML by older versions (which is decoded
+with a compatibility shim each time the protocol is opened) is re-serialized
+using `pickle`, where the data can be decoded.
+
+Usage:
+
+    python -m microdrop.bin.migrate <device directory> [-j <processes>] \\
+        [--dry-run] [--report <report.json>]
+"""
+import json
+import logging
+import multiprocessing
+import time
+import traceback
+from argparse import ArgumentParser
+from collections import OrderedDict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from path_helpers import path
+import yaml
+
+from ..experiment_log import ExperimentLog, is_segment, read_segment
+from ..protocol import Protocol, decode_step_data
+from ..protocol_container import is_container, read_header
+from ..protocol_journal import replace_file
+from microdrop_utility import Version
+
+
+def find_files(device_directory):
+    '''
+    Returns a list of `(kind, path)` tuples, where `kind` is one of
+    `'device'`, `'protocol'` or `'log'`, for each file in a device directory.
+    '''
+    files = []
+    for device_dir in sorted(path(device_directory).dirs()):
+        if device_dir.joinpath('device').isfile():
+            files.append(('device', device_dir.joinpath('device')))
+        protocols_dir = device_dir.joinpath('protocols')
+        if protocols_dir.isdir():
+            for f in sorted(protocols_dir.files()):
+                # Skip protocol journals and partly written files.
+                if '.journal-' in f.name or f.ext == '.tmp':
+                    continue
+                files.append(('protocol', f))
+        logs_dir = device_dir.joinpath('logs')
+        if logs_dir.isdir():
+            for log_dir in sorted(logs_dir.dirs()):
+                for kind, name in (('log', 'data'), ('device', 'device'),
+                                   ('protocol', 'protocol')):
+                    if log_dir.joinpath(name).isfile():
+                        files.append((kind, log_dir.joinpath(name)))
+    return files
+
+
+def _read_raw(filename):
+    '''
+    Returns the object stored in a file, without upgrading it.
+    '''
+    with open(filename, 'rb') as f:
+        try:
+            return pickle.load(f)
+        except Exception:
+            pass
+    with open(filename, 'rb') as f:
+        return yaml.load(f)
+
+
+def read_version(filename):
+    '''
+    Returns the version of the object stored in a file.
+    '''
+    if is_container(filename):
+        return read_header(filename)['version']
+    if is_segment(filename):
+        return read_segment(filename)[0]['version']
+    return getattr(_read_raw(filename), 'version', '0')
+
+
+def _is_pickle(data):
+    try:
+        pickle.loads(data)
+        return True
+    except Exception:
+        return False
+
+
+def _normalize_payload(data):
+    '''
+    Returns plugin data serialized using `pickle`, or `None` if the data is
+    already serialized using `pickle` (or can not be decoded).
+    '''
+    if not isinstance(data, basestring) or _is_pickle(data):
+        return None
+    try:
+        return pickle.dumps(decode_step_data(data), pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        return None
+
+
+def _write(filename, save):
+    temp_filename = filename.parent.joinpath(filename.name + '.tmp')
+    try:
+        save(temp_filename)
+        replace_file(temp_filename, filename)
+    finally:
+        if temp_filename.isfile():
+            temp_filename.remove()
+
+
+def _get_class(kind):
+    if kind == 'device':
+        # `dmf_device` requires `svg_model`, which is only needed to upgrade
+        # devices.
+        from ..dmf_device import DmfDevice
+
+        return DmfDevice
+    return {'protocol': Protocol, 'log': ExperimentLog}[kind]
+
+
+def _migrate_device(filename, dry_run):
+    device = _get_class('device').load(filename)
+    if not dry_run:
+        _write(filename, device.save)
+
+
+def _migrate_log(filename, dry_run):
+    log = ExperimentLog.load(filename)
+    # `ExperimentLog.save` does not write logs without data.
+    if log.data and not dry_run:
+        _write(filename, log.save)
+
+
+def _migrate_protocol(filename, upgrade, dry_run):
+    '''
+    Returns the number of step data items that were re-serialized.
+    '''
+    container = is_container(filename)
+    # Journals (if any) still apply, since the protocol keeps its
+    # `journal_id`.
+    protocol = Protocol.load(filename, warm=False, journal=False)
+    n_payloads = 0
+    for k, v in protocol.plugin_data.items():
+        if _normalize_payload(v) is not None:
+            protocol.plugin_data[k] = decode_step_data(v)
+            n_payloads += 1
+    for step in protocol.steps:
+        # Data of plugins that are not loaded is left serialized by
+        # `Protocol.load`, and is written as-is once set as encoded data.
+        raw_data = dict([(k, v) for k, v in step.plugin_data.iteritems()
+                         if isinstance(v, basestring)])
+        normalized = {}
+        for k, v in raw_data.iteritems():
+            data = _normalize_payload(v)
+            if data is not None:
+                n_payloads += 1
+                v = data
+            normalized[k] = v
+        step.set_encoded_data(normalized)
+    if (upgrade or n_payloads) and not dry_run:
+        _write(filename, lambda f: protocol.save(f, format='container'
+                                                 if container else 'pickle'))
+    return n_payloads
+
+
+def migrate_file(task):
+    '''
+    Upgrade a file (see `find_files()`) to the current version.
+
+    Returns a dictionary describing the result.
+    '''
+    kind, filename, dry_run = task
+    filename = path(filename)
+    result = OrderedDict([('kind', kind), ('path', str(filename)),
+                          ('status', None), ('to_version', None)])
+    start_time = time.time()
+    try:
+        cls = _get_class(kind)
+        result['to_version'] = cls.class_version
+        from_version = read_version(filename)
+        result['from_version'] = from_version
+        upgrade = Version.fromstring(from_version) < \
+            Version.fromstring(cls.class_version)
+        if kind == 'device':
+            if upgrade:
+                _migrate_device(filename, dry_run)
+        elif kind == 'log':
+            # Plugin data upgraded from version 0 is serialized as YAML.
+            # Segment files are always written with pickled plugin data.
+            if upgrade or not is_segment(filename) and \
+                    [v for step_data in _read_raw(filename).data
+                     for v in step_data.values() if not _is_pickle(v)]:
+                upgrade = True
+                _migrate_log(filename, dry_run)
+        else:
+            n_payloads = _migrate_protocol(filename, upgrade, dry_run)
+            result['payloads'] = n_payloads
+            upgrade = upgrade or n_payloads > 0
+        if not upgrade:
+            result['status'] = 'current'
+        else:
+            result['status'] = 'would upgrade' if dry_run else 'upgraded'
+    except Exception, why:
+        result['status'] = 'error'
+        result['error'] = str(why)
+        result['traceback'] = traceback.format_exc()
+    result['duration'] = time.time() - start_time
+    return result
+
+
+def migrate(device_directory, processes=None, dry_run=False):
+    '''
+    Upgrade all devices, protocols and experiment logs in a device directory.
+
+    Args:
+        processes: number of worker processes (default: number of CPUs).
+        dry_run: if `True`, do not write upgraded files.
+
+    Returns:
+        list of results (see `migrate_file()`), in the order of
+        `find_files()`.
+    '''
+    tasks = [(kind, str(filename), dry_run)
+             for kind, filename in find_files(device_directory)]
+    if not tasks:
+        return []
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(migrate_file, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def format_report(results):
+    lines = []
+    for result in results:
+        line = '%-13s %-8s %s' % (result['status'], result['kind'],
+                                 result['path'])
+        if result['status'] in ('upgraded', 'would upgrade'):
+            line += ' (%s -> %s, %.2f s)' % (result['from_version'],
+                                             result['to_version'],
+                                             result['duration'])
+        elif result['status'] == 'error':
+            line += ': %s' % result['error']
+        lines.append(line)
+    counts = OrderedDict()
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    lines.append('')
+    lines.append('%d files: %s' % (len(results),
+                                   ', '.join(['%d %s' % (v, k)
+                                              for k, v in counts.items()])))
+    return '\n'.join(lines)
+
+
+def parse_args(args=None):
+    """Parses command-line arguments."""
+    parser = ArgumentParser(description='Upgrade the devices, protocols and '
+                            'experiment logs in a device directory to the '
+                            'current file versions.')
+    parser.add_argument('device_directory', type=path)
+    parser.add_argument('-j', '--processes', type=int, default=None,
+                        help='number of worker processes (default: number '
+                        'of CPUs)')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='report files that need to be upgraded, '
+                        'without writing them')
+    parser.add_argument('-r', '--report', type=path, default=None,
+                        help='write results to JSON file')
+
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args()
+    results = migrate(args.device_directory, processes=args.processes,
+                      dry_run=args.dry_run)
+    print format_report(results)
+    if args.report is not None:
+        with open(args.report, 'wb') as f:
+            json.dump(results, f, indent=2)
+    if [r for r in results if r['status'] == 'error']:
+        raise SystemExit(1)
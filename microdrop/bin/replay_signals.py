@@ -0,0 +1,117 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+
+Re-emit the signals recorded in a signal trace (see
+`microdrop.signal_trace`) to a selected set of plugins, without starting the
+GUI, and compare the time spent by each plugin handling each signal with the
+recorded times.
+
+Usage:
+
+    python -m microdrop.bin.replay_signals <trace> -d <plugins dir> \\
+        -p <plugin package> [-p <plugin package> ...]
+"""
+import logging
+import time
+from argparse import ArgumentParser
+
+from path_helpers import path
+
+from .. import plugin_manager
+from ..interfaces import PluginGlobals
+from ..signal_profiler import SignalProfiler
+from ..signal_trace import read_trace
+
+
+def load_replay_plugins(plugins_dir, package_names):
+    plugin_manager.load_plugins(plugins_dir, enabled=package_names)
+    for package_name in package_names:
+        service = plugin_manager.get_service_instance_by_package_name(
+            package_name)
+        try:
+            plugin_manager.enable(service.name)
+        except Exception, why:
+            # Plugins may depend on the GUI being available when enabled.
+            logging.warning('Error enabling plugin %s: %s' % (service.name,
+                                                             why))
+
+
+def replay(trace_path, signals=None, realtime=False):
+    '''
+    Emit each signal recorded in a trace file to the enabled plugins.
+
+    Args:
+        trace_path: path to signal trace file.
+        signals: if not `None`, only replay signals with these names.
+        realtime: if `True`, reproduce the timing between recorded signals.
+
+    Returns:
+        (recorded, replayed): `SignalProfiler` instances containing handler
+            times from the trace and from the replay, respectively.
+    '''
+    recorded = SignalProfiler()
+    replayed = plugin_manager.enable_profiling(SignalProfiler())
+    try:
+        start = time.time()
+        for event in read_trace(trace_path):
+            if signals is not None and event.function not in signals:
+                continue
+            for name, duration in event.observers:
+                recorded.record(name, event.function, duration)
+            interface = PluginGlobals.interface_registry.get(event.interface)
+            if interface is None:
+                logging.warning('Unknown interface: %s' % event.interface)
+                continue
+            if realtime:
+                delay = event.time - (time.time() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            plugin_manager.emit_signal(event.function, list(event.args),
+                                       interface=interface)
+    finally:
+        plugin_manager.disable_profiling()
+    return recorded, replayed
+
+
+def parse_args(args=None):
+    """Parses command-line arguments."""
+    parser = ArgumentParser(description='Replay recorded Microdrop signals '
+                            'to a set of plugins (without the GUI).')
+    parser.add_argument('trace', type=path)
+    parser.add_argument('-d', '--plugins-dir', type=path, required=True)
+    parser.add_argument('-p', '--plugin', dest='plugins', action='append',
+                        default=[], help='package name of plugin to load '
+                        '(may be specified more than once)')
+    parser.add_argument('-s', '--signal', dest='signals', action='append',
+                        default=None, help='only replay the named signal '
+                        '(may be specified more than once)')
+    parser.add_argument('-r', '--realtime', action='store_true',
+                        help='reproduce the recorded time between signals')
+
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    load_replay_plugins(args.plugins_dir, args.plugins)
+    recorded, replayed = replay(args.trace, signals=args.signals,
+                                realtime=args.realtime)
+    print '# Recorded #\n'
+    print recorded.report()
+    print '# Replayed #\n'
+    print replayed.report()
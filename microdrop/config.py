@@ -56,6 +56,9 @@ class Config(object):
 
         # list of enabled plugins
         enabled = string_list(default=list())
+
+        # list of enabled plugins to run in a separate process
+        out_of_process = string_list(default=list())
         """
 
     def __init__(self, filename=None):
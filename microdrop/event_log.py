@@ -0,0 +1,148 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+
+Bounded history of structured diagnostic events.
+
+Event fields may be callables, which are only evaluated when a field is
+requested (e.g., by a sink, or when the history is dumped after an error), so
+recording an event on a hot path is cheap.  Note that a lazy field reflects
+the state at the time it is first evaluated, and keeps the objects it refers
+to alive while the event is in the history, so only use callables to format
+values that are captured when the event is recorded (e.g., a copy of a
+dictionary, rather than a bound method of the object being changed).
+
+Usage:
+
+    from event_log import record_event
+
+    values = step.get_values()
+    record_event('protocol.goto_step', step_number=step_number,
+                 values=lambda: expensive_format(values))
+"""
+
+import logging
+import threading
+import time
+import traceback
+from collections import deque
+from StringIO import StringIO
+from contextlib import closing
+
+
+class Event(object):
+    __slots__ = ('time', 'name', '_fields')
+
+    def __init__(self, time, name, fields):
+        self.time = time
+        self.name = name
+        self._fields = fields
+
+    def get(self, key):
+        '''
+        Returns the value of a field, evaluating it if it is lazy.
+        '''
+        value = self._fields[key]
+        if callable(value):
+            try:
+                value = value()
+            except Exception:
+                value = '<error: %s>' % traceback.format_exc().splitlines()[-1]
+            self._fields[key] = value
+        return value
+
+    @property
+    def fields(self):
+        return dict([(key, self.get(key)) for key in self._fields])
+
+    def format(self):
+        with closing(StringIO()) as output:
+            print >> output, '%s %s' % (time.strftime('%H:%M:%S', time
+                                                      .localtime(self.time)),
+                                        self.name),
+            for key in sorted(self._fields):
+                print >> output, '%s=%r' % (key, self.get(key)),
+            return output.getvalue()
+
+    def __repr__(self):
+        return '<Event %s>' % self.name
+
+
+class LoggingSink(object):
+    '''
+    Log events at `level` (evaluating their fields) only if the logger is
+    enabled for that level.
+    '''
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger()
+        self.level = level
+
+    def __call__(self, event):
+        if self.logger.isEnabledFor(self.level):
+            self.logger.log(self.level, event.format())
+
+
+class EventLog(object):
+    '''
+    Ring buffer holding the most recent `capacity` events.
+    '''
+    def __init__(self, capacity=1000):
+        self._events = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+        self.sinks = []
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def record(self, name, **fields):
+        event = Event(time.time(), name, fields)
+        with self._lock:
+            self._events.append(event)
+        for sink in self.sinks:
+            sink(event)
+        return event
+
+    def events(self, name=None):
+        with self._lock:
+            events = list(self._events)
+        if name is not None:
+            events = [e for e in events if e.name == name]
+        return events
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+
+    def dump(self, count=None):
+        '''
+        Returns the formatted `count` most recent events (or all events).
+        '''
+        events = self.events()
+        if count is not None:
+            events = events[-count:]
+        return '\n'.join([e.format() for e in events])
+
+
+event_log = EventLog()
+event_log.add_sink(LoggingSink())
+
+
+def record_event(name, **fields):
+    return event_log.record(name, **fields)
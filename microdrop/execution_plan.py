@@ -0,0 +1,121 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+
+Execution plan for a protocol run (see `ProtocolController.run_protocol`).
+
+The plan unrolls the steps of a protocol for each repetition, and holds what
+the protocol controller needs to advance from one step to the next, so that no
+plugins are looked up between steps:
+
+ - the names of the enabled plugins handling `on_step_run` (i.e., the plugins
+   the protocol controller waits for before advancing);
+ - the names of the plugins with data for each step (i.e., the plugins
+   `on_step_options_swapped` is emitted for, see `Protocol.goto_step`);
+ - the data of each step, by plugin name.
+
+A plan is only valid for the protocol (and set of enabled plugins) it was
+compiled for, and must be discarded when either changes, except for changes
+to the data of a single step (see `ExecutionPlan.update_step()`).
+"""
+
+import logging
+import time
+from collections import namedtuple
+
+
+class PlanEntry(namedtuple('PlanEntry', 'step_number repetition plugins')):
+    '''
+    A step of an execution plan.
+
+    Attributes:
+        step_number: index of step in protocol.
+        repetition: protocol repetition.
+        plugins: names of the plugins with data for the step.
+    '''
+    __slots__ = ()
+
+
+class ExecutionPlan(object):
+    def __init__(self, protocol, step_run_plugins):
+        '''
+        Args:
+            protocol: `Protocol` to run.  The data of its steps is decoded in
+                a background thread (see `Protocol.decode_steps`), so it is
+                decoded before the steps are run.
+            step_run_plugins: names of the plugins handling `on_step_run`
+                (see `plugin_manager.get_dispatch()`).
+        '''
+        start_time = time.time()
+        self.protocol = protocol
+        self.n_steps = len(protocol.steps)
+        self.n_repeats = max(protocol.n_repeats, 1)
+        self.step_run_plugins = tuple(step_run_plugins)
+        self._steps = list(protocol.steps)
+        # Entries are created when they are requested, since the plugins of a
+        # step are shared by its entries for each repetition.
+        self._step_plugins = [tuple(sorted(step.plugins))
+                              for step in self._steps]
+        protocol.decode_steps(background=True)
+        logging.debug('[ExecutionPlan] compiled %d steps in %f s.' %
+                      (self.n_steps, time.time() - start_time))
+
+    def update_step(self, step_number, step):
+        '''
+        Update a step (e.g., after its options have changed).
+        '''
+        self._steps[step_number] = step
+        self._step_plugins[step_number] = tuple(sorted(step.plugins))
+
+    def get_values(self, step_number):
+        '''
+        Returns a dictionary mapping the name of each plugin of a step to its
+        data.  The data objects may be shared with other steps, so they must
+        not be modified.
+        '''
+        step = self._steps[step_number]
+        return dict([(plugin_name, step.get_data(plugin_name))
+                     for plugin_name in self._step_plugins[step_number]])
+
+    def index(self, step_number, repetition=0):
+        '''
+        Returns the index of the entry of a step (for a repetition).
+        '''
+        if not 0 <= step_number < self.n_steps:
+            raise IndexError, 'step index out of range'
+        return min(repetition, self.n_repeats - 1) * self.n_steps + \
+            step_number
+
+    def __len__(self):
+        return self.n_steps * self.n_repeats
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError, 'plan index out of range'
+        repetition, step_number = divmod(i, self.n_steps)
+        return PlanEntry(step_number, repetition,
+                         self._step_plugins[step_number])
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return '<ExecutionPlan %d steps x %d repeats>' % (self.n_steps,
+                                                          self.n_repeats)
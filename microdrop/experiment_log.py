@@ -15,6 +15,32 @@ GNU General Public License for more details.
 
 You should have received a copy of the GNU General Public License
 along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+
+Experiment logs are either saved as a single pickle (see `ExperimentLog.save()`)
+or streamed to a segment file as records are added (see
+`ExperimentLog.open_segment()`).
+
+A segment file starts with `SEGMENT_MAGIC` and a header record, followed by
+one record for each change to the log:
+
+ - `('append', entry)`: append an entry to the log;
+ - `('update', plugin_name, data)`: update the data of a plugin in the last
+   entry of the log.
+
+The plugin data in each record is pickled separately (as in pickled logs), so
+the data of a plugin that can not be loaded does not prevent loading the rest
+of the log.  Each record is framed with its length and CRC32, so a record that
+was only partly written is ignored.
+
+Each record is written and synced to disk as it is added, so a log is readable
+while it is being written, and a crash only loses the last (partly written)
+record.  Streams can opt in to writing records from a background thread with
+`sync_interval` (see `ExperimentLog.__init__()`), trading durability for
+latency: records are then synced at most every `sync_interval` seconds, so a
+crash may lose the records added since the last sync.
+
+Only the last `ExperimentLog.max_entries` entries of a streamed log are kept in
+memory; older entries are read from the segment file when they are accessed.
 """
 
 import os
@@ -22,7 +48,11 @@ try:
     import cPickle as pickle
 except ImportError:
     import pickle
+import struct
 import time
+import zlib
+from array import array
+from collections import OrderedDict, deque
 from copy import deepcopy
 
 import numpy as np
@@ -30,11 +60,260 @@ from path_helpers import path
 import yaml
 
 from microdrop_utility import is_int, Version, VersionError, FutureVersionError
+from async_writer import AsyncWriter
 from logger import logger
 
 
+SEGMENT_MAGIC = 'MICRODROP-LOG\n'
+# Length and CRC32 of each record.
+_FRAME = struct.Struct('<II')
+
+
+def is_segment(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(SEGMENT_MAGIC)) == SEGMENT_MAGIC
+
+
+def _frame(record):
+    data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+    return _FRAME.pack(len(data), zlib.crc32(data) & 0xffffffff) + data
+
+
+def _read_record(f):
+    '''
+    Returns the next record of a segment file, or `None` at the end of the
+    file or if the record was only partly written.
+    '''
+    frame = f.read(_FRAME.size)
+    if len(frame) < _FRAME.size:
+        return None
+    length, crc = _FRAME.unpack(frame)
+    data = f.read(length)
+    if len(data) < length or zlib.crc32(data) & 0xffffffff != crc:
+        return None
+    return pickle.loads(data)
+
+
+def _scan_segment(filename):
+    '''
+    Returns the header and the `(offset, record)` pairs of a segment file.
+
+    See `read_segment()`.
+    '''
+    header = None
+    records = []
+    with open(filename, 'rb') as f:
+        if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+            raise TypeError, 'File is not an experiment log segment: %s' % \
+                filename
+        end = f.tell()
+        while True:
+            record = _read_record(f)
+            if record is None:
+                if f.tell() > end:
+                    logger.warning('[ExperimentLog] Ignoring truncated record '
+                                   'in %s.' % filename)
+                break
+            if header is None:
+                header = record
+            else:
+                records.append((end, record))
+            end = f.tell()
+    if header is None:
+        raise TypeError, 'File is not an experiment log segment: %s' % \
+            filename
+    return header, records, end
+
+
+def read_segment(filename):
+    '''
+    Returns the header and the records of a segment file.
+
+    A record that was only partly written (e.g., if the application crashed)
+    and all records following it are ignored.
+
+    Returns:
+        (header, records, end): `end` is the offset following the last
+            complete record.
+
+    Raises:
+        TypeError: file is not a segment file.
+    '''
+    header, records, end = _scan_segment(filename)
+    return header, [record for offset, record in records], end
+
+
+def _apply_record(data, record):
+    if record[0] == 'append':
+        data.append(dict([(k, _decode_plugin_data(k, v))
+                          for k, v in record[1].iteritems()]))
+    elif record[0] == 'update':
+        plugin_name, plugin_data = record[1:]
+        data[-1].setdefault(plugin_name, {}).update(
+            _decode_plugin_data(plugin_name, plugin_data))
+    else:
+        logger.warning('[ExperimentLog] Ignoring unknown record: %s' %
+                       record[0])
+
+
+class _SegmentFile(object):
+    '''
+    Write the records of a segment file, syncing each record to disk as it is
+    written.
+    '''
+    def __init__(self, f):
+        self._file = f
+
+    def write(self, data):
+        self._file.write(data)
+        os.fsync(self._file.fileno())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self._file.close()
+
+
+class _SegmentEntries(object):
+    '''
+    Entries of a log that is streamed to a segment file.
+
+    Only the last `max_entries` entries are kept in memory.  Older entries are
+    read from the segment file when they are accessed, so changes made to
+    them are not kept.
+    '''
+    def __init__(self, filename, end, max_entries):
+        self.filename = path(filename)
+        # Offset following the last record written to the segment file.
+        self.end = end
+        self.max_entries = max(max_entries, 1)
+        # Writer of the segment file, if it is open.
+        self.writer = None
+        # Offset of the `'append'` record of each entry.
+        self._offsets = array('L')
+        self._entries = deque()
+        # Index of the first entry kept in memory.
+        self._first = 0
+
+    def append(self, entry, offset=None):
+        '''
+        Append an entry, whose `'append'` record is written at `offset` (by
+        default, at the end of the segment file).
+        '''
+        self._offsets.append(self.end if offset is None else offset)
+        self._entries.append(entry)
+        while len(self._entries) > self.max_entries:
+            self._entries.popleft()
+            self._first += 1
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.take(range(*i.indices(len(self))))
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError, 'list index out of range'
+        return self.take([i])[0]
+
+    def __iter__(self):
+        if self._first:
+            self._flush()
+            with open(self.filename, 'rb') as f:
+                for i in xrange(self._first):
+                    yield self._read_entry(f, i)
+        for entry in list(self._entries):
+            yield entry
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def take(self, indices):
+        '''
+        Returns a list of the entries at `indices`, reading the entries that
+        are not kept in memory from the segment file in a single pass.
+        '''
+        read = {}
+        old = sorted(set([i for i in indices if i < self._first]))
+        if old:
+            self._flush()
+            with open(self.filename, 'rb') as f:
+                for i in old:
+                    read[i] = self._read_entry(f, i)
+        return [read[i] if i < self._first else self._entries[i - self._first]
+                for i in indices]
+
+    def _flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
+    def _read_entry(self, f, i):
+        # Apply the records from the `'append'` record of the entry to the
+        # `'append'` record of the next entry (entries that are not kept in
+        # memory are always followed by another entry).
+        data = []
+        f.seek(self._offsets[i])
+        while f.tell() < self._offsets[i + 1]:
+            record = _read_record(f)
+            if record is None:
+                break
+            _apply_record(data, record)
+        return data[0]
+
+
+def _encode_plugin_data(plugin_data):
+    return pickle.dumps(plugin_data, pickle.HIGHEST_PROTOCOL)
+
+
+def _decode_plugin_data(plugin_name, plugin_data):
+    try:
+        return pickle.loads(plugin_data)
+    except Exception, e:
+        logger.debug("Not a valid pickle string ("
+                     "plugin: %s). %s." % (plugin_name, e))
+        try:
+            return yaml.load(plugin_data)
+        except Exception, e:
+            logger.error("Couldn't load experiment log data for "
+                         "plugin: %s. %s." % (plugin_name, e))
+    return plugin_data
+
+
+def _is_scalar(value):
+    return value is None or isinstance(value, (int, long, float, bool,
+                                               basestring, np.generic))
+
+
+def _as_array(values):
+    '''
+    Returns an array of objects converted to a numeric (or boolean) type, if
+    possible.
+    '''
+    try:
+        converted = np.array(values.tolist())
+    except Exception:
+        return values
+    if converted.dtype.kind in 'biuf':
+        return converted
+    return values
+
+
 class ExperimentLog():
     class_version = str(Version(0,1,0))
+    # Writer of the segment file records are streamed to (see
+    # `open_segment()`).
+    segment = None
+    # Number of entries of a streamed log that are kept in memory.
+    max_entries = 1000
+    # If non-zero, maximum time (in seconds) between adding a record and
+    # syncing it to disk (see `__init__()`).
+    sync_interval = 0
 
     @classmethod
     def load(cls, filename):
@@ -52,6 +331,11 @@ class ExperimentLog():
         logger.info("Loading Experiment log from %s" % filename)
         out = None
         start_time = time.time()
+        if is_segment(filename):
+            out = cls._load_segment(filename)
+            logger.debug("[ExperimentLog].load() loaded in %f s." % \
+                         (time.time()-start_time))
+            return out
         with open(filename, 'rb') as f:
             try:
                 out = pickle.load(f)
@@ -77,26 +361,175 @@ class ExperimentLog():
         # load objects from serialized strings
         for i in range(len(out.data)):
             for plugin_name, plugin_data in out.data[i].items():
-                try:
-                    out.data[i][plugin_name] = pickle.loads(plugin_data)
-                except Exception, e:
-                    logger.debug("Not a valid pickle string ("
-                                 "plugin: %s). %s." % (plugin_name, e))
-                    try:
-                        out.data[i][plugin_name] = yaml.load(plugin_data)
-                    except Exception, e:
-                        logger.error("Couldn't load experiment log data for "
-                                     "plugin: %s. %s." % (plugin_name, e))
+                out.data[i][plugin_name] = _decode_plugin_data(plugin_name,
+                                                               plugin_data)
+        out._build_index()
         logger.debug("[ExperimentLog].load() loaded in %f s." % \
                      (time.time()-start_time))
         return out
 
-    def __init__(self, directory=None):
+    @classmethod
+    def _load_segment(cls, filename):
+        header, records, end = read_segment(filename)
+        version = Version.fromstring(header['version'])
+        if version > Version.fromstring(cls.class_version):
+            raise FutureVersionError
+        out = cls()
+        out.directory = header['directory']
+        out.experiment_id = header['experiment_id']
+        out.filename = filename
+        for record in records:
+            _apply_record(out.data, record)
+        out._build_index()
+        return out
+
+    def __init__(self, directory=None, stream=False, sync_interval=0):
+        '''
+        Args:
+            directory: directory containing the logs of a device.
+            stream: if `True`, stream records to a segment file in the log
+                directory (see `open_segment()`) once the first record is
+                added.
+            sync_interval: if 0, each streamed record is synced to disk as it
+                is added.  Otherwise, records are written by a background
+                thread, and synced at most every `sync_interval` seconds.
+        '''
         self.directory = directory
         self.data = []
         self.version = self.class_version
+        self.stream = stream
+        self.sync_interval = sync_interval
+        self._build_index()
         self._get_next_id()
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for k in ('segment', 'stream', 'sync_interval', '_columns',
+                  '_n_indexed', '_start_time'):
+            state.pop(k, None)
+        if isinstance(self.data, _SegmentEntries):
+            state['data'] = list(self.data)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def open_segment(self, filename=None):
+        '''
+        Stream the records added to the log to a segment file (by default,
+        `data` in the log directory).
+
+        Records are appended to the file if it is a segment file of this log
+        (e.g., if the log was loaded from it).  Otherwise, the file is
+        replaced with a segment file containing the current records.
+
+        While the segment is open, only the last `max_entries` entries are
+        kept in memory (see `_SegmentEntries`).
+        '''
+        self.close_segment()
+        if filename is None:
+            filename = os.path.join(self.get_log_path(), "data")
+        filename = path(filename)
+        entries = None
+        if filename.isfile() and is_segment(filename) and \
+                self._is_log_file(filename):
+            entries = self._segment_entries(filename)
+        # Records are written unbuffered, so they are readable as soon as
+        # they are written.
+        if entries is not None:
+            f = open(filename, 'r+b', 0)
+            # Discard a partly written record.
+            f.truncate(entries.end)
+            f.seek(entries.end)
+            self.segment = self._open_writer(f)
+            self.data = entries
+        else:
+            f = open(filename, 'wb', 0)
+            # Write the header before returning, so the file is a segment
+            # file even if records are written by a background thread.
+            header = SEGMENT_MAGIC + _frame({'version': self.version,
+                                             'directory': self.directory,
+                                             'experiment_id':
+                                             self.experiment_id})
+            f.write(header)
+            os.fsync(f.fileno())
+            self.segment = self._open_writer(f)
+            data = self.data
+            self.data = _SegmentEntries(filename, len(header),
+                                        self.max_entries)
+            for entry in data:
+                self.data.append(entry)
+                self._write_record(('append', dict([(k, _encode_plugin_data(v))
+                                                    for k, v in
+                                                    entry.iteritems()])))
+            self.filename = filename
+        self.data.writer = self.segment
+        return filename
+
+    def _open_writer(self, f):
+        if not self.sync_interval:
+            return _SegmentFile(f)
+
+        def on_error():
+            logger.error('[ExperimentLog] Could not write to %s.' % f.name,
+                         exc_info=True)
+        return AsyncWriter(f.write, lambda: os.fsync(f.fileno()), f.close,
+                           self.sync_interval, name='ExperimentLog',
+                           on_error=on_error)
+
+    def _segment_entries(self, filename):
+        '''
+        Returns the entries of the log, backed by the segment file it was
+        loaded from (or `None` if the entries do not match the file).
+        '''
+        if isinstance(self.data, _SegmentEntries) and \
+                self.data.filename.abspath() == filename.abspath():
+            return self.data
+        header, records, end = _scan_segment(filename)
+        offsets = [offset for offset, record in records
+                   if record[0] == 'append']
+        if len(offsets) != len(self.data):
+            return None
+        entries = _SegmentEntries(filename, end, self.max_entries)
+        for offset, entry in zip(offsets, self.data):
+            entries.append(entry, offset)
+        return entries
+
+    def _is_log_file(self, filename):
+        return getattr(self, 'filename', None) is not None and \
+            path(filename).abspath() == path(self.filename).abspath()
+
+    def close_segment(self):
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+            self.data.writer = None
+
+    def flush(self):
+        '''
+        Wait for the records added to the log to be written to disk.
+        '''
+        if self.segment is not None:
+            self.segment.flush()
+
+    def _write_record(self, record):
+        frame = _frame(record)
+        self.segment.write(frame)
+        self.data.end += len(frame)
+
+    def _append_record(self, record, start=False):
+        if self.segment is None and isinstance(self.data, _SegmentEntries):
+            # Keep the segment file consistent with the entries it backs
+            # (e.g., if records are added after the log was saved).
+            self.open_segment(self.data.filename)
+        if self.segment is not None:
+            self._write_record(record)
+        elif start and getattr(self, 'stream', False) and self.directory:
+            # Streaming starts with the first step, so no log directory is
+            # created for logs without steps.  Opening the segment writes the
+            # current records.
+            self.open_segment()
+
     def _upgrade(self):
         """
         Upgrade the serialized object if necessary.
@@ -150,7 +583,10 @@ class ExperimentLog():
         else:
             log_path = path(filename).parent
 
-        if self.data:
+        if self.segment is not None and self._is_log_file(filename):
+            # Records are already written to the segment file.
+            self.close_segment()
+        elif self.data:
             out = deepcopy(self)
             # serialize plugin dictionaries to strings
             for i in range(len(out.data)):
@@ -171,13 +607,16 @@ class ExperimentLog():
         return log_path
 
     def start_time(self):
-        data = self.get("start time")
-        for val in data:
-            if val:
-                return val
-        start_time = time.time()
-        self.add_data({"start time":start_time})
-        return start_time
+        self._update_index()
+        if getattr(self, '_start_time', None) is None:
+            for val in self.get_values("start time"):
+                if val:
+                    self._start_time = val
+                    return val
+            start_time = time.time()
+            self.add_data({"start time":start_time})
+            self._start_time = start_time
+        return self._start_time
 
     def get_log_path(self):
         log_path = os.path.join(self.directory, str(self.experiment_id))
@@ -186,27 +625,129 @@ class ExperimentLog():
         return log_path
 
     def add_step(self, step_number, attempt=0):
-        self.data.append({'core':{'step': step_number,
+        entry = {'core':{'step': step_number,
                          'time': time.time() - self.start_time(),
-                         'attempt': attempt}})
+                         'attempt': attempt}}
+        self._update_index()
+        self.data.append(entry)
+        self._index_entry(len(self.data) - 1, entry)
+        self._append_record(('append', dict([(k, _encode_plugin_data(v))
+                                             for k, v in entry.iteritems()])),
+                            start=True)
 
     def add_data(self, data, plugin_name='core'):
+        self._update_index()
         if len(self.data)==0:
             self.data.append({})
+            self._append_record(('append', {}))
         if not plugin_name in self.data[-1]:
             self.data[-1][plugin_name] = {}
         for k, v in data.items():
             self.data[-1][plugin_name][k]=v
+        self._index_entry(len(self.data) - 1, {plugin_name: data})
+        self._append_record(('update', plugin_name,
+                             _encode_plugin_data(dict(data))))
 
     def get(self, name, plugin_name='core'):
-        var = []
-        for d in self.data:
-            if plugin_name in d and d[plugin_name].keys().count(name):
-                var.append(d[plugin_name][name])
-            else:
-                var.append(None)
+        '''
+        Returns a list containing the value of `name` in each entry of the
+        log (or `None` for entries without a value).
+        '''
+        var = [None] * len(self.data)
+        indices = self._get_column(name, plugin_name)
+        for i, entry in zip(indices, self._take(indices)):
+            var[i] = entry[plugin_name].get(name)
         return var
 
+    def get_values(self, name, plugin_name='core'):
+        '''
+        Returns a list containing the value of `name` in each entry of the
+        log that has a value, in order.
+        '''
+        return [entry[plugin_name].get(name) for entry in
+                self._take(self._get_column(name, plugin_name))]
+
+    def _take(self, indices):
+        # Entries of a streamed log that are not kept in memory are read from
+        # the segment file in a single pass.
+        if isinstance(self.data, _SegmentEntries):
+            return self.data.take(indices)
+        return [self.data[i] for i in indices]
+
+    # pandas conversion #
+    def to_frame(self):
+        '''
+        Returns a `pandas.DataFrame` with one row per log entry and one column
+        per `(plugin name, key)` with scalar values (e.g., numbers and
+        strings), starting with the `('core', 'step')`, `('core', 'attempt')`
+        and `('core', 'time')` columns.
+
+        Numeric columns with undefined values are `float` columns, with `NaN`
+        for undefined values.  Undefined values in other columns are `None`
+        (in object columns).
+        '''
+        import pandas as pd
+
+        self._update_index()
+        n = len(self.data)
+        core = [('core', name) for name in ('step', 'attempt', 'time')]
+        keys = core + sorted([k for k in self._columns if k not in core])
+        data = OrderedDict()
+        for plugin_name, name in keys:
+            indices = self._columns.get((plugin_name, name), [])
+            values = [entry[plugin_name].get(name)
+                      for entry in self._take(indices)]
+            if not all([_is_scalar(v) for v in values]):
+                continue
+            values = np.array(values, dtype=object)
+            if len(indices) == n:
+                data[(plugin_name, name)] = _as_array(values)
+                continue
+            numeric = all([isinstance(v, (int, long, float, np.number)) and
+                           not isinstance(v, bool) for v in values])
+            if numeric:
+                column = np.empty(n, dtype=float)
+                column.fill(np.nan)
+            else:
+                column = np.empty(n, dtype=object)
+            column[indices] = values
+            data[(plugin_name, name)] = column
+        frame = pd.DataFrame(data, index=np.arange(n), columns=data.keys())
+        if len(data):
+            frame.columns = pd.MultiIndex.from_tuples(data.keys())
+        return frame
+
+    def _build_index(self):
+        # Maps each `(plugin_name, name)` pair to the (sorted) indices of the
+        # entries with a value for `name`.
+        self._columns = {}
+        self._n_indexed = 0
+        for i, entry in enumerate(self.data):
+            self._index_entry(i, entry)
+        self._n_indexed = len(self.data)
+
+    def _update_index(self):
+        # Rebuild the index if entries were added to (or removed from) `data`
+        # directly.  Values set directly in existing entries are not indexed.
+        if getattr(self, '_columns', None) is None or \
+                self._n_indexed != len(self.data):
+            self._build_index()
+            self._start_time = None
+
+    def _index_entry(self, i, entry):
+        for plugin_name, plugin_data in entry.iteritems():
+            if not isinstance(plugin_data, dict):
+                continue
+            for name in plugin_data:
+                column = self._columns.setdefault((plugin_name, name), [])
+                if not column or column[-1] != i:
+                    column.append(i)
+        self._n_indexed = max(self._n_indexed, i + 1)
+
+    def _get_column(self, name, plugin_name):
+        self._update_index()
+        return self._columns.get((plugin_name, name), [])
+
     def _get_next_id(self):
         if self.directory is None:
             self.experiment_id = None
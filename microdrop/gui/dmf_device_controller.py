@@ -352,17 +352,42 @@ directory)?''' % (device_directory, self.previous_device_dir))
     def get_default_options(self):
         return DmfDeviceOptions()
 
-    def get_step_options(self, step=None):
+    def get_step_options(self, step_number=None):
         """
-        Return a FeedbackOptions object for the current step in the protocol.
-        If none exists yet, create a new one.
+        Return a DmfDeviceOptions object for a step in the protocol (by
+        default, the current step).  If none exists yet, create a new one.
+
+        The options may be shared with copies of the step, so they must not
+        be modified in place (see `edit_step_options()`).
         """
         app = get_app()
-        options = app.protocol.current_step().get_data(self.name)
+        if step_number is None:
+            step_number = app.protocol.current_step_number
+        options = app.protocol.steps[step_number].get_data(self.name)
         if options is None:
-            # No data is registered for this plugin (for this step).
-            options = self.get_default_options()
-            app.protocol.current_step().set_data(self.name, options)
+            options = self._set_default_options(step_number)
+        return options
+
+    def edit_step_options(self, step_number=None):
+        """
+        Return the DmfDeviceOptions object for a step in the protocol (by
+        default, the current step), which may be modified in place (e.g.,
+        `state_of_channels`), since it is not shared with copies of the step
+        (see `Step.edit_data()`).  Call `Protocol.record_step_data()` after
+        modifying it.
+        """
+        app = get_app()
+        if step_number is None:
+            step_number = app.protocol.current_step_number
+        options = app.protocol.steps[step_number].edit_data(self.name)
+        if options is None:
+            options = self._set_default_options(step_number)
+        return options
+
+    def _set_default_options(self, step_number):
+        # No data is registered for this plugin (for this step).
+        options = self.get_default_options()
+        get_app().protocol.set_step_data(step_number, self.name, options)
         return options
 
     def load_device(self, filename):
@@ -468,6 +493,9 @@ directory)?''' % (device_directory, self.previous_device_dir))
         app = get_app()
         if not app.dmf_device:
             return
+        # The options were modified in place (see `edit_step_options()`).
+        app.protocol.record_step_data(app.protocol.current_step_number,
+                                      self.name)
         emit_signal('on_step_options_changed',
                     [self.name, app.protocol.current_step_number],
                     interface=IPlugin)
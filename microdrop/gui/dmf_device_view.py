@@ -80,17 +80,22 @@ class ElectrodeContextMenu(SlaveView):
                 if channels and max(channels) >= len(state):
                     # zero-pad channel states for all steps
                     for i in range(len(app.protocol)):
-                        options = self.model.controller.get_step_options(i)
+                        options = self.model.controller.edit_step_options(i)
                         options.state_of_channels = \
                             np.concatenate([options.state_of_channels, \
                                 np.zeros(max(channels) - \
                                 len(options.state_of_channels)+1, int)])
                         # don't emit signal for current step, we will do that after
                         if i != app.protocol.current_step_number:
+                            app.protocol.record_step_data(
+                                i, self.model.controller.name)
                             emit_signal('on_step_options_changed',
                                         [self.model.controller.name, i],
                                         interface=IPlugin)
                 self.last_electrode_clicked.channels = channels
+                app.protocol.record_step_data(
+                    app.protocol.current_step_number,
+                    self.model.controller.name)
                 emit_signal('on_step_options_changed',
                             [self.model.controller.name,
                              app.protocol.current_step_number],
@@ -317,9 +322,10 @@ class DmfDeviceView(GtkVideoView):
         return True
 
     def on_electrode_click(self, electrode, event):
-        options = self.controller.get_step_options()
-        state = options.state_of_channels
         if event.button == 1:
+            # The channel states are modified in place (the change is recorded
+            # by the 'channel-state-changed' handler).
+            state = self.controller.edit_step_options().state_of_channels
             if len(electrode.channels):
                 for channel in electrode.channels:
                     if state[channel] > 0:
@@ -330,6 +336,7 @@ class DmfDeviceView(GtkVideoView):
             else:
                 logger.error("No channel assigned to electrode.")
         elif event.button == 3:
+            state = self.controller.get_step_options().state_of_channels
             self.popup.popup(state, electrode, event.button, event.time,
                     register_enabled=self.controller.video_enabled)
         return True
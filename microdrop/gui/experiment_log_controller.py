@@ -23,7 +23,7 @@ import pkg_resources
 
 import gtk
 from path_helpers import path
-from flatland import Form
+from flatland import Form, Boolean
 from pygtkhelpers.delegates import SlaveView
 from pygtkhelpers.ui.notebook import NotebookManagerView
 from pygtkhelpers.ui.extra_widgets import Directory
@@ -32,10 +32,13 @@ from microdrop_utility import copytree
 from microdrop_utility.gui import (combobox_set_model_from_list,
                                    combobox_get_active_text, textview_get_text)
 
-from ..experiment_log import ExperimentLog
+from ..experiment_log import ExperimentLog, is_segment
+from ..signal_trace import SignalTraceWriter
 from ..plugin_manager import (IPlugin, SingletonPlugin, implements,
                               PluginGlobals, emit_signal, ScheduleRequest,
-                              get_service_names, get_service_instance_by_name)
+                              get_service_names, get_service_instance_by_name,
+                              get_profiler, enable_signal_recording,
+                              disable_signal_recording)
 from ..plugin_helpers import AppDataController
 from ..protocol import Protocol
 from ..dmf_device import DmfDevice
@@ -83,6 +86,8 @@ class ExperimentLogController(SingletonPlugin, AppDataController):
     def AppFields(self):
         return Form.of(
             Directory.named('notebook_directory').using(default='', optional=True),
+            Boolean.named('record_signal_trace').using(default=False,
+                                                       optional=True),
         )
 
     def __init__(self):
@@ -218,7 +223,7 @@ directory)?''' % (notebook_directory, self.previous_notebook_dir))
             self.builder.get_object("textview_notes").set_sensitive(True)
 
             label = "Software version: "
-            data = self.results.log.get("software version")
+            data = self.results.log.get_values("software version")
             for val in data:
                 if val:
                     label += val
@@ -226,14 +231,14 @@ directory)?''' % (notebook_directory, self.previous_notebook_dir))
                 set_text(label)
 
             label = "Device: "
-            data = self.results.log.get("device name")
+            data = self.results.log.get_values("device name")
             for val in data:
                 if val:
                     label += val
             self.builder.get_object("label_device"). \
                 set_text(label)
 
-            data = self.results.log.get("protocol name")
+            data = self.results.log.get_values("protocol name")
 
             label = "Protocol: None"
             for val in data:
@@ -244,24 +249,26 @@ directory)?''' % (notebook_directory, self.previous_notebook_dir))
                 set_text(label)
 
             label = "Control board: "
-            data = self.results.log.get("control board name")
+            data = self.results.log.get_values("control board name")
             for val in data:
                 if val:
                     label += val
-            data = self.results.log.get("control board hardware version")
+            data = self.results.log.get_values(
+                "control board hardware version")
             for val in data:
                 if val:
                     label += " v%s" % val
             serial_number = ""
-            data = self.results.log.get("control board serial number")
+            data = self.results.log.get_values("control board serial number")
             for val in data:
                 if val:
                     serial_number = ", S/N %03d" % val
-            data = self.results.log.get("control board software version")
+            data = self.results.log.get_values(
+                "control board software version")
             for val in data:
                 if val:
                     label += "\n\t(Firmware: %s%s)" % (val, serial_number)
-            data = self.results.log.get("i2c devices")
+            data = self.results.log.get_values("i2c devices")
             for val in data:
                 if val:
                     label += "\ni2c devices:"
@@ -271,7 +278,7 @@ directory)?''' % (notebook_directory, self.previous_notebook_dir))
                 set_text(label)
 
             label = "Enabled plugins: "
-            data = self.results.log.get("plugins")
+            data = self.results.log.get_values("plugins")
             for val in data:
                 if val:
                     for k, v in val.iteritems():
@@ -281,7 +288,7 @@ directory)?''' % (notebook_directory, self.previous_notebook_dir))
                 set_text(label)
 
             label = "Time of experiment: "
-            data = self.results.log.get("start time")
+            data = self.results.log.get_values("start time")
             for val in data:
                 if val:
                     label += time.ctime(val)
@@ -289,7 +296,7 @@ directory)?''' % (notebook_directory, self.previous_notebook_dir))
                 set_text(label)
 
             label = ""
-            data = self.results.log.get("notes")
+            data = self.results.log.get_values("notes")
             for val in data:
                 if val:
                     label = val
@@ -348,9 +355,7 @@ directory)?''' % (notebook_directory, self.previous_notebook_dir))
 
         # Only save the current log if it is not empty (i.e., it contains at
         # least one step).
-        if app.experiment_log and len([x for x in
-                                       app.experiment_log.get('step')
-                                       if x is not None]):
+        if app.experiment_log and app.experiment_log.get_values('step'):
             data = {"software version": app.version}
             data["device name"] = app.dmf_device.name
             data["protocol name"] = app.protocol.name
@@ -369,8 +374,14 @@ directory)?''' % (notebook_directory, self.previous_notebook_dir))
             app.protocol.save(os.path.join(log_path,"protocol"))
             app.dmf_device.save(os.path.join(log_path,"device"))
 
+            # save the signal latency report (if profiling is enabled)
+            profiler = get_profiler()
+            if profiler is not None:
+                profiler.save(os.path.join(log_path, "signal_profile.txt"))
+
             # create a new log
-            experiment_log = ExperimentLog(app.experiment_log.directory)
+            experiment_log = ExperimentLog(app.experiment_log.directory,
+                                           stream=True)
             emit_signal("on_experiment_log_changed", experiment_log)
 
     def get_selected_data(self):
@@ -415,25 +426,56 @@ directory)?''' % (notebook_directory, self.previous_notebook_dir))
         app.protocol_controller.load_protocol(filename)
 
     def on_textview_notes_focus_out_event(self, widget, data=None):
-        if len(self.results.log.data[0])==0:
-            self.results.log.data.append({})
-        self.results.log.data[-1]['core']['notes'] = \
-            textview_get_text(self.builder.get_object("textview_notes"))
+        notes = textview_get_text(self.builder.get_object("textview_notes"))
         filename = os.path.join(self.results.log.directory,
                                 str(self.results.log.experiment_id),
                                 'data')
+        if is_segment(filename):
+            # Append the notes to the log, rather than rewriting it.
+            self.results.log.open_segment(filename)
+            self.results.log.add_data({'notes': notes})
+            self.results.log.close_segment()
+            return
+        self.results.log.add_data({'notes': notes})
         self.results.log.save(filename)
 
+    def start_signal_trace(self):
+        """
+        Record all signals emitted during the protocol run to a trace file in
+        the current experiment log directory (see
+        `microdrop.bin.replay_signals`).
+        """
+        app = get_app()
+        self.stop_signal_trace()
+        if not (app.experiment_log and app.experiment_log.directory):
+            return
+        trace_path = os.path.join(app.experiment_log.get_log_path(),
+                                  "signal_trace.bin")
+        logger.info('[ExperimentLogController] recording signals to %s' %
+                    trace_path)
+        enable_signal_recording(SignalTraceWriter(trace_path,
+                                                  exclude_interfaces=
+                                                  ['ILoggingPlugin']))
+
+    def stop_signal_trace(self):
+        recorder = disable_signal_recording()
+        if recorder is not None:
+            recorder.close()
+
     def on_protocol_run(self):
         self.save()
+        if self.get_app_value('record_signal_trace'):
+            self.start_signal_trace()
 
     def on_app_exit(self):
+        self.stop_signal_trace()
         self.save()
         logger.info('[ExperimentLogController] Killing IPython notebooks')
         if self.notebook_manager_view is not None:
             self.notebook_manager_view.stop()
 
     def on_protocol_pause(self):
+        self.stop_signal_trace()
         self.save()
 
     def on_dmf_device_swapped(self, old_dmf_device, dmf_device):
@@ -442,7 +484,7 @@ directory)?''' % (notebook_directory, self.previous_notebook_dir))
         if dmf_device and dmf_device.name:
             device_path = os.path.join(app.get_device_directory(),
                                        dmf_device.name, "logs")
-            experiment_log = ExperimentLog(device_path)
+            experiment_log = ExperimentLog(device_path, stream=True)
         emit_signal("on_experiment_log_changed", experiment_log)
 
     def on_experiment_log_changed(self, experiment_log):
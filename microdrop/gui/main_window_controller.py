@@ -36,7 +36,7 @@ from ..plugin_manager import (IPlugin, SingletonPlugin, implements,
                               PluginGlobals, ScheduleRequest, ILoggingPlugin,
                               emit_signal, get_service_instance_by_name)
 from ..app_context import get_app
-from ..logger import logger
+from ..logger import logger, WARNING
 from .. import glade_path
 
 
@@ -49,6 +49,8 @@ class MainWindowController(SingletonPlugin):
     implements(ILoggingPlugin)
 
     builder_path = glade_path().joinpath("main_window.glade")
+    # Only warnings and errors are shown (see `ILoggingPlugin`).
+    log_level = WARNING
 
     def __init__(self):
         self._shutting_down_latch = False
@@ -41,19 +41,28 @@ from ..plugin_helpers import get_plugin_info
 from ..plugin_manager import (IPlugin, implements, SingletonPlugin,
                               PluginGlobals, get_service_instance,
                               get_plugin_package_name, enable as
-                              enable_service, disable as disable_service)
+                              enable_service, disable as disable_service,
+                              get_plugin_manifest, import_plugin,
+                              get_service_instance_by_package_name)
 from ..gui.plugin_manager_dialog import PluginManagerDialog
 
 
 class PluginController(object):
-    def __init__(self, controller, name):
+    def __init__(self, controller, package_name):
         self.controller = controller
-        self.name = name
+        self.package_name = package_name
         self.e = PluginGlobals.env('microdrop.managed')
-        self.plugin_class = self.e.plugin_registry[name]
-        self.service = get_service_instance(self.plugin_class)
+        # The plugin class and service are `None` until the plugin package has
+        # been imported (see `plugin_manager.import_plugin`).
+        self.plugin_class = None
+        self.service = None
+        self._load_service()
         self.box = gtk.HBox()
-        self.label = gtk.Label('%s' % self.service.name)
+        if self.service is not None:
+            label = self.service.name
+        else:
+            label = self._manifest_info().plugin_name
+        self.label = gtk.Label('%s' % label)
         self.label.set_alignment(0, 0.5)
         self.label_version = gtk.Label(str(self.version))
         self.label_version.set_alignment(0, 0.5)
@@ -75,15 +84,38 @@ class PluginController(object):
         self.update()
         self.box.show_all()
 
+    def _manifest_info(self):
+        return get_plugin_manifest()[self.package_name].info
+
+    def _load_service(self):
+        for class_ in self.e.plugin_registry.values():
+            if get_plugin_package_name(class_.__module__) == \
+                    self.package_name:
+                self.plugin_class = class_
+                self.service = get_service_instance(class_)
+                return
+        try:
+            # Plugin may be hosted in a separate process (see `plugin_host`).
+            self.service = get_service_instance_by_package_name(
+                self.package_name)
+            self.plugin_class = self.service.__class__
+        except KeyError:
+            pass
+
     @property
     def version(self):
+        if self.service is not None:
+            return getattr(self.service, 'version', None)
+        elif self.plugin_class is None:
+            return self._manifest_info().version
         return getattr(self.plugin_class, 'version', None)
 
     def enabled(self):
         return not(self.service is None or not self.service.enabled())
 
     def update(self):
-        self.service = get_service_instance(self.plugin_class)
+        if self.service is None:
+            self._load_service()
         if self.enabled():
             self.button.set_label('Disable')
         else:
@@ -91,6 +123,14 @@ class PluginController(object):
 
     def toggle_enabled(self):
         if not self.enabled():
+            if self.service is None:
+                # Plugin was not imported at startup.
+                import_plugin(self.package_name)
+                self._load_service()
+                if self.service is None:
+                    logging.error('Could not load %s plugin.' %
+                                  self.package_name)
+                    return
             enable_service(self.service.name)
         else:
             disable_service(self.service.name)
@@ -135,7 +175,7 @@ class PluginController(object):
         return get_plugin_info(self.get_plugin_path())
 
     def get_plugin_package_name(self):
-        return get_plugin_package_name(self.plugin_class.__module__)
+        return self.package_name
 
     def get_plugin_path(self, packge_name=None):
         if packge_name is None:
@@ -215,12 +255,29 @@ class PluginManagerController(SingletonPlugin):
     def get_plugin_names(self):
         return list(self.e.plugin_registry.keys())
 
+    def get_plugin_package_names(self):
+        """
+        Returns the package names of all installed plugins, including plugins
+        that have not been imported.
+        """
+        package_names = []
+        for class_ in self.e.plugin_registry.values():
+            package_name = get_plugin_package_name(class_.__module__)
+            if package_name not in package_names:
+                package_names.append(package_name)
+        for package_name, entry in get_plugin_manifest().items():
+            # Plugins without valid properties can only be listed if they
+            # were imported.
+            if package_name not in package_names and entry.info is not None:
+                package_names.append(package_name)
+        return package_names
+
     def update(self):
-        plugin_names = self.get_plugin_names()
+        package_names = self.get_plugin_package_names()
         del self.plugins
         self.plugins = []
-        for name in plugin_names:
-            p = PluginController(self, name)
+        for package_name in package_names:
+            p = PluginController(self, package_name)
             # Skip the plugin if it has been marked for uninstall, or no
             # longer exists
             if p.get_plugin_path().abspath() in self.requested_deletions\
@@ -22,19 +22,32 @@ import logging
 import shutil
 
 import gtk
+import gobject
 from textbuffer_with_undo import UndoableBuffer
 from microdrop_utility import is_float, is_int, FutureVersionError
 from microdrop_utility.gui import (yesno, contains_pointer, register_shortcuts,
                                    textentry_validate, text_entry_dialog)
 
 from ..protocol import Protocol
+from ..protocol_container import is_container, read_header
+from ..protocol_journal import journal_paths
+from ..execution_plan import ExecutionPlan
 from ..plugin_manager import (ExtensionPoint, IPlugin, SingletonPlugin,
                               implements, PluginGlobals, ScheduleRequest,
                               emit_signal, get_service_class,
-                              get_service_instance,
-                              get_service_instance_by_name, get_observers,
-                              get_service_names)
+                              get_service_instance, get_dispatch,
+                              get_service_names, coalesce_call,
+                              flush_coalesced_signals,
+                              get_installed_plugin_names)
 from ..app_context import get_app
+from ..trampoline import Trampoline
+
+
+# Interval (in seconds) between checks of the size of the protocol journal.
+AUTOSAVE_INTERVAL = 10
+# Size (in bytes) of the protocol journal above which the protocol is saved
+# (and a new journal is started).
+JOURNAL_COMPACT_SIZE = 4 << 20
 
 
 PluginGlobals.push_env('microdrop')
@@ -57,6 +70,15 @@ class ProtocolController(SingletonPlugin):
         self.button_last_step = None
         self.textentry_protocol_repeats = None
         self._modified = False
+        # Advance steps through a trampoline, since plugins may call
+        # `on_step_complete` from within `on_step_run`.
+        self.step_trampoline = Trampoline()
+        # Thread writing the protocol file (see `save_protocol`).
+        self._save_thread = None
+        # Execution plan of the protocol run (see `get_plan`).
+        self._plan = None
+        # Plan entry of the step being run.
+        self.plan_entry = None
 
     @property
     def modified(self):
@@ -88,10 +110,46 @@ class ProtocolController(SingletonPlugin):
         register_shortcuts(view, notes_shortcuts,
                     enabled_widgets=[self.textentry_notes])
 
+    def _get_protocol_format(self):
+        # Protocol files are only saved in the container format if it is
+        # selected in the application options, since previous versions can
+        # not open them.
+        return get_app().get_app_value('protocol_format')
+
+    def _ask_clear_plugins(self, filename, name, plugins):
+        '''
+        Returns the names of the plugins (in `plugins`) that are not installed
+        and whose data the user chose to clear from the protocol.
+        '''
+        enabled_plugins = get_installed_plugin_names() + \
+            get_service_names('microdrop')
+        missing_plugins = sorted(set(plugins) - set(enabled_plugins))
+        if not missing_plugins:
+            return []
+        logging.info('load protocol(%s): missing plugins: %s' %
+                     (filename, ", ".join(missing_plugins)))
+        result = yesno('Some data in the protocol "%s" requires '
+                       'plugins that are not currently installed:'
+                       '\n\t%s\nThis data will be ignored unless you '
+                       'install and enable these plugins. Would you'
+                       'like to permanently clear this data from the '
+                       'protocol?' % (name, ",\n\t".join(missing_plugins)))
+        if result == gtk.RESPONSE_YES:
+            return missing_plugins
+        return []
+
     def load_protocol(self, filename):
         app = get_app()
         p = None
+        clear_plugins = None
         try:
+            if is_container(filename):
+                # The plugins with data in the protocol are listed in the
+                # header, so they are checked before the protocol is loaded.
+                header = read_header(filename)
+                clear_plugins = self._ask_clear_plugins(filename,
+                                                        header['name'],
+                                                        header['plugins'])
             p = Protocol.load(filename)
         except FutureVersionError, why:
             logging.error('''\
@@ -103,38 +161,25 @@ Protocol is version %s, but only up to version %s is supported with this version
         except Exception, why:
             logging.error("Could not open %s. %s" % (filename, why))
         if p:
-            # check if the protocol contains data from plugins that are not
-            # enabled
-            enabled_plugins = get_service_names(env='microdrop.managed') + \
-                get_service_names('microdrop')
-            missing_plugins = []
-            for k, v in p.plugin_data.items():
-                if k not in enabled_plugins and k not in missing_plugins:
-                    missing_plugins.append(k)
-            for i in range(len(p)):
-                for k, v in p[i].plugin_data.items():
-                    if k not in enabled_plugins and k not in missing_plugins:
-                        missing_plugins.append(k)
-            if missing_plugins:
-                logging.info('load protocol(%s): missing plugins: %s' %
-                             (filename, ", ".join(missing_plugins)))
-                result = yesno('Some data in the protocol "%s" requires '
-                               'plugins that are not currently installed:'
-                               '\n\t%s\nThis data will be ignored unless you '
-                               'install and enable these plugins. Would you'
-                               'like to permanently clear this data from the '
-                               'protocol?' % (p.name,
-                                            ",\n\t".join(missing_plugins)))
-                if result == gtk.RESPONSE_YES:
-                    logging.info('Deleting protocol data for missing items')
-                    for k, v in p.plugin_data.items():
-                        if k in missing_plugins:
-                            del p.plugin_data[k]
-                    for i in range(len(p)):
-                        for k, v in p[i].plugin_data.items():
-                            if k in missing_plugins:
-                                del p[i].plugin_data[k]
-                    self.save_protocol()
+            if clear_plugins is None:
+                # check if the protocol contains data from plugins that are
+                # not installed (step data is not decoded to find the plugins
+                # it refers to)
+                clear_plugins = self._ask_clear_plugins(
+                    filename, p.name, p.get_referenced_plugins())
+            if clear_plugins:
+                logging.info('Deleting protocol data for missing items')
+                for k, v in p.plugin_data.items():
+                    if k in clear_plugins:
+                        del p.plugin_data[k]
+                for step in p.steps:
+                    for k in clear_plugins:
+                        step.remove_data(k)
+                self.save_protocol()
+            # Record edits in a journal next to the protocol file (edits
+            # recorded before the application last exited have been applied).
+            self._save_thread = p.open_journal(
+                filename, format=self._get_protocol_format())
             self.modified = False
             emit_signal("on_protocol_swapped", [app.protocol, p])
 
@@ -145,6 +190,9 @@ Protocol is version %s, but only up to version %s is supported with this version
         emit_signal("on_protocol_swapped", [old_protocol, p])
 
     def on_protocol_swapped(self, old_protocol, protocol):
+        if old_protocol is not None:
+            old_protocol.close_journal()
+        self.invalidate_plan()
         protocol.plugin_fields = emit_signal('get_step_fields')
         logging.debug('[ProtocolController] on_protocol_swapped(): plugin_fields=%s' % protocol.plugin_fields)
         protocol.first_step()
@@ -189,6 +237,7 @@ Protocol is version %s, but only up to version %s is supported with this version
                 self.on_textentry_protocol_repeats_key_press
         app.protocol_controller = self
         self._register_shortcuts()
+        gobject.timeout_add_seconds(AUTOSAVE_INTERVAL, self._autosave)
 
         self.menu_protocol.set_sensitive(False)
         self.menu_new_protocol.set_sensitive(False)
@@ -280,18 +329,44 @@ Protocol is version %s, but only up to version %s is supported with this version
     def on_protocol_repeats_changed(self):
         app = get_app()
         if app.protocol:
-            app.protocol.n_repeats = \
-                textentry_validate(self.textentry_protocol_repeats,
-                    app.protocol.n_repeats,
-                    int)
+            n_repeats = textentry_validate(self.textentry_protocol_repeats,
+                                           app.protocol.n_repeats, int)
+            if n_repeats != app.protocol.n_repeats:
+                app.protocol.set_n_repeats(n_repeats)
+                self.invalidate_plan()
+
+    def _autosave(self):
+        '''
+        Save the protocol in the background if its journal is large, so
+        loading the protocol does not have to apply too many edits.
+        '''
+        app = get_app()
+        if app.protocol is not None and app.protocol.journal is not None \
+                and app.protocol.journal.size > JOURNAL_COMPACT_SIZE and \
+                (self._save_thread is None or
+                 not self._save_thread.is_alive()):
+            logging.info('[ProtocolController] Saving protocol %s' %
+                         app.protocol.name)
+            self._save_thread = app.protocol.compact_journal(
+                app.protocol.filename, background=True,
+                format=self._get_protocol_format())
+        # Keep checking.
+        return True
 
     def save_check(self):
         app = get_app()
+        # Process any pending step option changes before checking whether the
+        # protocol has been modified.
+        flush_coalesced_signals()
         if self.modified:
             result = yesno('Protocol %s has unsaved changes.  Save now?'\
                     % app.protocol.name)
             if result == gtk.RESPONSE_YES:
                 self.save_protocol()
+            elif app.protocol.journal is not None:
+                # Do not apply the unsaved edits when the protocol is next
+                # loaded.
+                app.protocol.discard_journal()
 
     def save_protocol(self, save_as=False, rename=False):
         app = get_app()
@@ -321,22 +396,73 @@ Protocol is version %s, but only up to version %s is supported with this version
                 if name != app.protocol.name:
                     app.protocol.name = name
 
+                # wait for a previous save to finish writing its file
+                self.wait_for_save()
                 # if we're renaming
                 if rename and os.path.isfile(src):
+                    # Move the journal of the protocol file along with it.
+                    app.protocol.close_journal()
                     shutil.move(src, dest)
+                    for src_journal, dest_journal in \
+                            zip(journal_paths(src), journal_paths(dest)):
+                        if src_journal.isfile():
+                            shutil.move(src_journal, dest_journal)
+                    app.protocol.open_journal(
+                        dest, format=self._get_protocol_format())
                 else: # save the file
-                    app.protocol.save(dest)
+                    # Write the file in the background, so saving a large
+                    # protocol does not block the UI.  Further edits are
+                    # recorded in a new journal.
+                    self._save_thread = app.protocol.compact_journal(
+                        dest, background=True,
+                        format=self._get_protocol_format())
                 self.modified = False
                 emit_signal("on_protocol_changed")
 
+    def wait_for_save(self):
+        '''
+        Wait until the protocol file being written (if any) is saved.
+        '''
+        if self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
+
+    def get_plan(self):
+        '''
+        Returns the execution plan of the current protocol, compiling it if
+        necessary.
+        '''
+        app = get_app()
+        if self._plan is None or self._plan.protocol is not app.protocol:
+            step_run_plugins = [observer.name for observer, f in
+                                get_dispatch("on_step_run", IPlugin)
+                                if observer.enabled()]
+            self._plan = ExecutionPlan(app.protocol, step_run_plugins)
+        return self._plan
+
+    def invalidate_plan(self):
+        '''
+        Discard the execution plan (e.g., when the protocol changes).  A new
+        plan is compiled when it is next needed.
+        '''
+        self._plan = None
+
+    def _set_plan_entry(self):
+        app = get_app()
+        plan = self.get_plan()
+        self.plan_entry = plan[plan.index(app.protocol.current_step_number,
+                                          app.protocol.current_repetition)]
+
     def run_protocol(self):
         app = get_app()
         app.running = True
         self.button_run_protocol.set_image(self.builder.get_object(
             "image_pause"))
         app.protocol.current_step_attempt = 0
+        # Compile the plan before the first step is run.
+        self._set_plan_entry()
         emit_signal("on_protocol_run")
-        self.run_step()
+        self.step_trampoline.call(self.run_step)
 
     def pause_protocol(self):
         app = get_app()
@@ -354,7 +480,13 @@ Protocol is version %s, but only up to version %s is supported with this version
                 app.experiment_log.add_step(app.protocol.current_step_number,
                                             app.protocol.current_step_attempt)
 
-            self.waiting_for = get_observers("on_step_run", IPlugin).keys()
+            if app.running:
+                self._set_plan_entry()
+                self.waiting_for = list(self.get_plan().step_run_plugins)
+            else:
+                self.waiting_for = [observer.name for observer, f in
+                                    get_dispatch("on_step_run", IPlugin)
+                                    if observer.enabled()]
             logging.info("[ProcolController.run_step]: waiting for %s" %
                           ", ".join(self.waiting_for))
             emit_signal("on_step_run")
@@ -380,33 +512,54 @@ Protocol is version %s, but only up to version %s is supported with this version
                           "for %s" % ", ".join(self.waiting_for))
         # if all plugins have completed the current step, go to the next step
         elif app.running:
+            self.step_trampoline.call(self._advance_step)
+
+    def _advance_step(self):
+        app = get_app()
+        if app.running:
             if self.repeat_step:
                 app.protocol.current_step_attempt += 1
                 self.run_step()
             else:
                 app.protocol.current_step_attempt = 0
-                if app.protocol.current_step_number < len(app.protocol)-1:
-                    self.on_next_step()
-                elif app.protocol.current_repetition < app.protocol.n_repeats-1:
-                    app.protocol.next_repetition()
+                plan = self.get_plan()
+                index = plan.index(app.protocol.current_step_number,
+                                   app.protocol.current_repetition) + 1
+                if index < len(plan):
+                    entry = plan[index]
+                    app.protocol.current_repetition = entry.repetition
+                    # Runs the step (see `on_step_swapped`).
+                    app.protocol.goto_step(entry.step_number,
+                                           plugins=entry.plugins)
                 else: # we're on the last step
                     self.pause_protocol()
 
-    def _get_dmf_control_fields(self, step_number):
-        step = get_app().protocol.get_step(step_number)
-        dmf_plugin_name = step.plugin_name_lookup(
-            r'wheelerlab.dmf_control_board_', re_pattern=True)
-        service = get_service_instance_by_name(dmf_plugin_name)
-        if service:
-            return service.get_step_values(step_number)
-        return None
-
     def on_step_options_changed(self, plugin, step_number):
         logging.debug('[ProtocolController.on_step_options_changed] plugin=%s, '
                       'step_number=%s' % (plugin, step_number))
         self.modified = True
+        if self._plan is not None:
+            # Only the step needs to be updated in the plan.
+            app = get_app()
+            if 0 <= step_number < self._plan.n_steps:
+                self._plan.update_step(step_number,
+                                       app.protocol.steps[step_number])
         emit_signal('on_protocol_changed')
-        self.run_step()
+        # Bulk edits (e.g., pasting steps) change the options of many steps
+        # at once, so only re-run the step once all changes are processed.
+        coalesce_call('run_step', self.run_step)
+
+    def on_steps_inserted(self, step_number, count):
+        self.invalidate_plan()
+
+    def on_steps_removed(self, step_numbers, steps):
+        self.invalidate_plan()
+
+    def on_plugin_enabled(self, env, plugin):
+        self.invalidate_plan()
+
+    def on_plugin_disabled(self, env, plugin):
+        self.invalidate_plan()
 
     def set_app_values(self, values_dict):
         logging.debug('[ProtocolController] set_app_values(): '\
@@ -451,11 +604,10 @@ Protocol is version %s, but only up to version %s is supported with this version
 
     def on_app_exit(self):
         app = get_app()
-        if self.modified:
-            result = yesno('Protocol %s has unsaved changes.  Save now?'\
-                    % app.protocol.name)
-            if result == gtk.RESPONSE_YES:
-                self.save_protocol()
+        self.save_check()
+        self.wait_for_save()
+        if app.protocol is not None:
+            app.protocol.close_journal()
 
     def get_schedule_requests(self, function_name):
         """
@@ -25,10 +25,11 @@ from pygtkhelpers.ui.objectlist.combined_fields import (CombinedFields,
                                                         CombinedRow, RowFields)
 from microdrop_utility.gui import register_shortcuts
 
-from microdrop.plugin_manager import (ExtensionPoint, IPlugin, SingletonPlugin,
-                                      implements, PluginGlobals,
-                                      ScheduleRequest, emit_signal)
+from microdrop.plugin_manager import (IPlugin, SingletonPlugin, implements,
+                                      PluginGlobals, ScheduleRequest,
+                                      emit_signal, get_enabled_service)
 from microdrop.app_context import get_app
+from microdrop.event_log import record_event
 
 
 class ProtocolGridView(CombinedFields):
@@ -40,9 +41,8 @@ class ProtocolGridView(CombinedFields):
         self.connect('selection-changed', self.on_selection_changed)
 
     def _on_step_options_changed(self, form_name, step_number):
-        observers = ExtensionPoint(IPlugin)
         # Get the instance of the specified plugin
-        service = observers.service(form_name)
+        service = get_enabled_service(form_name)
         if hasattr(service, 'get_step_values'):
             # Get the step option values from the plugin instance
             attrs = service.get_step_values(step_number=step_number)
@@ -120,8 +120,7 @@ class ProtocolGridView(CombinedFields):
             field_set_prefix = self.field_set_prefix % uuid_code
             if field_name.startswith(field_set_prefix):
                 form_step = row.get_row_fields(form_name)
-                observers = ExtensionPoint(IPlugin)
-                service = observers.service(form_name)
+                service = get_enabled_service(form_name)
                 try:
                     service.set_step_values(form_step.attrs,
                                             step_number=row_id)
@@ -135,8 +134,7 @@ class ProtocolGridView(CombinedFields):
                 field_set_prefix = self.field_set_prefix % uuid_code
                 if attr.startswith(field_set_prefix):
                     form_step = step.get_row_fields(form_name)
-                    observers = ExtensionPoint(IPlugin)
-                    service = observers.service(form_name)
+                    service = get_enabled_service(form_name)
                     service.set_step_values(form_step.attrs,
                                             step_number=step_number)
 
@@ -212,14 +210,12 @@ class ProtocolGridController(SingletonPlugin):
             protocol = app.protocol
         if protocol is None:
             return
-        logging.debug('[ProtocolGridController].update_grid:')
-        logging.debug('[ProtocolGridController]   plugin_fields=%s',
-                      protocol.plugin_fields)
         forms = emit_signal('get_step_form_class')
 
         steps = protocol.steps
-        logging.debug('[ProtocolGridController]   forms=%s steps=%s', forms,
-                      steps)
+        record_event('protocol_grid.update_grid', n_steps=len(steps),
+                     plugin_fields=dict(protocol.plugin_fields),
+                     forms=forms)
 
         if self.enabled_fields is None:
             # Assign directly to _enabled_fields to avoid recursive call into
@@ -237,13 +233,10 @@ class ProtocolGridController(SingletonPlugin):
 
         for i, step in enumerate(steps):
             values = emit_signal('get_step_values', [i])
-            logging.debug('[ProtocolGridController]   Step[%d]=%s values=%s',
-                          i, step, values)
 
             attributes = dict()
             for form_name, form in combined_fields.forms.iteritems():
                 attr_values = values[form_name]
-                logging.debug('[CombinedRow] attr_values=%s' % attr_values)
                 attributes[form_name] = RowFields(**attr_values)
             c = CombinedRow(combined_fields, attributes=attributes)
             combined_fields.append(c)
@@ -299,9 +292,9 @@ class ProtocolGridController(SingletonPlugin):
             return [ScheduleRequest('microdrop.app', self.name)]
         return []
 
-    def on_step_created(self, step_number):
-        logging.debug('[ProtocolGridController] on_step_created[%d]',
-                      step_number)
+    def on_steps_inserted(self, step_number, count):
+        logging.debug('[ProtocolGridController] on_steps_inserted[%d:%d]',
+                      step_number, step_number + count)
         self.update_grid()
 
     def on_step_swapped(self, original_step_number, step_number):
@@ -310,9 +303,9 @@ class ProtocolGridController(SingletonPlugin):
         if self.widget:
             self.widget.select_row(get_app().protocol.current_step_number)
 
-    def on_step_removed(self, step_number, step):
-        logging.debug('[ProtocolGridController] on_step_removed[%d]',
-                      step_number)
+    def on_steps_removed(self, step_numbers, steps):
+        logging.debug('[ProtocolGridController] on_steps_removed[%d steps]',
+                      len(step_numbers))
         self.update_grid()
 
 
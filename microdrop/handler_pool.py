@@ -0,0 +1,101 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys
+import threading
+from Queue import Queue
+
+
+class PendingCall(object):
+    '''
+    Result of a call submitted to a `HandlerPool`.
+    '''
+    def __init__(self, f, args):
+        self.f = f
+        self.args = args
+        self.result = None
+        self.exc_info = None
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            self.result = self.f(*self.args)
+        except Exception:
+            self.exc_info = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def wait(self):
+        '''
+        Block until the call has completed.  Re-raise the exception raised by
+        the call, if any; otherwise, return the call's result.
+        '''
+        # Wait in short intervals, since `Event.wait()` without a timeout is
+        # not interruptible (e.g., by `KeyboardInterrupt`) in Python 2.
+        while not self._done.wait(0.1):
+            pass
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+
+class HandlerPool(object):
+    '''
+    Fixed-size pool of daemon worker threads.
+
+    Worker threads are started lazily, on the first call to `submit()`.
+
+    Calls must not wait for calls submitted from a worker thread, since all
+    workers may be waiting (see `in_worker()`).
+    '''
+    def __init__(self, n_workers=4):
+        self.n_workers = n_workers
+        self._queue = Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def in_worker(self):
+        '''
+        Returns `True` if called from one of the pool's worker threads.
+        '''
+        return getattr(self._local, 'worker', False)
+
+    def _start(self):
+        with self._lock:
+            while len(self._workers) < self.n_workers:
+                worker = threading.Thread(target=self._work,
+                                          name='HandlerPool-%d' %
+                                          len(self._workers))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        self._local.worker = True
+        while True:
+            call = self._queue.get()
+            call.run()
+
+    def submit(self, f, *args):
+        if len(self._workers) < self.n_workers:
+            self._start()
+        call = PendingCall(f, args)
+        self._queue.put(call)
+        return call
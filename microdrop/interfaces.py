@@ -23,6 +23,11 @@ if 'ILoggingPlugin' in PluginGlobals.interface_registry:
     ILoggingPlugin = PluginGlobals.interface_registry['ILoggingPlugin']
 else:
     class ILoggingPlugin(Interface):
+        """
+        Plugins may define a `log_level` attribute (e.g., `logging.WARNING`)
+        to only receive records at or above that level.  By default, records
+        of all levels are delivered.
+        """
         def on_debug(self, record):
             pass
 
@@ -236,6 +241,11 @@ else:
                 None
                 'Repeat' - repeat the step
                 or 'Fail' - unrecoverable error (stop the protocol)
+
+            Plugins that block while handling this signal (e.g., waiting on
+            a serial link) may list 'on_step_run' in a `concurrent_signals`
+            class attribute to have it handled on a worker thread (see
+            `plugin_manager.is_concurrent`).
             """
             pass
 
@@ -251,6 +261,44 @@ else:
             pass
 
         def on_step_created(self, step_number):
+            """
+            Handler called when a step is inserted in the protocol.
+
+            Note that this signal is only sent to plugins that do not handle
+            `on_steps_inserted`.
+            """
+            pass
+
+        def on_steps_inserted(self, step_number, count):
+            """
+            Handler called once when one or more steps are inserted in the
+            protocol.
+
+            Parameters:
+                step_number : index of the first inserted step
+                count : number of inserted steps
+            """
+            pass
+
+        def on_step_removed(self, step_number, step):
+            """
+            Handler called when a step is removed from the protocol.
+
+            Note that this signal is only sent to plugins that do not handle
+            `on_steps_removed`.
+            """
+            pass
+
+        def on_steps_removed(self, step_numbers, steps):
+            """
+            Handler called once when one or more steps are removed from the
+            protocol.
+
+            Parameters:
+                step_numbers : sorted list of the (original) indexes of the
+                    removed steps
+                steps : list of the removed steps
+            """
             pass
 
         def get_step_form_class(self):
@@ -1,10 +1,25 @@
+import gzip
 import logging
 import logging.handlers
+import os
+import shutil
+import threading
+import time
+import traceback
+from Queue import Queue
+from contextlib import closing
 from logging import DEBUG, INFO, WARNING, ERROR, CRITICAL
 
+from async_writer import AsyncWriter
 from plugin_manager import ILoggingPlugin
 import plugin_manager
 
+# `ILoggingPlugin` signal for each log level name.
+LOGGING_SIGNALS = {'DEBUG': 'on_debug', 'INFO': 'on_info',
+                   'WARNING': 'on_warning', 'ERROR': 'on_error',
+                   'CRITICAL': 'on_critical'}
+
+
 class CustomHandler(logging.Handler):
     def __init__(self):
         # run the regular Handler __init__
@@ -22,6 +37,224 @@ class CustomHandler(logging.Handler):
         elif record.levelname == 'CRITICAL':
             plugin_manager.emit_signal('on_critical', [record], interface=ILoggingPlugin)
 
+
+class QueueHandler(logging.Handler):
+    '''
+    Deliver log records to `ILoggingPlugin` observers without blocking the
+    logging thread.
+
+    Records below the minimum level of every enabled observer of the
+    corresponding signal (see `ILoggingPlugin.log_level`) are dropped
+    immediately.  Other records are queued, formatted on a background thread
+    and delivered in batches from the GTK main loop (or from the background
+    thread if `gobject` is not available).
+    '''
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.setFormatter(logging.Formatter('%(message)s'))
+        self._queue = Queue()
+        self._batch = []
+        self._batch_lock = threading.Lock()
+        self._delivery_scheduled = False
+        self._thread = None
+        try:
+            import gobject
+            self._idle_add = gobject.idle_add
+        except ImportError:
+            self._idle_add = None
+
+    def accepts(self, record):
+        '''
+        Returns `True` if an enabled `ILoggingPlugin` observer accepts records
+        at the level of `record`.
+        '''
+        function = LOGGING_SIGNALS.get(record.levelname)
+        if function is None:
+            return False
+        for observer, f in plugin_manager.get_dispatch(function,
+                                                       ILoggingPlugin):
+            if observer.enabled() and record.levelno >= \
+                    getattr(observer, 'log_level', DEBUG):
+                return True
+        return False
+
+    def emit(self, record):
+        if not self.accepts(record):
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._work,
+                                            name='QueueHandler')
+            self._thread.daemon = True
+            self._thread.start()
+        self._queue.put(record)
+
+    def _prepare(self, record):
+        # Format the message (sets `record.message` and caches the formatted
+        # exception text), and drop references to arguments and traceback.
+        try:
+            self.format(record)
+        except Exception:
+            record.message = str(record.msg)
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def _work(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                # Stop (see `close()`).
+                self._queue.task_done()
+                return
+            try:
+                record = self._prepare(record)
+                with self._batch_lock:
+                    self._batch.append(record)
+                    schedule = self._idle_add is not None and \
+                        not self._delivery_scheduled
+                    if schedule:
+                        self._delivery_scheduled = True
+                if self._idle_add is None:
+                    self.deliver()
+                elif schedule:
+                    self._idle_add(self._on_idle)
+            finally:
+                self._queue.task_done()
+
+    def _on_idle(self):
+        self.deliver()
+        return False
+
+    def deliver(self):
+        '''
+        Emit the `ILoggingPlugin` signal for each formatted record.
+        '''
+        with self._batch_lock:
+            batch, self._batch = self._batch, []
+            self._delivery_scheduled = False
+        for record in batch:
+            plugin_manager.emit_signal(LOGGING_SIGNALS[record.levelname],
+                                       [record], interface=ILoggingPlugin)
+
+    def flush(self):
+        '''
+        Wait for queued records to be formatted, then deliver them from the
+        calling thread.
+        '''
+        if self._thread is not None:
+            self._queue.join()
+        self.deliver()
+
+    def close(self):
+        '''
+        Deliver queued records and stop the background thread.
+        '''
+        if self._thread is not None:
+            self.flush()
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        logging.Handler.close(self)
+
+
+class AsyncRotatingFileHandler(logging.Handler):
+    '''
+    Write log records to a file from a background thread.
+
+    The file is rotated when it reaches `max_bytes` bytes, or `rotate_interval`
+    seconds after it was opened (either check is disabled if 0).  Rotated
+    files are named `<filename>.1.gz`, `<filename>.2.gz`, etc. (most recent
+    first), and at most `backup_count` are kept.
+
+    Records are formatted by the logging thread, but written (and flushed at
+    most every `flush_interval` seconds) by an `AsyncWriter`, so a slow disk
+    does not block the logging thread.
+    '''
+    def __init__(self, filename, max_bytes=0, rotate_interval=0,
+                 backup_count=10, flush_interval=1.):
+        logging.Handler.__init__(self)
+        self.baseFilename = os.path.abspath(filename)
+        self.options = dict(max_bytes=max_bytes,
+                            rotate_interval=rotate_interval,
+                            backup_count=backup_count,
+                            flush_interval=flush_interval)
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self._stream = None
+        self._rollover_time = None
+        self._open()
+        self._writer = AsyncWriter(self._write, self._flush_stream,
+                                   self._close_stream, flush_interval,
+                                   name='AsyncRotatingFileHandler',
+                                   on_error=self._on_error)
+
+    def _open(self):
+        self._stream = open(self.baseFilename, 'ab')
+        if self.rotate_interval:
+            self._rollover_time = time.time() + self.rotate_interval
+
+    def _backup_path(self, i):
+        return '%s.%d.gz' % (self.baseFilename, i)
+
+    def should_rollover(self):
+        if self.max_bytes and self._stream.tell() >= self.max_bytes:
+            return True
+        return (self._rollover_time is not None and
+                time.time() >= self._rollover_time)
+
+    def rollover(self):
+        self._stream.close()
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(self._backup_path(i)):
+                    if os.path.exists(self._backup_path(i + 1)):
+                        os.remove(self._backup_path(i + 1))
+                    os.rename(self._backup_path(i), self._backup_path(i + 1))
+            with open(self.baseFilename, 'rb') as input_:
+                with closing(gzip.open(self._backup_path(1), 'wb')) as output:
+                    shutil.copyfileobj(input_, output)
+        os.remove(self.baseFilename)
+        self._open()
+
+    def emit(self, record):
+        try:
+            self._writer.write(self.format(record) + '\n')
+        except Exception:
+            self.handleError(record)
+
+    # Called by the writer thread. #
+    def _write(self, message):
+        if isinstance(message, unicode):
+            message = message.encode('utf8')
+        self._stream.write(message)
+        if self.should_rollover():
+            self.rollover()
+
+    def _flush_stream(self):
+        self._stream.flush()
+
+    def _close_stream(self):
+        self._stream.close()
+
+    def _on_error(self):
+        # Do not stop writing because of an I/O error (e.g., failure to
+        # compress a rotated file).
+        if logging.raiseExceptions:
+            traceback.print_exc()
+
+    def flush(self):
+        '''
+        Wait (up to 5 seconds) for queued records to be written to disk.
+        '''
+        self._writer.flush(timeout=5.)
+
+    def close(self):
+        self._writer.close(timeout=5.)
+        logging.Handler.close(self)
+
+
 #logging.basicConfig(format='[%(levelname)s-%(threadName)10s]: %(message)s', level=DEBUG)
 logging.basicConfig(format='[%(levelname)s]: %(message)s', level=INFO)
 
@@ -5,7 +5,9 @@ import yaml
 
 from app_context import get_app
 from logger import logger
-from plugin_manager import IPlugin, ExtensionPoint, emit_signal
+from event_log import record_event
+from plugin_manager import (IPlugin, ExtensionPoint, emit_signal,
+                            get_enabled_service)
 from microdrop_utility import Version
 
 
@@ -118,8 +120,7 @@ class AppDataController(object):
 
     @staticmethod
     def get_plugin_app_values(plugin_name):
-        observers = ExtensionPoint(IPlugin)
-        service = observers.service(plugin_name)
+        service = get_enabled_service(plugin_name)
         if hasattr(service, 'get_app_values'):
             return service.get_app_values()
         return None
@@ -128,8 +129,7 @@ class AppDataController(object):
 class StepOptionsController(object):
     @staticmethod
     def get_plugin_step_values(plugin_name, step_number=None):
-        observers = ExtensionPoint(IPlugin)
-        service = observers.service(plugin_name)
+        service = get_enabled_service(plugin_name)
         if hasattr(service, 'get_step_values'):
             return service.get_step_values(step_number)
         return None
@@ -178,8 +178,8 @@ class StepOptionsController(object):
         addition of arbitrary Python data types as step options.
         '''
         step_number = self.get_step_number(step_number)
-        logger.debug('[StepOptionsController] set_step[%d]_values(): '
-                     'values_dict=%s' % (step_number, values_dict))
+        record_event('step_options.set_step_values', plugin_name=self.name,
+                     step_number=step_number, values=values_dict.copy())
         validate_dict = dict([(k, v) for k, v in values_dict.iteritems()
                               if k in self.StepFields.field_schema_mapping])
         validation_result = self.StepFields(value=validate_dict)
@@ -193,8 +193,7 @@ class StepOptionsController(object):
 
         if values:
             app = get_app()
-            step = app.protocol.steps[step_number]
-            step.set_data(self.name, values)
+            app.protocol.set_step_data(step_number, self.name, values)
             emit_signal('on_step_options_changed', [self.name, step_number],
                         interface=IPlugin)
 
@@ -208,10 +207,31 @@ class StepOptionsController(object):
         return default
 
     def get_step_options(self, step_number=None):
-        step = self.get_step(step_number)
-        options = step.get_data(self.name)
+        '''
+        Returns the options of the plugin for a step.  The options may be
+        shared with copies of the step, so they must not be modified in place
+        (see `edit_step_options()`).
+        '''
+        options = self.get_step(step_number).get_data(self.name)
         if options is None:
-            # No data is registered for this plugin (for this step).
-            options = self.get_default_step_options()
-            step.set_data(self.name, options)
+            options = self._set_default_step_options(step_number)
+        return options
+
+    def edit_step_options(self, step_number=None):
+        '''
+        Returns the options of the plugin for a step, which may be modified in
+        place, since they are not shared with copies of the step (see
+        `Step.edit_data()`).  Call `Protocol.record_step_data()` after
+        modifying them.
+        '''
+        options = self.get_step(step_number).edit_data(self.name)
+        if options is None:
+            options = self._set_default_step_options(step_number)
+        return options
+
+    def _set_default_step_options(self, step_number):
+        # No data is registered for this plugin (for this step).
+        options = self.get_default_step_options()
+        get_app().protocol.set_step_data(self.get_step_number(step_number),
+                                         self.name, options)
         return options
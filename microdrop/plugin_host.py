@@ -0,0 +1,525 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+
+Run a managed plugin in a child process.
+
+The parent creates a `PluginHostProxy` service in the `microdrop.managed`
+environment for the plugin.  The proxy forwards each `IPlugin` signal to the
+child process over a ZeroMQ `REQ`/`REP` socket pair.  Signals emitted by the
+plugin in the child process are sent back with each reply and re-emitted in
+the parent.
+
+Notification signals (i.e., `on_*` signals, whose return codes are not used)
+are forwarded without waiting for the child process (see
+`PluginHostProxy.call_async()`): the replies are handled by the GTK main loop,
+so a slow plugin does not block the GUI, and `None` is returned as the
+handler's return code.  Other methods (e.g., `get_step_form_class`) are
+called synchronously, after the replies to pending notifications are handled.
+
+Requests and replies are pickled.  Arguments (and return values) that cannot
+be pickled (e.g., GTK widgets, other plugin instances) are replaced by `None`.
+
+If a call does not complete within the proxy timeout, or the child process
+exits, the child process is restarted.
+
+Signals emitted by the plugin are delivered to the plugin itself in the
+child process, so they are not forwarded back to the proxy they came from.
+
+The child process runs this module as `microdrop.plugin_host`, so that the
+plugin and the host share the same `microdrop.plugin_manager` module (and
+emitted signals are seen by the host).
+
+Usage (child process, started by `PluginHostProxy`):
+
+    python -m microdrop.plugin_host <plugins dir> <plugin package> <endpoint>
+"""
+import atexit
+import cPickle as pickle
+import logging
+import os
+import subprocess
+import sys
+import threading
+import traceback
+from collections import deque
+from timeit import default_timer
+
+from path_helpers import path
+import zmq
+
+from interfaces import IPlugin, PluginGlobals
+from plugin_manager import (Plugin, implements, emit_signal,
+                            invalidate_service_registry,
+                            invalidate_dispatch_table)
+import plugin_manager
+
+
+# Maximum time (in seconds) to wait for a hosted plugin to handle a signal.
+DEFAULT_TIMEOUT = 10.
+# Maximum time (in seconds) to wait for a child process to load its plugin.
+DEFAULT_STARTUP_TIMEOUT = 30.
+# Interval (in seconds) between checks that the child process is still alive
+# while waiting for a reply.
+POLL_INTERVAL = 0.1
+# Prefix of the methods of the hosted plugin that are called asynchronously.
+ASYNC_PREFIX = 'on_'
+
+# Methods of the hosted plugin that are handled by the proxy itself.
+LOCAL_METHODS = set(['activate', 'deactivate', 'enable', 'disable',
+                     'enabled'])
+
+# `PluginHostProxy` instances, by package name.  Keep a reference to each
+# proxy, since the plugin environment only holds weak references to
+# (non-singleton) plugin instances.
+_hosts = {}
+
+
+def _package_root():
+    return str(path(__file__).abspath().parent.parent)
+
+
+class PluginHostError(Exception):
+    pass
+
+
+class PluginHostTimeout(PluginHostError):
+    pass
+
+
+def _picklable(value):
+    try:
+        pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        return value
+    except Exception:
+        return None
+
+
+def _picklable_args(args):
+    return [_picklable(arg) for arg in args]
+
+
+PluginGlobals.push_env('microdrop')
+
+
+class PluginHostProxy(Plugin):
+    '''
+    Forward `IPlugin` signals to a plugin running in a child process.
+
+    Use `start_plugin_host()` to create a proxy, so that the proxy is
+    registered as a service in the `microdrop.managed` environment.
+    '''
+    implements(IPlugin)
+
+    def __init__(self, plugins_dir, package_name, timeout=DEFAULT_TIMEOUT,
+                 startup_timeout=DEFAULT_STARTUP_TIMEOUT):
+        self.plugins_dir = path(plugins_dir).abspath()
+        self.package_name = package_name
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.version = None
+        self.methods = set()
+        self.restart_count = 0
+        self._context = zmq.Context.instance()
+        self._socket = None
+        self._process = None
+        self._lock = threading.RLock()
+        # Asynchronous calls that have not been sent yet, and the call whose
+        # reply is awaited (see `call_async()`).
+        self._queue = deque()
+        self._in_flight = None
+        # GTK main loop sources handling replies (see `_start_watch()`).
+        self._watch_ids = None
+        self.start()
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not found normally.
+        if name.startswith('_') or name not in self.__dict__.get('methods',
+                                                                  ()):
+            raise AttributeError, name
+
+        if name.startswith(ASYNC_PREFIX):
+            def remote_method(*args):
+                return self.call_async(name, args)
+        else:
+            def remote_method(*args):
+                return self.call(name, args)
+        remote_method.__name__ = name
+        return remote_method
+
+    def start(self):
+        '''
+        Start the child process and wait for it to load the plugin.
+        '''
+        with self._lock:
+            self._socket = self._context.socket(zmq.REQ)
+            self._socket.setsockopt(zmq.LINGER, 0)
+            port = self._socket.bind_to_random_port('tcp://127.0.0.1')
+            # Run from the directory containing the `microdrop` package, so
+            # that `microdrop` is not resolved to the `microdrop.py` script
+            # (e.g., if the application was started from the package
+            # directory).
+            self._process = subprocess.Popen([sys.executable, '-m',
+                                              'microdrop.plugin_host',
+                                              self.plugins_dir,
+                                              self.package_name,
+                                              'tcp://127.0.0.1:%d' % port],
+                                             cwd=_package_root())
+            try:
+                info = self._request(('describe', ), self.startup_timeout)
+            except PluginHostError:
+                # Close the socket, so the ZeroMQ context can terminate.
+                self.stop()
+                raise
+            self.name = info['name']
+            self.version = info['version']
+            self.methods = set(info['methods']) - LOCAL_METHODS
+            logging.info('[PluginHost] Started %s (pid=%d)' %
+                         (self.name, self._process.pid))
+
+    def stop(self):
+        with self._lock:
+            self._stop_watch()
+            self._in_flight = None
+            if self._process is not None and self._process.poll() is None:
+                try:
+                    self._request(('exit', ), POLL_INTERVAL * 10)
+                except (PluginHostError, zmq.ZMQError):
+                    # e.g., a reply to another request is still awaited.
+                    pass
+                if self._process.poll() is None:
+                    self._process.kill()
+                self._process.wait()
+            if self._socket is not None:
+                self._socket.close()
+            self._socket = None
+            self._process = None
+
+    def restart(self):
+        logging.warning('[PluginHost] Restarting %s' % self.package_name)
+        self.stop()
+        self.restart_count += 1
+        self.start()
+        if self.enabled() and 'on_plugin_enable' in self.methods:
+            # Calls that were not sent yet are sent after this one.
+            self._handle_reply(self._call('on_plugin_enable', []))
+
+    def _request(self, request, timeout):
+        '''
+        Send a request to the child process and return the reply.
+
+        Raises:
+            PluginHostTimeout: the reply was not received within `timeout`
+                seconds.
+            PluginHostError: the child process exited.
+        '''
+        start = default_timer()
+        # Sending blocks until the child process has connected.
+        self._wait(zmq.POLLOUT, start, timeout)
+        self._socket.send(pickle.dumps(request, pickle.HIGHEST_PROTOCOL))
+        self._wait(zmq.POLLIN, start, timeout)
+        return pickle.loads(self._socket.recv())
+
+    def _wait(self, flags, start, timeout):
+        while not self._socket.poll(int(1e3 * POLL_INTERVAL), flags):
+            self._check(start, timeout)
+
+    def _check(self, start, timeout):
+        if self._process.poll() is not None:
+            raise PluginHostError, '%s plugin host exited (code=%s)' % \
+                (self.package_name, self._process.returncode)
+        if default_timer() - start > timeout:
+            raise PluginHostTimeout, '%s plugin host did not reply ' \
+                'within %.1f s' % (self.package_name, timeout)
+
+    def _call(self, function, args):
+        with self._lock:
+            if self._process is None or self._process.poll() is not None:
+                self.restart()
+            try:
+                return self._request(('call', function,
+                                      _picklable_args(args)), self.timeout)
+            except PluginHostError:
+                self.restart()
+                raise
+
+    def call(self, function, args):
+        '''
+        Call a method of the hosted plugin and return its result.
+
+        Pending asynchronous calls are completed first (see `flush()`).  If
+        the call times out, or the child process has exited, the child
+        process is restarted and `PluginHostError` is raised.
+        '''
+        self.flush()
+        return self._handle_reply(self._call(function, args))
+
+    def call_async(self, function, args, callback=None):
+        '''
+        Forward a call to the hosted plugin without waiting for its result.
+
+        Calls are sent in order, each after the reply to the previous call is
+        received.  Replies are handled by the GTK main loop: signals emitted
+        by the hosted plugin are re-emitted, and `callback` (if any) is called
+        with the result.  Errors are logged.
+
+        If `gobject` is not available (i.e., there is no main loop), the call
+        is made synchronously.
+        '''
+        try:
+            import gobject
+        except ImportError:
+            try:
+                result = self.call(function, args)
+            except PluginHostError:
+                logging.error(''.join(traceback.format_exc()))
+            else:
+                if callback is not None:
+                    callback(result)
+            return
+        with self._lock:
+            self._queue.append((function, _picklable_args(args), callback))
+            self._send_next()
+
+    def flush(self):
+        '''
+        Wait for the replies to all asynchronous calls, and handle them.
+        '''
+        while True:
+            with self._lock:
+                if self._in_flight is None:
+                    if not self._queue:
+                        return
+                    self._send_next()
+            self._receive(wait=True)
+
+    def _send_next(self):
+        # Send the next asynchronous call, unless a reply is awaited.
+        with self._lock:
+            if self._in_flight is not None:
+                return
+            if not self._queue:
+                self._stop_watch()
+                return
+            if self._process is None or self._process.poll() is not None:
+                self.restart()
+            function, args, callback = self._queue.popleft()
+            self._socket.send(pickle.dumps(('call', function, args),
+                                           pickle.HIGHEST_PROTOCOL))
+            self._in_flight = (function, callback, default_timer())
+            if self._watch_ids is None:
+                self._start_watch()
+
+    def _receive(self, wait=False):
+        '''
+        Handle the reply to the asynchronous call in flight (if it was
+        received, or, if `wait` is `True`, once it is received).
+        '''
+        with self._lock:
+            if self._in_flight is None:
+                return
+            function, callback, start = self._in_flight
+            try:
+                if wait:
+                    self._wait(zmq.POLLIN, start, self.timeout)
+                elif not self._socket.poll(0, zmq.POLLIN):
+                    self._check(start, self.timeout)
+                    return
+                reply = pickle.loads(self._socket.recv())
+            except PluginHostError:
+                logging.error('[PluginHost] %s call failed.' % function)
+                logging.error(''.join(traceback.format_exc()))
+                self.restart()
+                return
+            self._in_flight = None
+        try:
+            result = self._handle_reply(reply)
+            if callback is not None:
+                callback(result)
+        except Exception:
+            logging.error('[PluginHost] error handling %s reply from %s.' %
+                          (function, self.name))
+            logging.error(''.join(traceback.format_exc()))
+
+    def _start_watch(self):
+        # Handle replies from the GTK main loop.  The socket file descriptor
+        # only signals changes of the socket state, so the socket is also
+        # polled periodically (which also detects timeouts).
+        import gobject
+
+        watch_ids = []
+
+        def on_event(*args):
+            self._receive()
+            self._send_next()
+            # Remove this source if the watch was stopped (or replaced).
+            return self._watch_ids is watch_ids
+
+        watch_ids.append(gobject.io_add_watch(self._socket
+                                              .getsockopt(zmq.FD),
+                                              gobject.IO_IN, on_event))
+        watch_ids.append(gobject.timeout_add(int(1e3 * POLL_INTERVAL),
+                                             on_event))
+        self._watch_ids = watch_ids
+
+    def _stop_watch(self):
+        if self._watch_ids is not None:
+            import gobject
+
+            watch_ids, self._watch_ids = self._watch_ids, None
+            for watch_id in watch_ids:
+                gobject.source_remove(watch_id)
+
+    def _handle_reply(self, reply):
+        status, result, signals = reply
+        for signal_function, signal_args, interface_name in signals:
+            interface = PluginGlobals.interface_registry.get(interface_name,
+                                                             IPlugin)
+            # The hosted plugin already handled the signal in the child
+            # process.
+            emit_signal(signal_function, signal_args, interface=interface,
+                        exclude=[self.name])
+        if status == 'error':
+            raise PluginHostError, result
+        return result
+
+    def get_schedule_requests(self, function_name):
+        if 'get_schedule_requests' not in self.methods:
+            return []
+        try:
+            return self.call('get_schedule_requests', [function_name])
+        except PluginHostError:
+            logging.error(''.join(traceback.format_exc()))
+            return []
+
+
+PluginGlobals.pop_env()
+
+
+def start_plugin_host(plugins_dir, package_name, **kwargs):
+    '''
+    Start a child process hosting the plugin in `plugins_dir/package_name`
+    and register a (disabled) proxy service for it in the `microdrop.managed`
+    environment.
+
+    Returns the `PluginHostProxy` instance.
+    '''
+    PluginGlobals.push_env('microdrop.managed')
+    try:
+        host = PluginHostProxy(plugins_dir, package_name, **kwargs)
+    finally:
+        PluginGlobals.pop_env()
+    host.disable()
+    _hosts[package_name] = host
+    invalidate_service_registry()
+    invalidate_dispatch_table()
+    return host
+
+
+def get_plugin_hosts():
+    return dict(_hosts)
+
+
+@atexit.register
+def stop_plugin_hosts():
+    for package_name, host in _hosts.items():
+        try:
+            host.stop()
+        except Exception:
+            logging.error(''.join(traceback.format_exc()))
+
+
+class _SignalForwarder(object):
+    '''
+    Signal recorder (see `plugin_manager.enable_signal_recording()`) that
+    collects signals emitted in the child process so they can be forwarded to
+    the parent.
+    '''
+    def __init__(self):
+        self.signals = []
+        self._lock = threading.Lock()
+
+    def record(self, function, interface, args, timings, start, duration):
+        with self._lock:
+            self.signals.append((function, _picklable_args(args),
+                                 interface.__name__))
+
+    def pop(self):
+        with self._lock:
+            signals, self.signals = self.signals, []
+        return signals
+
+
+def _parent_exited(parent_pid):
+    return hasattr(os, 'getppid') and os.getppid() != parent_pid
+
+
+def serve(plugins_dir, package_name, endpoint):
+    '''
+    Load a plugin and handle requests from a `PluginHostProxy` until an `exit`
+    request is received (or the parent process exits).
+    '''
+    parent_pid = os.getppid() if hasattr(os, 'getppid') else None
+    plugin_manager.load_plugins(plugins_dir, enabled=[package_name])
+    service = plugin_manager.get_service_instance_by_package_name(
+        package_name)
+    # Enable the service directly, since `plugin_manager.enable()` emits
+    # `on_plugin_enabled`, which would be forwarded to the parent.
+    service.enable()
+    plugin_manager.invalidate_dispatch_table()
+    forwarder = _SignalForwarder()
+    plugin_manager.enable_signal_recording(forwarder)
+
+    socket = zmq.Context.instance().socket(zmq.REP)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.connect(endpoint)
+    while True:
+        if not socket.poll(1000):
+            if _parent_exited(parent_pid):
+                break
+            continue
+        request = pickle.loads(socket.recv())
+        command = request[0]
+        if command == 'describe':
+            methods = [name for name in dir(service)
+                       if not name.startswith('_') and
+                       callable(getattr(service, name, None))]
+            reply = {'name': service.name,
+                     'version': _picklable(getattr(service, 'version',
+                                                   None)),
+                     'methods': methods}
+        elif command == 'call':
+            function, args = request[1:]
+            try:
+                result = _picklable(getattr(service, function)(*args))
+                status = 'ok'
+            except Exception:
+                result = ''.join(traceback.format_exc())
+                status = 'error'
+            reply = (status, result, forwarder.pop())
+        elif command == 'exit':
+            socket.send(pickle.dumps(None, pickle.HIGHEST_PROTOCOL))
+            break
+        else:
+            reply = ('error', 'Unknown command: %s' % command, [])
+        socket.send(pickle.dumps(reply, pickle.HIGHEST_PROTOCOL))
+    socket.close()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    serve(*sys.argv[1:4])
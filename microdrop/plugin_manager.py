@@ -21,12 +21,14 @@ import traceback
 import sys
 from StringIO import StringIO
 from contextlib import closing
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import logging
 import re
 import os
 import platform
 import subprocess
+import threading
+from timeit import default_timer
 
 from path_helpers import path
 import task_scheduler
@@ -36,33 +38,258 @@ from run_exe import run_exe
 from interfaces import (Plugin, IPlugin, PluginGlobals, ExtensionPoint,
                         IWaveformGenerator, ILoggingPlugin, IVideoPlugin,
                         SingletonPlugin, implements)
+from signal_profiler import SignalProfiler
+from handler_pool import HandlerPool
+from event_log import event_log
 
 
 ScheduleRequest = namedtuple('ScheduleRequest', 'before after')
-
-
-def load_plugins(plugins_dir='plugins'):
-    plugins_dir = path(plugins_dir)
-    logging.info('Loading plugins:')
-    if plugins_dir.parent.abspath() not in sys.path:
-        sys.path.insert(0, plugins_dir.parent.abspath())
-
-    for package in plugins_dir.dirs():
+PluginManifestEntry = namedtuple('PluginManifestEntry', 'path info')
+ServiceIndex = namedtuple('ServiceIndex',
+                          'by_name by_package_name by_class names size')
+
+_package_name_pattern = re.compile(r'plugins\.(?P<name>.*)')
+# Index of the services in each plugin environment, mapping environment name
+# to a `ServiceIndex`.  Built on first use and dropped whenever the set of
+# plugins changes (see `invalidate_service_registry()`).
+_service_indexes = {}
+
+# Directory containing the installed plugins (set by `load_manifest()`).
+_plugins_dir = None
+# Installed plugins, mapping package name to `PluginManifestEntry`.
+_plugin_manifest = OrderedDict()
+# Package names of the plugins that have been imported.
+_loaded_packages = set()
+# Plugin classes for which a service instance has been created.
+_instantiated_classes = set()
+
+# Dispatch table mapping `(function, interface)` to the scheduled list of
+# `(observer, bound method)` pairs for the signal, along with the schedule
+# dependency graph if any of the observers handles the signal concurrently.
+# Entries are compiled lazily by `get_dispatch()` and the whole table is
+# dropped whenever the set of plugins changes (see
+# `invalidate_dispatch_table()`).  Each entry also records the number of
+# services and plugins when it was compiled (see `_get_plugins_size()`).
+_dispatch_table = {}
+
+
+# Worker threads for handlers of signals that plugins have marked as
+# concurrent (see `is_concurrent()`).  Created on first use.
+_handler_pool = None
+# Signals that are delivered on the GTK thread when they are emitted from a
+# handler running on a worker thread (see `set_main_thread_signal()`).
+_main_thread_signals = set([('on_step_complete', IPlugin)])
+
+# Active `SignalProfiler` instance, or `None` if profiling is disabled.
+_profiler = None
+# Active signal recorder (see `enable_signal_recording()`), or `None`.
+_signal_recorder = None
+
+# Signals (i.e., `(function, interface)` pairs) that are queued by
+# `emit_signal()` and delivered later, at most once per argument key (see
+# `set_coalescible()`).
+_coalescible_signals = set()
+# Delay (in milliseconds) between the last queued signal and the delivery of
+# the queued signals.  If `None`, signals are delivered on the next GTK idle
+# iteration.
+_coalesce_delay = None
+# Queued calls, keyed by coalescing key, in the order they were first queued.
+_coalesced_calls = OrderedDict()
+_coalesce_lock = threading.Lock()
+_coalesce_source_id = None
+# Signals that deliver all queued coalescible signals before they are
+# delivered themselves (see `set_flush_before()`), since they change the step
+# numbers that queued signals refer to.
+_flush_before_signals = set([(function, IPlugin) for function in
+                             ('on_step_swapped', 'on_step_created',
+                              'on_steps_inserted', 'on_step_removed',
+                              'on_steps_removed', 'on_protocol_swapped')])
+
+
+def enable_profiling(profiler=None):
+    """
+    Start recording the time spent by each plugin handling each signal
+    emitted through `emit_signal()`.
+
+    Returns the active `SignalProfiler` instance.
+    """
+    global _profiler
+    if profiler is None:
+        profiler = _profiler if _profiler is not None else SignalProfiler()
+    _profiler = profiler
+    return _profiler
+
+
+def disable_profiling():
+    global _profiler
+    _profiler = None
+
+
+def get_profiler():
+    """
+    Returns the active `SignalProfiler` instance, or `None` if profiling is
+    disabled.
+    """
+    return _profiler
+
+
+def enable_signal_recording(recorder):
+    """
+    Pass every signal delivered by `emit_signal()` to `recorder` (e.g., a
+    `signal_trace.SignalTraceWriter`), along with the call order and duration
+    of each handler.
+    """
+    global _signal_recorder
+    _signal_recorder = recorder
+
+
+def disable_signal_recording():
+    """
+    Stop recording signals.  Returns the recorder that was active (if any).
+    """
+    global _signal_recorder
+    recorder = _signal_recorder
+    _signal_recorder = None
+    return recorder
+
+
+def invalidate_service_registry():
+    """
+    Discard the service lookup indexes.
+
+    Must be called whenever plugins are loaded, enabled, or disabled.
+    """
+    _service_indexes.clear()
+
+
+def invalidate_dispatch_table():
+    """
+    Discard all compiled signal dispatch entries.
+
+    Must be called whenever the set of enabled plugins changes (e.g., after
+    loading, enabling, or disabling a plugin).
+    """
+    _dispatch_table.clear()
+
+
+def load_manifest(plugins_dir='plugins'):
+    """
+    Read the `properties.yml` file of each plugin in `plugins_dir` into the
+    plugin manifest, *without* importing any plugins.
+
+    Returns the manifest (see `get_plugin_manifest()`).
+    """
+    # Import here to avoid a circular import (`plugin_helpers` depends on
+    # this module).
+    from plugin_helpers import get_plugin_info
+
+    global _plugins_dir
+    _plugins_dir = path(plugins_dir)
+    _plugin_manifest.clear()
+    for package in _plugins_dir.dirs():
         try:
-            logging.info('\t %s' % package.abspath())
-            import_statement = 'import %s.%s' % \
-                (plugins_dir.name, package.name)
-            logging.debug(import_statement)
-            exec(import_statement)
+            info = get_plugin_info(package)
         except Exception, why:
             logging.info(''.join(traceback.format_exc()))
-            logging.error('Error loading %s plugin.' % package.name)
-
-    # Create an instance of each of the plugins, but set it to disabled
+            logging.error('Error reading %s plugin properties.' %
+                          package.name)
+            info = None
+        _plugin_manifest[package.name] = PluginManifestEntry(package, info)
+    return _plugin_manifest
+
+
+def get_plugin_manifest():
+    """
+    Returns an ordered dictionary mapping the package name of each installed
+    plugin to a `PluginManifestEntry` (i.e., `(path, info)`, where `info` is
+    the `plugin_helpers.PluginMetaData` read from the plugin's
+    `properties.yml`, or `None` if it could not be read).
+    """
+    return _plugin_manifest
+
+
+def get_installed_plugin_names():
+    """
+    Returns the names of all plugins that are installed, whether or not they
+    have been imported.
+    """
+    names = get_service_names(env='microdrop.managed')
+    for entry in _plugin_manifest.values():
+        if entry.info is not None and entry.info.plugin_name not in names:
+            names.append(entry.info.plugin_name)
+    return names
+
+
+def is_plugin_loaded(package_name):
+    return package_name in _loaded_packages
+
+
+def _instantiate_plugins():
+    # Create an instance of each newly registered plugin, but set it to
+    # disabled
     e = PluginGlobals.env('microdrop.managed')
     for class_ in e.plugin_registry.values():
+        if class_ in _instantiated_classes:
+            continue
         service = class_()
         service.disable()
+        _instantiated_classes.add(class_)
+    invalidate_service_registry()
+    invalidate_dispatch_table()
+
+
+def _import_plugin_package(package_name):
+    try:
+        logging.info('\t %s' % _plugins_dir.joinpath(package_name).abspath())
+        import_statement = 'import %s.%s' % \
+            (_plugins_dir.name, package_name)
+        logging.debug(import_statement)
+        exec(import_statement)
+    except Exception, why:
+        logging.info(''.join(traceback.format_exc()))
+        logging.error('Error loading %s plugin.' % package_name)
+        return False
+    _loaded_packages.add(package_name)
+    return True
+
+
+def import_plugin(package_name):
+    """
+    Import an installed plugin that was not loaded by `load_plugins()` (e.g.,
+    because it was not enabled at startup) and create its (disabled) service
+    instance.
+
+    Returns `True` if the plugin is loaded.
+    """
+    if package_name in _loaded_packages:
+        return True
+    if _plugins_dir is None or package_name not in _plugin_manifest:
+        raise KeyError, 'No plugin installed with package name: %s' % \
+            package_name
+    logging.info('Loading plugin:')
+    result = _import_plugin_package(package_name)
+    _instantiate_plugins()
+    return result
+
+
+def load_plugins(plugins_dir='plugins', enabled=None):
+    """
+    Load the plugins installed in `plugins_dir`.
+
+    If `enabled` is a list of package names, only the listed plugins are
+    imported.  Other installed plugins are only added to the plugin manifest
+    and may be imported later using `import_plugin()`.
+    """
+    plugins_dir = path(plugins_dir)
+    logging.info('Loading plugins:')
+    if plugins_dir.parent.abspath() not in sys.path:
+        sys.path.insert(0, plugins_dir.parent.abspath())
+
+    load_manifest(plugins_dir)
+    for package_name in _plugin_manifest:
+        if enabled is None or package_name in enabled:
+            _import_plugin_package(package_name)
+    _instantiate_plugins()
 
 
 def post_install(install_path):
@@ -131,28 +358,87 @@ def get_service_class(name, env='microdrop.managed'):
     return e.plugin_registry[name]
 
 
-def get_service_instance_by_name(name, env='microdrop.managed'):
+def _build_service_index(env):
     e = PluginGlobals.env(env)
-    plugins = [p for i, p in enumerate(e.services) if name == p.name]
-    if plugins:
-        return plugins[0]
+    by_name = {}
+    by_package_name = {}
+    by_class = {}
+    for service in e.services:
+        by_name.setdefault(service.name, service)
+        by_class.setdefault(service.__class__, service)
+        # Services that are not defined by a plugin package (e.g., a
+        # `plugin_host.PluginHostProxy`) provide their package name.
+        package_name = getattr(service, 'package_name', None)
+        if package_name is None:
+            match = _package_name_pattern.search(service.__class__.__module__)
+            if match is not None:
+                package_name = match.group('name')
+        if package_name is not None:
+            by_package_name.setdefault(package_name, service)
+    names = []
+    for name in get_plugin_names(env):
+        service = by_class.get(e.plugin_registry[name])
+        if service is None:
+            service = _find_service_instance(e.plugin_registry[name], env)
+        if service is not None:
+            names.append(service.name)
+    registered_classes = set(e.plugin_registry.values())
+    for service in e.services:
+        if service.__class__ not in registered_classes and \
+                service.name not in names:
+            names.append(service.name)
+    return ServiceIndex(by_name, by_package_name, by_class, names,
+                        _get_env_size(e))
+
+
+def _get_env_size(e):
+    return len(e.services), len(e.plugin_registry)
+
+
+def _get_plugins_size():
+    # Size of all plugin environments, since signals may be dispatched to
+    # services in several environments (e.g., `microdrop.managed`).
+    sizes = [_get_env_size(e) for e in PluginGlobals.env_registry.values()]
+    return tuple([sum(size) for size in zip(*sizes)])
+
+
+def _get_service_index(env):
+    index = _service_indexes.get(env)
+    if index is None or index.size != _get_env_size(PluginGlobals.env(env)):
+        # The index is dropped when plugins are loaded, enabled or disabled
+        # (see `invalidate_service_registry()`), but services may also be
+        # created on import (e.g., core plugins).
+        index = _build_service_index(env)
+        _service_indexes[env] = index
+    return index
+
+
+def _lookup_service(env, attr, key):
+    """
+    Look up a service in the index for `env`.  Returns `None` if there is no
+    matching service.
+    """
+    return getattr(_get_service_index(env), attr).get(key)
+
+
+def get_service_instance_by_name(name, env='microdrop.managed'):
+    service = _lookup_service(env, 'by_name', name)
+    if service is not None:
+        return service
     else:
         raise KeyError, 'No plugin registered with name: %s' % name
 
 
 def get_service_instance_by_package_name(name, env='microdrop.managed'):
-    e = PluginGlobals.env(env)
-    plugins = [p for i, p in enumerate(e.services) \
-               if name == get_plugin_package_name(p.__class__.__module__)]
-    if plugins:
-        return plugins[0]
+    service = _lookup_service(env, 'by_package_name', name)
+    if service is not None:
+        return service
     else:
         raise KeyError, 'No plugin registered with package name: %s' % name
 
 
 def get_plugin_package_name(class_name):
-    match = re.search(r'plugins\.(?P<name>.*)',
-                      class_name)
+    match = _package_name_pattern.search(class_name)
     if match is None:
         logging.error('Could not determine package name from: %s'\
                 % class_name)
@@ -160,7 +446,7 @@ def get_plugin_package_name(class_name):
     return match.group('name')
 
 
-def get_service_instance(class_, env='microdrop.managed'):
+def _find_service_instance(class_, env):
     e = PluginGlobals.env(env)
     for service in e.services:
         if isinstance(service, class_):
@@ -169,17 +455,40 @@ def get_service_instance(class_, env='microdrop.managed'):
     return None
 
 
+def get_service_instance(class_, env='microdrop.managed'):
+    by_class = _get_service_index(env).by_class
+    if class_ not in by_class:
+        # `class_` may be a base class of a registered plugin class.  The
+        # result (including `None`) is cached until the index is rebuilt.
+        by_class[class_] = _find_service_instance(class_, env)
+    return by_class[class_]
+
+
 def get_service_names(env='microdrop.managed'):
-    e = PluginGlobals.env(env)
-    service_names = []
-    for name in get_plugin_names(env):
-        plugin_class = e.plugin_registry[name]
-        service = get_service_instance(plugin_class, env=env)
-        service_names.append(service.name)
-    return service_names
+    return list(_get_service_index(env).names)
+
+
+def get_enabled_service(name, envs=('microdrop.managed', 'microdrop')):
+    """
+    Returns the enabled service with the specified name, or `None`.
+
+    This is equivalent to `ExtensionPoint(IPlugin).service(name)` for plugins
+    in the core and managed environments, but does not scan all services.
+    """
+    for env in envs:
+        service = _lookup_service(env, 'by_name', name)
+        if service is not None:
+            if service.enabled():
+                return service
+            return None
+    return None
 
 
-def get_schedule(observers, function):
+def _get_schedule(observers, function):
+    """
+    Returns a tuple containing the serial schedule of observer names for
+    `function` and the list of schedule requests used to build it.
+    """
     # Query plugins for schedule requests for 'function'
     schedule_requests = {}
     for observer in observers.values():
@@ -189,6 +498,7 @@ def get_schedule(observers, function):
 
     if schedule_requests:
         scheduler = task_scheduler.TaskScheduler(observers.keys())
+        accepted = []
         for request in [r for name, requests in schedule_requests.items() for r in requests]:
             try:
                 scheduler.request_order(*request)
@@ -196,9 +506,27 @@ def get_schedule(observers, function):
                 logging.info('[PluginManager] emit_signal(%s) could not '\
                         'add schedule request %s' % (function, request))
                 continue
-        return scheduler.get_schedule()
+            accepted.append(ScheduleRequest(*request))
+        return scheduler.get_schedule(), accepted
     else:
-        return observers.keys()
+        return observers.keys(), []
+
+
+def get_schedule(observers, function):
+    return _get_schedule(observers, function)[0]
+
+
+def get_schedule_dependencies(observers, function):
+    """
+    Returns a dictionary mapping each observer name to the set of observer
+    names that must complete handling `function` before it may start, i.e.,
+    the schedule requests for `function` as a dependency graph.
+    """
+    dependencies = dict([(name, set()) for name in observers])
+    for before, after in _get_schedule(observers, function)[1]:
+        if before in observers and after in observers:
+            dependencies[after].add(before)
+    return dependencies
 
 
 def get_observers(function, interface=IPlugin):
@@ -209,35 +537,403 @@ def get_observers(function, interface=IPlugin):
     return observers
 
 
-def emit_signal(function, args=None, interface=IPlugin):
+def is_concurrent(observer, function):
+    """
+    Returns `True` if `observer` may handle `function` on a worker thread.
+
+    Plugins opt in by listing signal names in a `concurrent_signals` class
+    attribute, e.g.:
+
+        class MyPlugin(Plugin):
+            implements(IPlugin)
+            concurrent_signals = ('on_step_run', )
+
+    Concurrent handlers run on a thread pool as soon as all handlers they are
+    scheduled after (see `get_schedule_requests`) have completed, so they must
+    not touch GTK objects directly (use `gobject.idle_add` instead).
+
+    Signals emitted by a concurrent handler are handled serially on the same
+    worker thread, except for signals marked with `set_main_thread_signal()`
+    (e.g., `on_step_complete`), which are delivered on the GTK thread.
+    """
+    return function in getattr(observer.__class__, 'concurrent_signals', ())
+
+
+def _compile_dispatch(function, interface):
+    observers = get_observers(function, interface)
+    schedule = get_schedule(observers, function)
+    dispatch = [(observers[name], getattr(observers[name], function))
+                for name in schedule]
+    if [name for name in schedule
+        if is_concurrent(observers[name], function)]:
+        dependencies = get_schedule_dependencies(observers, function)
+    else:
+        # Serial dispatch does not need the dependency graph.
+        dependencies = None
+    return dispatch, dependencies
+
+
+def _get_compiled_dispatch(function, interface):
+    key = (function, interface)
+    entry = _dispatch_table.get(key)
+    size = _get_plugins_size()
+    if entry is None or entry[0] != size:
+        # The table is dropped when plugins are loaded, enabled or disabled
+        # (see `invalidate_dispatch_table()`), but services may also be
+        # created on import (e.g., core plugins).
+        entry = (size, _compile_dispatch(function, interface))
+        _dispatch_table[key] = entry
+    return entry[1]
+
+
+def get_dispatch(function, interface=IPlugin):
+    """
+    Returns the scheduled list of `(observer, bound method)` pairs handling
+    `function` for `interface`.
+
+    The list is compiled on first use and cached until the plugin set changes
+    (see `invalidate_dispatch_table()`).
+    """
+    return _get_compiled_dispatch(function, interface)[0]
+
+
+def _call_handler(observer, function, f, args, timings=None):
+    profiler = _profiler
+    if profiler is None and timings is None:
+        return f(*args)
+    start = default_timer()
     try:
-        observers = get_observers(function, interface)
-        schedule = get_schedule(observers, function)
-        return_codes = {}
-        for observer_name in schedule:
-            observer = observers[observer_name]
-            logging.debug('emit_signal: %s.%s()' % (observer.name, function))
+        return f(*args)
+    finally:
+        duration = default_timer() - start
+        if profiler is not None:
+            profiler.record(observer.name, function, duration)
+        if timings is not None:
+            timings[observer.name] = duration
+
+
+def _log_handler_error(observer, function, interface, why):
+    """
+    Log an exception raised by a signal handler.  Must be called from within
+    the `except` block handling the exception.
+    """
+    with closing(StringIO()) as message:
+        if hasattr(observer, "name"):
+            if interface == ILoggingPlugin:
+                # If this is a logging plugin, do not try to log
+                # since that will result in infinite recursion.
+                # Instead, just continue onto the next plugin.
+                return
+            print >> message, \
+                '%s plugin crashed processing %s signal.' % \
+                (observer.name, function)
+        print >> message, 'Reason:', str(why)
+        logging.error(message.getvalue().strip())
+    logging.info(''.join(traceback.format_exc()))
+    logging.info('Recent events:\n%s' % event_log.dump(20))
+
+
+def _get_handler_pool():
+    global _handler_pool
+    if _handler_pool is None:
+        _handler_pool = HandlerPool()
+    return _handler_pool
+
+
+def _in_worker():
+    return _handler_pool is not None and _handler_pool.in_worker()
+
+
+def set_main_thread_signal(function, main_thread=True, interface=IPlugin):
+    """
+    Mark (or unmark) a signal that must be handled on the GTK thread.
+
+    When such a signal is emitted from a concurrent handler (i.e., from a
+    worker thread), `emit_signal()` returns an empty dictionary immediately
+    and the signal is delivered by the GTK main loop.  `on_step_complete` is
+    marked by default, since its handlers advance the protocol and update the
+    GUI.
+    """
+    if main_thread:
+        _main_thread_signals.add((function, interface))
+    else:
+        _main_thread_signals.discard((function, interface))
+
+
+def _emit_concurrent(function, args, interface, dispatch, dependencies,
+                     return_codes, timings, exclude=None):
+    pending = {}
+    pending_order = []
+    # A signal emitted from a concurrent handler is delivered serially on
+    # the same worker thread, since waiting for other workers may deadlock
+    # the pool.
+    inline = _in_worker()
+
+    def collect(name):
+        observer, call = pending.pop(name)
+        try:
+            return_codes[observer.name] = call.wait()
+        except Exception, why:
+            _log_handler_error(observer, function, interface, why)
+
+    for observer, f in dispatch:
+        if not observer.enabled():
+            # Plugin was disabled without going through `disable()`.
+            continue
+        if exclude and observer.name in exclude:
+            continue
+        for name in dependencies[observer.name]:
+            if name in pending:
+                collect(name)
+        logging.debug('emit_signal: %s.%s()' % (observer.name, function))
+        if timings is not None:
+            # Record the handler in call order.
+            timings[observer.name] = None
+        if is_concurrent(observer, function) and not inline:
+            pending[observer.name] = (observer, _get_handler_pool()
+                                      .submit(_call_handler, observer,
+                                              function, f, args, timings))
+            pending_order.append(observer.name)
+        else:
             try:
-                if args is None:
-                    args = []
-                elif type(args) is not list:
-                    args = [args]
-                f = getattr(observer, function)
-                return_codes[observer.name] = f(*args)
+                return_codes[observer.name] = _call_handler(observer,
+                                                            function, f,
+                                                            args, timings)
             except Exception, why:
-                with closing(StringIO()) as message:
-                    if hasattr(observer, "name"):
-                        if interface == ILoggingPlugin:
-                            # If this is a logging plugin, do not try to log
-                            # since that will result in infinite recursion.
-                            # Instead, just continue onto the next plugin.
-                            continue
-                        print >> message, \
-                            '%s plugin crashed processing %s signal.' % \
-                            (observer.name, function)
-                    print >> message, 'Reason:', str(why)
-                    logging.error(message.getvalue().strip())
-                logging.info(''.join(traceback.format_exc()))
+                _log_handler_error(observer, function, interface, why)
+    for name in pending_order:
+        if name in pending:
+            collect(name)
+
+
+def set_coalescible(function, coalescible=True, interface=IPlugin):
+    """
+    Mark (or unmark) a signal as coalescible.
+
+    When a coalescible signal is emitted, `emit_signal()` returns an empty
+    dictionary immediately and the signal is delivered later (see
+    `set_coalesce_delay()`).  Emitting the same signal again with equal
+    arguments before it is delivered has no effect, so bursts of identical
+    signals (e.g., `on_protocol_changed` while pasting steps) result in a
+    single call to each handler.
+
+    Only signals whose handler return values are not used by the emitter may
+    be marked as coalescible.
+    """
+    if coalescible:
+        _coalescible_signals.add((function, interface))
+    else:
+        _coalescible_signals.discard((function, interface))
+
+
+def set_flush_before(function, flush=True, interface=IPlugin):
+    """
+    Mark (or unmark) a signal that delivers all queued coalescible signals
+    before it is delivered, so that handlers see signals in the order they
+    were emitted.
+
+    Signals that insert, remove, or swap steps are marked by default, since
+    queued signals (e.g., `on_step_options_changed`) may refer to step
+    numbers that they change.
+    """
+    if flush:
+        _flush_before_signals.add((function, interface))
+    else:
+        _flush_before_signals.discard((function, interface))
+
+
+def set_coalesce_delay(delay=None):
+    """
+    Set the time (in milliseconds) to wait after the most recent coalescible
+    signal before delivering queued signals.  If `delay` is `None` (or 0),
+    queued signals are delivered on the next GTK idle iteration.
+    """
+    global _coalesce_delay
+    _coalesce_delay = delay or None
+
+
+def _coalesce_key(args):
+    try:
+        key = tuple(args)
+        hash(key)
+    except TypeError:
+        # Unhashable arguments are only considered equal if they are the
+        # same objects.
+        key = tuple([id(arg) for arg in args])
+    return key
+
+
+def coalesce_call(key, f, args=None):
+    """
+    Queue a call to `f(*args)` to be made when queued coalescible signals are
+    delivered, unless a call with the same `key` is already queued.
+    """
+    global _coalesce_source_id
+
+    if args is None:
+        args = []
+    try:
+        import gobject
+    except ImportError:
+        # There is no main loop to defer the call to.
+        return f(*args)
+
+    with _coalesce_lock:
+        if key not in _coalesced_calls:
+            _coalesced_calls[key] = (f, args)
+        if _coalesce_delay is not None:
+            # Debounce: restart the delay on every new call.
+            if _coalesce_source_id is not None:
+                gobject.source_remove(_coalesce_source_id)
+            _coalesce_source_id = gobject.timeout_add(_coalesce_delay,
+                                                      _flush_idle)
+        elif _coalesce_source_id is None:
+            _coalesce_source_id = gobject.idle_add(_flush_idle)
+
+
+def _flush_idle():
+    global _coalesce_source_id
+
+    with _coalesce_lock:
+        # The source is removed when this callback returns.
+        _coalesce_source_id = None
+    flush_coalesced_signals()
+    return False
+
+
+def flush_coalesced_signals():
+    """
+    Deliver all queued coalescible signals (and calls queued through
+    `coalesce_call()`) immediately, in the order they were queued.
+    """
+    global _coalesce_source_id
+
+    with _coalesce_lock:
+        if _coalesce_source_id is not None:
+            import gobject
+
+            gobject.source_remove(_coalesce_source_id)
+            _coalesce_source_id = None
+        calls = _coalesced_calls.values()
+        _coalesced_calls.clear()
+    for f, args in calls:
+        try:
+            f(*args)
+        except Exception, why:
+            logging.error('[PluginManager] error processing coalesced call '
+                          '%s: %s' % (f, why))
+            logging.info(''.join(traceback.format_exc()))
+
+
+def emit_signal(function, args=None, interface=IPlugin, exclude=None):
+    """
+    Emit a signal to all enabled plugins implementing `interface` that
+    handle `function`.
+
+    Args:
+        exclude: names of plugins that the signal is not delivered to (e.g.,
+            the plugin that the signal originates from).
+
+    Returns:
+        Return codes of the handlers, by plugin name.
+    """
+    if exclude is not None:
+        exclude = frozenset(exclude)
+    if (function, interface) in _main_thread_signals and _in_worker():
+        try:
+            import gobject
+        except ImportError:
+            pass
+        else:
+            gobject.idle_add(_emit_idle, function, args, interface, exclude)
+            return {}
+    if _coalesced_calls and (function, interface) in _flush_before_signals:
+        flush_coalesced_signals()
+    if (function, interface) in _coalescible_signals:
+        if args is None:
+            args = []
+        elif type(args) is not list:
+            args = [args]
+        coalesce_call((function, interface, _coalesce_key(args), exclude),
+                      _emit_signal, [function, args, interface, exclude])
+        return {}
+    return _emit_signal(function, args, interface, exclude)
+
+
+def _emit_idle(function, args, interface, exclude):
+    emit_signal(function, args, interface, exclude)
+    return False
+
+
+def emit_batch_signal(function, args, fallback, fallback_args,
+                      interface=IPlugin):
+    """
+    Emit a signal describing a batch of changes (e.g., `on_steps_inserted`),
+    and emit the equivalent per-item signal (e.g., `on_step_created`) once for
+    each item to plugins that only handle the per-item signal.
+
+    Args:
+        function: name of batch signal.
+        args: arguments of batch signal.
+        fallback: name of per-item signal.
+        fallback_args: list containing the arguments of the per-item signal
+            for each item, in the order the signals must be emitted.
+
+    Returns:
+        Return codes of the handlers of the batch signal, by plugin name.
+    """
+    return_codes = emit_signal(function, args, interface=interface)
+    # Plugins that handle the batch signal are not sent per-item signals.
+    dispatch = [(observer, f) for observer, f in get_dispatch(fallback,
+                                                              interface)
+                if not hasattr(observer, function)]
+    if dispatch:
+        for item_args in fallback_args:
+            for observer, f in dispatch:
+                if not observer.enabled():
+                    continue
+                try:
+                    _call_handler(observer, fallback, f, item_args)
+                except Exception, why:
+                    _log_handler_error(observer, fallback, interface, why)
+    return return_codes
+
+
+def _emit_signal(function, args=None, interface=IPlugin, exclude=None):
+    try:
+        if args is None:
+            args = []
+        elif type(args) is not list:
+            args = [args]
+        return_codes = {}
+        recorder = _signal_recorder
+        if recorder is not None:
+            timings = OrderedDict()
+            start = default_timer()
+        else:
+            timings = None
+        dispatch, dependencies = _get_compiled_dispatch(function, interface)
+        if dependencies is not None:
+            _emit_concurrent(function, args, interface, dispatch,
+                             dependencies, return_codes, timings, exclude)
+        else:
+            for observer, f in dispatch:
+                if not observer.enabled():
+                    # Plugin was disabled without going through `disable()`.
+                    continue
+                if exclude and observer.name in exclude:
+                    continue
+                logging.debug('emit_signal: %s.%s()' % (observer.name,
+                                                        function))
+                try:
+                    return_codes[observer.name] = _call_handler(observer,
+                                                                function, f,
+                                                                args, timings)
+                except Exception, why:
+                    _log_handler_error(observer, function, interface, why)
+        if recorder is not None:
+            recorder.record(function, interface, args, timings.items(),
+                            start, default_timer() - start)
         return return_codes
     except Exception, why:
         logging.error(why)
@@ -249,6 +945,8 @@ def enable(name, env='microdrop.managed'):
     service = get_service_instance_by_name(name, env)
     if not service.enabled():
         service.enable()
+        invalidate_service_registry()
+        invalidate_dispatch_table()
         logging.info('[PluginManager] Enabled plugin: %s' % name)
     if hasattr(service, "on_plugin_enable"):
         service.on_plugin_enable()
@@ -259,6 +957,8 @@ def disable(name, env='microdrop.managed'):
     service = get_service_instance_by_name(name, env)
     if service and service.enabled():
         service.disable()
+        invalidate_service_registry()
+        invalidate_dispatch_table()
         if hasattr(service, "on_plugin_disable"):
             service.on_plugin_disable()
         emit_signal('on_plugin_disabled', [env, service])
@@ -17,27 +17,43 @@ You should have received a copy of the GNU General Public License
 along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import copy_reg
 import time
+import threading
+import uuid
 from copy import deepcopy
+from types import InstanceType
 import re
 import logging
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
-from StringIO import StringIO
-from contextlib import closing
 
 import yaml
 
-from plugin_manager import (emit_signal, IPlugin, ExtensionPoint,
+from plugin_manager import (emit_signal, emit_batch_signal, IPlugin,
     get_service_names)
 from logger import logger
+from event_log import record_event
+from protocol_container import (is_container, write_container,
+                                ContainerReader)
+from protocol_journal import (ProtocolJournal, journal_paths,
+                              pending_journals, remove_journals, replace_file)
 from microdrop_utility import Version, VersionError, FutureVersionError
 
 
 class Protocol():
     class_version = str(Version(0,2))
+    # Identifies the saved protocol file that journal records apply to (see
+    # `protocol_journal`).
+    journal_id = None
+    # `ProtocolJournal` recording edits to the protocol (see
+    # `open_journal()`).
+    journal = None
+    # Attributes that are not saved.
+    _transient_attributes = ('filename', 'journal', 'n_replayed',
+                             '_compact_thread')
 
     def __init__(self, name=None):
         self.steps = [Step()]
@@ -51,12 +67,20 @@ class Protocol():
         self.version = self.class_version
 
     @classmethod
-    def load(cls, filename):
+    def load(cls, filename, warm=True, journal=True, share_payloads=True):
         """
         Load a Protocol from a file.
 
         Args:
             filename: path to file.
+            warm: if `True`, decode step data in a background thread (step
+                data is otherwise decoded on first access).
+            journal: if `True`, apply the edits recorded in the journal of the
+                protocol file (see `open_journal()`).
+            share_payloads: if `True`, identical serialized plugin data (e.g.,
+                the same electrode states in many steps) is only decoded once,
+                and the decoded object is shared by the steps (copy-on-write,
+                see `Step.copy()`).
         Raises:
             TypeError: file is not a Protocol.
             FutureVersionError: file was written by a future version of the
@@ -65,6 +89,15 @@ class Protocol():
         logger.debug("[Protocol].load(\"%s\")" % filename)
         logger.info("Loading Protocol from %s" % filename)
         start_time = time.time()
+        if is_container(filename):
+            out = cls._load_container(filename, share_payloads)
+            if journal:
+                out.replay_journal(filename)
+            logger.debug("[Protocol].load() loaded in %f s." % \
+                         (time.time()-start_time))
+            if warm:
+                out.decode_steps(background=True)
+            return out
         out = None
         with open(filename, 'rb') as f:
             try:
@@ -104,24 +137,251 @@ class Protocol():
                     out.plugin_data[k] = pickle.loads(v)
                 except Exception, e:
                     out.plugin_data[k] = yaml.load(v)
-        for i in range(len(out)):
-            for k, v in out[i].plugin_data.items():
-                if k in enabled_plugins:
-                    try:
-                        out[i].plugin_data[k] = pickle.loads(v)
-                    except Exception, e:
-                        # enable loading of old protocols where the
-                        # dmf_device_controller was imported as a relative
-                        # package
-                        v = v.replace('!!python/object:gui.'
-                                          'dmf_device_controller.',
-                                      '!!python/object:microdrop.gui.'
-                                          'dmf_device_controller.')
-                        out[i].plugin_data[k] = yaml.load(v)
+        # Step data is only decoded when it is first accessed (see
+        # `Step.get_data`), or by a background thread.
+        payloads = {} if share_payloads else None
+        for step in out.steps:
+            step.set_encoded_data(_share_payloads(
+                dict([(k, v) for k, v in step.plugin_data.iteritems()
+                      if k in enabled_plugins]), payloads))
+        if journal:
+            out.replay_journal(filename)
         logger.debug("[Protocol].load() loaded in %f s." % \
                      (time.time()-start_time))
+        if warm:
+            out.decode_steps(background=True)
         return out
 
+    @classmethod
+    def _load_container(cls, filename, share_payloads=True):
+        reader = ContainerReader(filename)
+        out = cls()
+        out.__dict__.update(pickle.loads(reader.attributes()))
+        out.filename = filename
+        out._upgrade()
+
+        enabled_plugins = get_service_names(env='microdrop.managed') + \
+            get_service_names('microdrop')
+        # As for other formats, the data of plugins that are not enabled is
+        # left serialized.
+        out.plugin_data = dict([(k, decode_step_data(v)
+                                 if k in enabled_plugins else v)
+                                for k, v in reader.plugin_data().iteritems()])
+        payloads = {} if share_payloads else None
+        enabled_plugins = set(enabled_plugins)
+        out.steps = [_decode_step(reader.step_data(i), enabled_plugins,
+                                  payloads)
+                     for i in xrange(reader.n_steps)]
+        return out
+
+    def replay_journal(self, filename):
+        '''
+        Apply the edits recorded in the journal of a protocol file (see
+        `protocol_journal`) to the protocol.
+
+        Returns the number of records that were applied (also stored in the
+        `n_replayed` attribute).
+        '''
+        self.n_replayed = 0
+        enabled_plugins = get_service_names(env='microdrop.managed') + \
+            get_service_names('microdrop')
+        for journal_path, header, records in pending_journals(filename,
+                                                              self.journal_id):
+            logger.info('[Protocol] Applying %d edits from %s.' %
+                        (len(records), journal_path))
+            for record in records:
+                try:
+                    self._apply_journal_record(record, enabled_plugins)
+                except Exception:
+                    logger.error('[Protocol] Invalid journal record in %s: '
+                                 '%r' % (journal_path, record[:2]),
+                                 exc_info=True)
+                    break
+                self.n_replayed += 1
+        return self.n_replayed
+
+    def _apply_journal_record(self, record, enabled_plugins):
+        # Signals are not emitted, since the protocol is not the current
+        # protocol while it is loaded.
+        kind = record[0]
+        if kind == 'insert':
+            self.steps.insert(record[1], _decode_step(record[2],
+                                                      enabled_plugins))
+        elif kind == 'delete':
+            self.steps.pop(record[1])
+        elif kind == 'set_data':
+            step_number, plugin_name, data = record[1:]
+            if plugin_name in enabled_plugins:
+                self.steps[step_number].set_encoded_data({plugin_name: data})
+            else:
+                self.steps[step_number].set_data(plugin_name, data)
+        elif kind == 'remove_data':
+            self.steps[record[1]].remove_data(record[2])
+        elif kind == 'set_protocol_data':
+            plugin_name, data = record[1:]
+            if plugin_name in enabled_plugins:
+                data = decode_step_data(data)
+            self.plugin_data[plugin_name] = data
+        elif kind == 'set_attribute':
+            setattr(self, record[1], record[2])
+        else:
+            raise ValueError, 'Unknown journal record: %s' % kind
+
+    def _journal(self, *record):
+        if self.journal is not None:
+            self.journal.append(record)
+
+    def open_journal(self, filename, format='pickle'):
+        '''
+        Record edits to the protocol (see `insert_step()`, `delete_step()`,
+        `set_step_data()`, `set_data()` and `set_n_repeats()`) in a journal
+        next to the protocol file, so they are not lost if the application
+        exits before the protocol is saved.  Use `compact_journal()` to save
+        the protocol and start a new journal.
+
+        If the protocol file was not saved with a journal, or edits from its
+        journal were applied when it was loaded, the protocol is compacted
+        (in a background thread, which is returned) and saved in `format`.
+        '''
+        self.close_journal()
+        if self.journal_id is None or getattr(self, 'n_replayed', 0):
+            return self.compact_journal(filename, background=True,
+                                        format=format)
+        journals = pending_journals(filename, self.journal_id)
+        if journals and journals[0][1][1] == self.journal_id:
+            self.journal = ProtocolJournal(journals[0][0], self.journal_id,
+                                           journals[0][1][2], append=True)
+        else:
+            self.journal = ProtocolJournal(journal_paths(filename)[0],
+                                           self.journal_id)
+        self.filename = filename
+        return None
+
+    def compact_journal(self, filename, background=False, format='pickle'):
+        '''
+        Save the protocol to `filename` (in `format`, see `save()`) and record
+        further edits in a new journal.
+
+        The protocol is written to a temporary file, which replaces
+        `filename` once it is complete.  Edits made while the file is written
+        are recorded in the new journal, which is applied on top of the
+        current journal if the application exits before the file is
+        replaced.
+
+        Args:
+            background: if `True`, write the file in a background thread and
+                return the thread (see `save()`).
+        '''
+        self.wait_for_compaction()
+        slots = journal_paths(filename)
+        parent_id = None
+        other_journal = None
+        if self.journal is not None:
+            if self.journal.filename in slots:
+                # Edits in the new journal apply on top of the current one.
+                parent_id = self.journal_id
+                slots.remove(self.journal.filename)
+            else:
+                # The protocol is saved to another file (e.g., "Save As"), so
+                # the unsaved edits in the current journal must not be applied
+                # to the file it belongs to.
+                other_journal = self.journal.filename
+            self.journal.close()
+        if parent_id is None:
+            # Prefer a free slot.
+            slots.sort(key=lambda p: p.isfile())
+        journal_path = slots[0]
+        self.journal_id = uuid.uuid4().hex
+        self.journal = ProtocolJournal(journal_path, self.journal_id,
+                                       parent_id)
+        self.filename = filename
+        temp_filename = '%s.tmp' % filename
+        write = self._get_writer(temp_filename, format,
+                                 background=background)
+
+        def compact():
+            write()
+            replace_file(temp_filename, filename)
+            # Journals of the replaced file no longer apply.
+            remove_journals(filename, keep=journal_path)
+            if other_journal is not None and other_journal.isfile():
+                other_journal.remove()
+
+        if not background:
+            compact()
+            return None
+
+        def compact_background():
+            try:
+                compact()
+            except Exception:
+                logger.error('Error saving protocol to %s.' % filename,
+                             exc_info=True)
+
+        self._compact_thread = threading.Thread(target=compact_background,
+                                                name='Protocol.compact_journal')
+        self._compact_thread.start()
+        return self._compact_thread
+
+    def wait_for_compaction(self):
+        thread = getattr(self, '_compact_thread', None)
+        if thread is not None:
+            thread.join()
+            self._compact_thread = None
+
+    def close_journal(self):
+        '''
+        Stop recording edits to the protocol (once the protocol file being
+        written, if any, is saved).
+        '''
+        self.wait_for_compaction()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def discard_journal(self):
+        '''
+        Stop recording edits to the protocol, and discard the edits recorded
+        since the protocol was last saved, so the protocol file is loaded as
+        it was last saved.
+        '''
+        self.wait_for_compaction()
+        if self.journal is not None:
+            self.journal.close()
+            try:
+                self.journal.filename.remove()
+            except OSError:
+                logger.warning('[Protocol] Could not remove %s.' %
+                               self.journal.filename)
+            self.journal = None
+
+    def decode_steps(self, background=False):
+        '''
+        Decode the data of all steps (in a background thread if `background`
+        is `True`).
+        '''
+        def decode(steps):
+            start_time = time.time()
+            for i, step in enumerate(steps):
+                try:
+                    step.decode_data()
+                except Exception:
+                    # The error is raised again when the step data is
+                    # accessed.
+                    logger.debug('[Protocol] error decoding step %d.' % i,
+                                 exc_info=True)
+            logger.debug('[Protocol] decoded steps in %f s.' %
+                         (time.time() - start_time))
+
+        steps = list(self.steps)
+        if background:
+            thread = threading.Thread(target=decode, args=(steps, ),
+                                      name='Protocol.decode_steps')
+            thread.daemon = True
+            thread.start()
+        else:
+            decode(steps)
+
     def _upgrade(self):
         """
         Upgrade the serialized object if necessary.
@@ -155,6 +415,16 @@ class Protocol():
     def plugins(self):
         return set(self.plugin_data.keys())
 
+    def get_referenced_plugins(self):
+        '''
+        Returns the names of the plugins with data in the protocol or in any
+        step (without decoding step data).
+        '''
+        plugins = set(self.plugin_data.keys())
+        for step in self.steps:
+            plugins.update(step.plugins)
+        return plugins
+
     def plugin_name_lookup(self, name, re_pattern=False):
         if not re_pattern:
             return name
@@ -174,6 +444,35 @@ class Protocol():
 
     def set_data(self, plugin_name, data):
         self.plugin_data[plugin_name] = data
+        if self.journal is not None:
+            self._journal('set_protocol_data', plugin_name,
+                          pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+
+    def set_n_repeats(self, n_repeats):
+        self.n_repeats = n_repeats
+        self._journal('set_attribute', 'n_repeats', n_repeats)
+
+    def set_step_data(self, step_number, plugin_name, data):
+        '''
+        Set the data of a plugin for a step, and record the change in the
+        journal (if any).
+        '''
+        self.steps[step_number].set_data(plugin_name, data)
+        self.record_step_data(step_number, plugin_name)
+
+    def record_step_data(self, step_number, plugin_name):
+        '''
+        Record the current data of a plugin for a step in the journal (e.g.,
+        after the data was modified in place, see `Step.edit_data()`).
+        '''
+        if self.journal is None:
+            return
+        data = self.steps[step_number].get_data(plugin_name)
+        if data is None:
+            self._journal('remove_data', step_number, plugin_name)
+        else:
+            self._journal('set_data', step_number, plugin_name,
+                          pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
 
     def __len__(self):
         return len(self.steps)
@@ -181,26 +480,111 @@ class Protocol():
     def __getitem__(self, i):
         return self.steps[i]
 
-    def save(self, filename, format='pickle'):
-        out = deepcopy(self)
-        if hasattr(out, 'filename'):
-            del out.filename
+    def save(self, filename, format='pickle', background=False,
+             compress=False):
+        """
+        Save the protocol to a file.
+
+        The protocol is not copied.  Instead, the data of each step is
+        serialized as the step is written to the file.  Step data that has not
+        been decoded since the protocol was loaded is written as-is, and data
+        objects shared by several steps (see `Step.copy()`) are only
+        serialized once.  In the `'container'` format, identical serialized
+        data is also only stored once.
+
+        Args:
+            filename: path to file.
+            format: `'pickle'`, `'yaml'` or `'container'` (see
+                `protocol_container`).  Files in the `'container'` format can
+                not be opened by previous versions (see `CHANGELOG`).
+            compress: if `True`, compress step data (`'container'` format
+                only).
+            background: if `True`, write the file in a background thread and
+                return the thread.  Only a shallow snapshot of the protocol is
+                taken before returning.  The step data objects are marked as
+                shared with the snapshot, so modifying them using
+                `Step.edit_data()` does not change the file being written.
+        """
+        write = self._get_writer(filename, format, compress, background)
 
+        if not background:
+            write()
+            return None
+
+        def write_background():
+            try:
+                write()
+            except Exception:
+                logger.error('Error saving protocol to %s.' % filename,
+                             exc_info=True)
+
+        thread = threading.Thread(target=write_background,
+                                  name='Protocol.save')
+        thread.start()
+        return thread
+
+    def _get_writer(self, filename, format='pickle', compress=False,
+                    background=False):
+        '''
+        Take a snapshot of the protocol and return a function that writes it
+        to a file (see `save()`).  If `background` is `True`, the step data
+        objects are marked as shared with the snapshot (see
+        `_step_snapshot()`).
+        '''
+        if format in ('pickle', 'container'):
+            pickle_protocol = pickle.HIGHEST_PROTOCOL
+        elif format == 'yaml':
+            pickle_protocol = 0
+        else:
+            raise TypeError
+        state = self.__dict__.copy()
+        for attribute in self._transient_attributes:
+            state.pop(attribute, None)
         # convert plugin data objects to strings
-        for k, v in out.plugin_data.items():
-            out.plugin_data[k] = pickle.dumps(v)
+        state['plugin_data'] = _encode_plugin_data(self.plugin_data,
+                                                   pickle_protocol)
+        snapshots = [_step_snapshot(step, background) for step in self.steps]
 
-        for step in out.steps:
-            for k, v in step.plugin_data.items():
-                step.plugin_data[k] = pickle.dumps(v)
-
-        with open(filename, 'wb') as f:
-            if format=='pickle':
-                pickle.dump(out, f, -1)
-            elif format=='yaml':
-                yaml.dump(out, f)
-            else:
-                raise TypeError
+        def write():
+            start_time = time.time()
+            # Serialized data of objects shared by several steps.  Cleared
+            # once the file is written.
+            memo = {}
+            with open(filename, 'wb') as f:
+                if format == 'pickle':
+                    state['steps'] = [_StepWriter(snapshot, pickle_protocol,
+                                                  memo)
+                                      for snapshot in snapshots]
+                    pickler = pickle.Pickler(f, pickle_protocol)
+                    # Do not keep a reference to each pickled object.
+                    pickler.fast = True
+                    pickler.dump(InstanceType(self.__class__, state))
+                elif format == 'container':
+                    attributes = dict([(k, v) for k, v in state.iteritems()
+                                       if k not in ('steps', 'plugin_data')])
+                    header = {'name': self.name, 'n_repeats': self.n_repeats,
+                              'version': self.version}
+                    write_container(f, header,
+                                    pickle.dumps(attributes, pickle_protocol),
+                                    state['plugin_data'],
+                                    [sorted(set(plugin_data) |
+                                            set(encoded_data))
+                                     for plugin_data, encoded_data in
+                                     snapshots],
+                                    lambda i: _StepWriter(snapshots[i],
+                                                          pickle_protocol,
+                                                          memo)
+                                    .get_state()['plugin_data'],
+                                    compress=compress)
+                else:
+                    state['steps'] = [_StepWriter(snapshot, pickle_protocol,
+                                                  memo).to_step()
+                                      for snapshot in snapshots]
+                    yaml.dump(InstanceType(self.__class__, state), f)
+            memo.clear()
+            logger.debug('[Protocol].save() saved in %f s.' %
+                         (time.time() - start_time))
+        return write
 
     def get_step_number(self, default):
         if default is None:
@@ -215,44 +599,79 @@ class Protocol():
         return self.steps[self.current_step_number]
 
     def insert_steps(self, step_number=None, count=None, values=None):
+        '''
+        Insert steps (`count` new steps, or the steps in `values`) before
+        `step_number` (or the current step).
+
+        Emits a single `on_steps_inserted` signal (and `on_step_created` for
+        each step to plugins that do not handle `on_steps_inserted`).
+        '''
         if values is None and count is None:
             raise ValueError, 'Either count or values must be specified'
         elif values is None:
-            values = [Step()] * count
-        for value in values[::-1]:
-            self.insert_step(step_number, value)
-
-    def insert_step(self, step_number=None, value=None):
+            values = [Step() for i in xrange(count)]
+        else:
+            values = list(values)
         if step_number is None:
             step_number = self.current_step_number
+        self.steps[step_number:step_number] = values
+        if self.journal is not None:
+            for i, value in enumerate(values):
+                self._journal('insert', step_number + i,
+                              _StepWriter(_step_snapshot(value),
+                                          pickle.HIGHEST_PROTOCOL)
+                              .get_state()['plugin_data'])
+        emit_batch_signal('on_steps_inserted', [step_number, len(values)],
+                          'on_step_created',
+                          [[step_number + i] for i in xrange(len(values))])
+
+    def insert_step(self, step_number=None, value=None):
         if value is None:
             value = Step()
-        self.steps.insert(step_number, value)
-        emit_signal('on_step_created', args=[self.current_step_number])
+        self.insert_steps(step_number, values=[value])
 
     def delete_step(self, step_number):
-        step_to_remove = self.steps[step_number]
-        del self.steps[step_number]
-        emit_signal('on_step_removed', args=[step_number, step_to_remove])
+        self.delete_steps([step_number])
+
+    def delete_steps(self, step_ids):
+        '''
+        Remove the steps at the specified indexes.
+
+        Emits a single `on_steps_removed` signal (and `on_step_removed` for
+        each step, in reverse order, to plugins that do not handle
+        `on_steps_removed`), then goes to the current step (or the last step,
+        if the current step was removed from the end of the protocol).
+        '''
+        step_numbers = sorted(set(step_ids))
+        if not step_numbers:
+            return
+        # Steps of a `StepTable` are views, which are not valid once steps are
+        # removed.
+        removed = [self.steps[i] for i in step_numbers]
+        removed = [step if isinstance(step, Step) else step.copy()
+                   for step in removed]
+        removed_ids = set(step_numbers)
+        self.steps[:] = [step for i, step in enumerate(self.steps)
+                         if i not in removed_ids]
+        if self.journal is not None:
+            # Delete in reverse order so the journal indexes stay valid.
+            for i in reversed(step_numbers):
+                self._journal('delete', i)
+        emit_batch_signal('on_steps_removed', [step_numbers, removed],
+                          'on_step_removed',
+                          [[i, step] for i, step in
+                           reversed(zip(step_numbers, removed))])
 
         if len(self.steps) == 0:
             # If we deleted the last remaining step, we need to insert a new
             # default Step
             self.insert_step(0, Step())
             self.goto_step(0)
-        elif self.current_step_number == len(self.steps):
-            self.goto_step(step_number - 1)
+        elif self.current_step_number >= len(self.steps):
+            self.goto_step(len(self.steps) - 1)
         else:
             self.goto_step(self.current_step_number)
 
-    def delete_steps(self, step_ids):
-        sorted_ids = sorted(step_ids)
-        # Process deletion of steps in reverse order to avoid ID mismatch due
-        # to deleted rows.
-        sorted_ids.reverse()
-        for id in sorted_ids:
-            self.delete_step(id)
-
     def next_step(self):
         if self.current_step_number == len(self.steps) - 1:
             self.insert_step(self.current_step_number,
@@ -277,45 +696,312 @@ class Protocol():
     def last_step(self):
         self.goto_step(len(self.steps) - 1)
 
-    def goto_step(self, step_number):
+    def goto_step(self, step_number, plugins=None):
+        '''
+        Args:
+            step_number: index of step to go to.
+            plugins: names of the plugins with data for the step (e.g., from
+                an `ExecutionPlan`).  By default, the plugins are looked up in
+                the step.
+        '''
         logging.debug('[Protocol].goto_step(%s)' % step_number)
         self.current_step_number = step_number
         original_step_number = self.current_step_number
-        for plugin_name in self.current_step().plugins:
+        if plugins is None:
+            plugins = self.current_step().plugins
+        for plugin_name in plugins:
             emit_signal('on_step_options_swapped',
                     [plugin_name,
                     original_step_number,
                     step_number],
                     interface=IPlugin)
-        with closing(StringIO()) as sio:
-            for plugin_name, fields in self.plugin_fields.iteritems():
-                observers = ExtensionPoint(IPlugin)
-                service = observers.service(plugin_name)
-                if service is None:
-                    # We can end up here if a service has been disabled.
-                    # TODO: protocol.plugin_fields should likely be updated
-                    #    whenever a plugin is enabled/disabled...
-                    continue
-                if hasattr(service, 'get_step_value'):
-                    print >> sio, '[ProtocolController] plugin.name=%s field_values='\
-                            % (plugin_name),
-                    print >> sio, [service.get_step_value(f) for f in fields]
-            logging.debug(sio.getvalue())
+        # Only take a (copy-on-write) snapshot of the step data; the field
+        # values are looked up if the event is formatted.
+        plugin_fields = self.plugin_fields
+        snapshot = _step_snapshot(self.current_step(), shared=True)
+        record_event('protocol.goto_step', step_number=step_number,
+                     field_values=lambda: _get_field_values(plugin_fields,
+                                                            snapshot))
         emit_signal('on_step_swapped', [original_step_number, step_number])
 
+def decode_step_data(data):
+    '''
+    Decode the serialized data of a plugin for a step (see `Protocol.save`).
+    '''
+    try:
+        return pickle.loads(data)
+    except Exception, e:
+        # enable loading of old protocols where the
+        # dmf_device_controller was imported as a relative
+        # package
+        data = data.replace('!!python/object:gui.'
+                                'dmf_device_controller.',
+                            '!!python/object:microdrop.gui.'
+                                'dmf_device_controller.')
+        return yaml.load(data)
+
+
+class _Payload(object):
+    '''
+    Serialized plugin data shared by several steps (see `_share_payloads()`).
+    The data is decoded once, and the decoded object is shared by the steps.
+    '''
+    __slots__ = ('data', 'value', 'decoded')
+
+    def __init__(self, data):
+        self.data = data
+        self.value = None
+        self.decoded = False
+
+    def decode(self):
+        # Called with `_decode_lock` held (see `Step.decode_data()`).
+        if not self.decoded:
+            self.value = decode_step_data(self.data)
+            self.decoded = True
+        return self.value
+
+
+def _share_payloads(data, payloads):
+    '''
+    Returns a copy of a dictionary of serialized plugin data, where each
+    value is replaced by the `_Payload` for that value in `payloads` (if
+    `payloads` is not `None`).
+    '''
+    if payloads is None:
+        return data
+    shared = {}
+    for plugin_name, value in data.iteritems():
+        payload = payloads.get(value)
+        if payload is None:
+            payload = payloads[value] = _Payload(value)
+        shared[plugin_name] = payload
+    return shared
+
+
+def _decode_step(data, enabled_plugins, payloads=None):
+    '''
+    Returns a `Step` with the serialized plugin data from `data`.  The data of
+    plugins that are enabled is decoded on first access (see
+    `_share_payloads()` for `payloads`).
+    '''
+    step = Step()
+    encoded_data = {}
+    for k, v in data.iteritems():
+        if k in enabled_plugins:
+            encoded_data[k] = v
+        else:
+            step._plugin_data[k] = v
+    step.set_encoded_data(_share_payloads(encoded_data, payloads))
+    return step
+
+
+# Serializes decoding of step data by `Step.decode_data` across threads.
+_decode_lock = threading.Lock()
+
+
+def _encode_plugin_data(plugin_data, protocol, memo=None):
+    '''
+    Serialize each plugin data object.  If `memo` is not `None`, objects that
+    were already serialized with the same `memo` are not serialized again.
+    '''
+    if memo is None:
+        return dict([(k, pickle.dumps(v, protocol))
+                     for k, v in plugin_data.iteritems()])
+    encoded = {}
+    for k, v in plugin_data.iteritems():
+        entry = memo.get(id(v))
+        if entry is None:
+            # Keep a reference to the object, so its id is not reused.
+            entry = memo[id(v)] = (v, pickle.dumps(v, protocol))
+        encoded[k] = entry[1]
+    return encoded
+
+
+def _encoded_value(value):
+    if isinstance(value, _Payload):
+        return value.data
+    return value
+
+
+def _get_field_values(plugin_fields, snapshot):
+    '''
+    Returns a dictionary mapping each plugin name to the values of its step
+    fields (see `Protocol.plugin_fields`) in a step snapshot (see
+    `_step_snapshot()`).
+    '''
+    plugin_data, encoded_data = snapshot
+    field_values = {}
+    for plugin_name, fields in plugin_fields.iteritems():
+        if plugin_name in plugin_data:
+            data = plugin_data[plugin_name]
+        elif plugin_name in encoded_data:
+            data = decode_step_data(_encoded_value(encoded_data[plugin_name]))
+        else:
+            continue
+        if isinstance(data, dict):
+            field_values[plugin_name] = [data.get(f) for f in fields]
+        else:
+            field_values[plugin_name] = [getattr(data, f, None)
+                                         for f in fields]
+    return field_values
+
+
+def _step_snapshot(step, shared=False):
+    '''
+    Returns a shallow copy of the plugin data of a step (or `StepView`), and
+    of its serialized plugin data that has not been decoded.
+
+    If `shared` is `True`, the data objects are marked as shared with the
+    snapshot, so `Step.edit_data()` copies them before they are modified
+    (e.g., while the snapshot is written by a background thread).
+    '''
+    if isinstance(step, Step):
+        with _decode_lock:
+            if shared:
+                step._shared.update(step._plugin_data)
+            return dict(step._plugin_data), dict(step._encoded_data)
+    # e.g., a `step_table.StepView`.
+    return step.snapshot(shared)
+
+
+class _StepWriter(object):
+    '''
+    Pickled as a `Step` with serialized plugin data (as read by
+    `Protocol.load`).  The plugin data is only serialized when the step is
+    written.
+    '''
+    def __init__(self, snapshot, protocol, memo=None):
+        self.snapshot = snapshot
+        self.protocol = protocol
+        self.memo = memo
+
+    def get_state(self):
+        plugin_data, encoded_data = self.snapshot
+        state = {'plugin_data': _encode_plugin_data(plugin_data,
+                                                    self.protocol,
+                                                    self.memo)}
+        for plugin_name, value in encoded_data.iteritems():
+            state['plugin_data'][plugin_name] = _encoded_value(value)
+        return state
+
+    def to_step(self):
+        step = Step.__new__(Step)
+        step.__setstate__(self.get_state())
+        return step
+
+    def __reduce__(self):
+        return (copy_reg._reconstructor, (Step, object, None),
+                self.get_state())
+
+
 class Step(object):
     def __init__(self, plugin_data=None):
         if plugin_data is None:
-            self.plugin_data = {}
+            self._plugin_data = {}
         else:
-            self.plugin_data = deepcopy(plugin_data)
+            self._plugin_data = deepcopy(plugin_data)
+        # Serialized data of plugins, by plugin name (see
+        # `set_encoded_data()`).
+        self._encoded_data = {}
+        # Names of plugins whose data object may be shared with a copy of
+        # this step (see `copy()`).
+        self._shared = set()
+
+    def __getstate__(self):
+        # Keep the attributes written by previous versions.
+        self.decode_data()
+        state = self.__dict__.copy()
+        del state['_encoded_data']
+        del state['_shared']
+        state['plugin_data'] = state.pop('_plugin_data')
+        return state
+
+    def __setstate__(self, state):
+        state = state.copy()
+        self._plugin_data = state.pop('plugin_data', {})
+        self._encoded_data = {}
+        self._shared = set()
+        self.__dict__.update(state)
+
+    @property
+    def plugin_data(self):
+        '''
+        Dictionary containing the data of each plugin.  Note that data
+        objects may be shared with copies of the step (see `copy()`).
+        '''
+        self.decode_data()
+        return self._plugin_data
+
+    @plugin_data.setter
+    def plugin_data(self, value):
+        with _decode_lock:
+            self._plugin_data = value
+            self._encoded_data = {}
+            self._shared = set()
+
+    def set_encoded_data(self, encoded_data):
+        '''
+        Set the serialized data of one or more plugins.  The data of each
+        plugin is decoded (and cached) the first time it is accessed.
+
+        Args:
+            encoded_data: dictionary mapping plugin names to data serialized
+                by `Protocol.save`.
+        '''
+        with _decode_lock:
+            for plugin_name in encoded_data:
+                self._plugin_data.pop(plugin_name, None)
+            self._encoded_data.update(encoded_data)
+
+    def decode_data(self, plugin_name=None):
+        '''
+        Decode the serialized data of a plugin (or of all plugins).
+        '''
+        if not self._encoded_data:
+            return
+        with _decode_lock:
+            if plugin_name is None:
+                plugin_names = self._encoded_data.keys()
+            elif plugin_name in self._encoded_data:
+                plugin_names = [plugin_name]
+            else:
+                return
+            for name in plugin_names:
+                value = self._encoded_data[name]
+                if isinstance(value, _Payload):
+                    # The decoded object is shared with other steps.
+                    self._plugin_data[name] = value.decode()
+                    self._shared.add(name)
+                else:
+                    self._plugin_data[name] = decode_step_data(value)
+                del self._encoded_data[name]
+
+    @property
+    def decoded(self):
+        return not self._encoded_data
 
     def copy(self):
-        return Step(plugin_data=deepcopy(self.plugin_data))
+        '''
+        Returns a copy of the step that shares the plugin data objects of this
+        step (copy-on-write).
+
+        Data that is replaced using `set_data()` is no longer shared, and
+        `edit_data()` returns a private copy of shared data that may be
+        modified in place, so changes to one step are never visible in the
+        other.  Serialized data that has not been decoded yet is shared as
+        is, and is decoded separately by each step.
+        '''
+        step = Step.__new__(Step)
+        with _decode_lock:
+            step._plugin_data = self._plugin_data.copy()
+            step._encoded_data = self._encoded_data.copy()
+            self._shared.update(self._plugin_data)
+            step._shared = set(self._plugin_data)
+        return step
 
     @property
     def plugins(self):
-        return set(self.plugin_data.keys())
+        return set(self._plugin_data.keys()) | set(self._encoded_data.keys())
 
     def plugin_name_lookup(self, name, re_pattern=False):
         if not re_pattern:
@@ -327,8 +1013,37 @@ class Step(object):
         return None
 
     def get_data(self, plugin_name):
-        logging.debug('[Step] plugin_data=%s' % self.plugin_data)
-        return self.plugin_data.get(plugin_name)
+        '''
+        Returns the data of a plugin.  The returned object may be shared with
+        copies of the step, so it must not be modified in place (use
+        `set_data()` or `edit_data()`).
+        '''
+        self.decode_data(plugin_name)
+        return self._plugin_data.get(plugin_name)
+
+    def edit_data(self, plugin_name):
+        '''
+        Returns the data of a plugin, which may be modified in place.  If the
+        data is shared with a copy of the step, it is replaced by a private
+        (deep) copy first.
+        '''
+        self.decode_data(plugin_name)
+        with _decode_lock:
+            if plugin_name in self._shared:
+                self._shared.discard(plugin_name)
+                if plugin_name in self._plugin_data:
+                    self._plugin_data[plugin_name] = \
+                        deepcopy(self._plugin_data[plugin_name])
+            return self._plugin_data.get(plugin_name)
 
     def set_data(self, plugin_name, data):
-        self.plugin_data[plugin_name] = data
+        with _decode_lock:
+            self._encoded_data.pop(plugin_name, None)
+            self._shared.discard(plugin_name)
+            self._plugin_data[plugin_name] = data
+
+    def remove_data(self, plugin_name):
+        with _decode_lock:
+            self._encoded_data.pop(plugin_name, None)
+            self._shared.discard(plugin_name)
+            self._plugin_data.pop(plugin_name, None)
@@ -0,0 +1,227 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+
+Container file format for protocols (see `Protocol.save(format='container')`).
+
+A container file starts with the magic bytes `MDPROTO\\0`, a format version
+(`uint16`), flags (`uint8`, see `FLAG_ZLIB`) and the length (`uint32`) of a
+JSON header, followed by:
+
+ - the header, containing the protocol `name`, `n_repeats`, `version`, the
+   number of steps (`n_steps`) and the sorted list of names of the plugins
+   with data in the protocol (`plugins`);
+ - the location (`uint64` offset, `uint32` length) of the blob holding the
+   other (pickled) protocol attributes;
+ - the first entry (`uint32`) and number of entries (`uint16`) of the
+   protocol plugin data;
+ - a step table: the first entry (`uint32`) and number of entries (`uint16`)
+   of each step;
+ - an entry table: the plugin (`uint16` index into `plugins`) and the
+   location (`uint64` offset, `uint32` length) of each plugin data blob;
+ - the blobs.
+
+Plugin data blobs hold the data serialized by `Protocol.save` (compressed
+with zlib if `FLAG_ZLIB` is set), so the data of a step (or plugin) can be
+read without reading the rest of the file.  Identical blobs (e.g., the same
+electrode states in many steps) are only stored once: entries refer to the
+location of the first copy.
+
+All integers are little-endian.
+"""
+
+import json
+import struct
+import zlib
+
+MAGIC = 'MDPROTO\0'
+FORMAT_VERSION = 1
+
+FLAG_ZLIB = 0x1
+
+_PREFIX = struct.Struct('<HBI')
+_LOCATION = struct.Struct('<QI')
+_RANGE = struct.Struct('<IH')
+_ENTRY = struct.Struct('<HQI')
+
+
+def is_container(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _read_prefix(f, filename):
+    if f.read(len(MAGIC)) != MAGIC:
+        raise TypeError, 'File is not a protocol container: %s' % filename
+    version, flags, header_length = _PREFIX.unpack(f.read(_PREFIX.size))
+    if version > FORMAT_VERSION:
+        raise TypeError, 'Unsupported protocol container version: %d' % \
+            version
+    header = json.loads(f.read(header_length))
+    return flags, header
+
+
+def read_header(filename):
+    '''
+    Returns the header of a protocol container file as a dictionary.
+
+    Raises:
+        TypeError: file is not a protocol container.
+    '''
+    with open(filename, 'rb') as f:
+        return _read_prefix(f, filename)[1]
+
+
+def write_container(f, header, attributes, plugin_data, step_plugins,
+                    encode_step, compress=False, dedup=True):
+    '''
+    Write a protocol container to a file object (opened in binary mode, and
+    seekable).
+
+    Args:
+        header: JSON-serializable dictionary (`n_steps` and `plugins` are
+            added).
+        attributes: serialized protocol attributes.
+        plugin_data: serialized protocol plugin data, by plugin name.
+        step_plugins: list containing the names of the plugins with data in
+            each step.
+        encode_step: function returning the serialized plugin data (by plugin
+            name) of the step at the specified index.  Only called once per
+            step, in order, so each step can be serialized as it is written.
+        compress: if `True`, compress blobs using zlib.
+        dedup: if `True`, only store one copy of identical blobs.
+    '''
+    plugins = set(plugin_data)
+    for names in step_plugins:
+        plugins.update(names)
+    plugins = sorted(plugins)
+    plugin_ids = dict([(name, i) for i, name in enumerate(plugins)])
+    header = dict(header, n_steps=len(step_plugins), plugins=plugins)
+    header_data = json.dumps(header)
+    flags = FLAG_ZLIB if compress else 0
+
+    n_entries = len(plugin_data) + sum([len(names)
+                                        for names in step_plugins])
+    start = f.tell()
+    f.write(MAGIC + _PREFIX.pack(FORMAT_VERSION, flags, len(header_data)) +
+            header_data)
+    tables_offset = f.tell()
+    blobs_offset = (tables_offset + _LOCATION.size + _RANGE.size *
+                    (1 + len(step_plugins)) + _ENTRY.size * n_entries)
+    f.seek(blobs_offset)
+
+    entries = []
+    ranges = []
+    # Location of each blob written, by content.
+    locations = {}
+
+    def write_blob(data):
+        if dedup:
+            location = locations.get(data)
+            if location is not None:
+                return location
+        key = data
+        if compress:
+            data = zlib.compress(data)
+        offset = f.tell() - start
+        f.write(data)
+        if dedup:
+            locations[key] = offset, len(data)
+        return offset, len(data)
+
+    def write_blobs(blobs):
+        ranges.append((len(entries), len(blobs)))
+        for name in sorted(blobs):
+            entries.append((plugin_ids[name], ) + write_blob(blobs[name]))
+
+    attributes_location = write_blob(attributes)
+    write_blobs(plugin_data)
+    for i, names in enumerate(step_plugins):
+        blobs = encode_step(i)
+        if set(blobs) != set(names):
+            raise ValueError, 'Plugins of step %d changed while saving.' % i
+        write_blobs(blobs)
+    end = f.tell()
+
+    f.seek(tables_offset)
+    f.write(_LOCATION.pack(*attributes_location))
+    f.write(''.join([_RANGE.pack(*r) for r in ranges]))
+    f.write(''.join([_ENTRY.pack(*e) for e in entries]))
+    f.seek(end)
+
+
+class ContainerReader(object):
+    '''
+    Read a protocol container file.
+
+    The file is read into memory, so it may be overwritten after the reader
+    is created.
+    '''
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.flags, self.header = _read_prefix(f, filename)
+            self._tables_offset = f.tell()
+            f.seek(0)
+            self._data = f.read()
+        # Plugin names are `str` in other protocol formats.
+        self.plugins = [name.encode('utf8') for name in
+                        self.header['plugins']]
+        self.n_steps = self.header['n_steps']
+        self._ranges_offset = self._tables_offset + _LOCATION.size
+        self._entries_offset = self._ranges_offset + _RANGE.size * \
+            (1 + self.n_steps)
+        # Blobs that were read, by location.  Identical blobs are stored once,
+        # so the same string is returned for each entry referring to a blob.
+        self._blobs_read = {}
+
+    def _blob(self, offset, length):
+        data = self._blobs_read.get((offset, length))
+        if data is None:
+            data = self._data[offset:offset + length]
+            if self.flags & FLAG_ZLIB:
+                data = zlib.decompress(data)
+            self._blobs_read[offset, length] = data
+        return data
+
+    def _blobs(self, index):
+        first, count = _RANGE.unpack_from(self._data, self._ranges_offset +
+                                          _RANGE.size * index)
+        blobs = {}
+        for i in xrange(first, first + count):
+            plugin_id, offset, length = \
+                _ENTRY.unpack_from(self._data, self._entries_offset +
+                                   _ENTRY.size * i)
+            blobs[self.plugins[plugin_id]] = self._blob(offset, length)
+        return blobs
+
+    def attributes(self):
+        return self._blob(*_LOCATION.unpack_from(self._data,
+                                                 self._tables_offset))
+
+    def plugin_data(self):
+        '''
+        Returns the serialized protocol plugin data, by plugin name.
+        '''
+        return self._blobs(0)
+
+    def step_data(self, step_number):
+        '''
+        Returns the serialized plugin data of a step, by plugin name.
+        '''
+        if not 0 <= step_number < self.n_steps:
+            raise IndexError, 'step index out of range'
+        return self._blobs(step_number + 1)
@@ -0,0 +1,186 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+
+Append-only journal of the edits made to a saved protocol (see
+`Protocol.open_journal()`).
+
+Each edit is appended to the journal as a pickled record, so the cost of
+persisting an edit does not depend on the size of the protocol.  Journals are
+compacted by saving the full protocol (see `Protocol.compact_journal()`).
+
+A protocol file is identified by the `journal_id` attribute it was saved
+with.  A journal starts with a header record, `('journal', base_id,
+parent_id)`, where `base_id` is the `journal_id` of the protocol file the
+records apply to.  While a protocol is being compacted (i.e., saved with a new
+`journal_id`), new records are written to a second journal whose `parent_id`
+is the `journal_id` of the current file, since they apply on top of the
+records of the first journal until the new file replaces the current one.
+
+Each protocol file has two journal slots (`<protocol>.journal-0` and
+`<protocol>.journal-1`), which are used alternately.
+"""
+
+import os
+import logging
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from path_helpers import path
+
+
+N_SLOTS = 2
+
+
+class ProtocolJournal(object):
+    '''
+    Journal file open for appending records.
+    '''
+    def __init__(self, filename, base_id, parent_id=None, append=False):
+        self.filename = path(filename)
+        self.base_id = base_id
+        self.parent_id = parent_id
+        if append:
+            self.n_records = len(read_journal(self.filename)[1])
+            self._file = open(self.filename, 'ab')
+        else:
+            self.n_records = 0
+            self._file = open(self.filename, 'wb')
+            self._write(('journal', base_id, parent_id))
+
+    def _write(self, record):
+        self._file.write(pickle.dumps(record, pickle.HIGHEST_PROTOCOL))
+        # Flush each record, so it is not lost if the application crashes.
+        self._file.flush()
+
+    def append(self, record):
+        self._write(record)
+        self.n_records += 1
+
+    @property
+    def size(self):
+        return self._file.tell()
+
+    @property
+    def closed(self):
+        return self._file.closed
+
+    def close(self):
+        self._file.close()
+
+    def __repr__(self):
+        return '<ProtocolJournal %s (%d records)>' % (self.filename.name,
+                                                      self.n_records)
+
+
+def journal_paths(filename):
+    '''
+    Returns the paths of the journal slots of a protocol file.
+    '''
+    filename = path(filename)
+    return [filename.parent.joinpath('%s.journal-%d' % (filename.name, i))
+            for i in range(N_SLOTS)]
+
+
+def read_journal(filename):
+    '''
+    Returns the header and the records of a journal file.
+
+    A record that was only partly written (e.g., if the application crashed)
+    and all records following it are ignored.
+
+    Returns:
+        (header, records): `header` is `None` if the file is not a journal.
+    '''
+    header = None
+    records = []
+    with open(filename, 'rb') as f:
+        while True:
+            try:
+                record = pickle.load(f)
+            except EOFError:
+                break
+            except Exception:
+                logging.warning('[ProtocolJournal] Ignoring truncated record '
+                                'in %s.' % filename)
+                break
+            if header is None:
+                if not (isinstance(record, tuple) and record and
+                        record[0] == 'journal'):
+                    break
+                header = record
+            else:
+                records.append(record)
+    return header, records
+
+
+def pending_journals(filename, journal_id):
+    '''
+    Returns the journals with records that must be applied to a protocol file
+    (saved with the specified `journal_id`), in the order they must be
+    applied.
+
+    Returns:
+        list of `(journal path, header, records)` tuples.
+    '''
+    if journal_id is None:
+        return []
+    journals = []
+    for journal_path in journal_paths(filename):
+        if not journal_path.isfile():
+            continue
+        header, records = read_journal(journal_path)
+        if header is None:
+            continue
+        base_id, parent_id = header[1:3]
+        if base_id == journal_id:
+            # Records apply directly to the protocol file.
+            journals.insert(0, (journal_path, header, records))
+        elif parent_id == journal_id:
+            # Records were written while the protocol was being compacted,
+            # and the compacted file did not replace the protocol file.
+            journals.append((journal_path, header, records))
+    return journals
+
+
+def remove_journals(filename, keep=None):
+    '''
+    Remove the journal files of a protocol file (except `keep`).
+    '''
+    for journal_path in journal_paths(filename):
+        if journal_path != keep and journal_path.isfile():
+            try:
+                journal_path.remove()
+            except OSError:
+                logging.warning('[ProtocolJournal] Could not remove %s.' %
+                                journal_path)
+
+
+def replace_file(src, dest):
+    '''
+    Move `src` to `dest`, replacing `dest` if it exists.
+    '''
+    try:
+        os.rename(src, dest)
+    except OSError:
+        # `os.rename` does not replace existing files on Windows.
+        if not os.path.isfile(dest):
+            raise
+        os.remove(dest)
+        os.rename(src, dest)
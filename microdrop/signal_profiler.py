@@ -0,0 +1,135 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+import threading
+from StringIO import StringIO
+from contextlib import closing
+
+
+class LatencyHistogram(object):
+    '''
+    Fixed-size histogram of call durations.
+
+    Bins are logarithmic (base 2), starting at `resolution` seconds, so a
+    histogram uses the same amount of memory no matter how many calls are
+    recorded.
+    '''
+    def __init__(self, n_bins=32, resolution=1e-6):
+        self.resolution = resolution
+        self.bins = [0] * n_bins
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def bin_index(self, duration):
+        if duration <= self.resolution:
+            return 0
+        index = int(math.log(duration / self.resolution, 2)) + 1
+        return min(index, len(self.bins) - 1)
+
+    def bin_upper_bound(self, index):
+        return self.resolution * 2 ** index
+
+    def record(self, duration):
+        self.bins[self.bin_index(duration)] += 1
+        self.count += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+
+    @property
+    def mean(self):
+        if not self.count:
+            return 0.
+        return self.total / self.count
+
+    def percentile(self, q):
+        '''
+        Return an upper bound on the `q`-th percentile (0 < q <= 100), with
+        the precision of the histogram bins.
+        '''
+        if not self.count:
+            return 0.
+        threshold = self.count * q / 100.
+        cumulative = 0
+        for i, n in enumerate(self.bins):
+            cumulative += n
+            if cumulative >= threshold:
+                return min(self.bin_upper_bound(i), self.max)
+        return self.max
+
+
+class SignalProfiler(object):
+    '''
+    Collect per-plugin, per-signal call latencies.
+
+    See `plugin_manager.enable_profiling()`.
+    '''
+    def __init__(self, n_bins=32, resolution=1e-6):
+        self.n_bins = n_bins
+        self.resolution = resolution
+        self._lock = threading.Lock()
+        self.histograms = {}
+
+    def record(self, plugin_name, function, duration):
+        key = (plugin_name, function)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = LatencyHistogram(self.n_bins, self.resolution)
+                self.histograms[key] = histogram
+            histogram.record(duration)
+
+    def get(self, plugin_name, function):
+        return self.histograms.get((plugin_name, function))
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def summary(self):
+        '''
+        Return a list of `(plugin_name, function, histogram)` tuples, sorted
+        by total time spent (slowest first).
+        '''
+        with self._lock:
+            items = self.histograms.items()
+        return [(plugin_name, function, histogram)
+                for (plugin_name, function), histogram in
+                sorted(items, key=lambda x: x[1].total, reverse=True)]
+
+    def report(self):
+        with closing(StringIO()) as report:
+            print >> report, '%-45s %-30s %8s %10s %10s %10s %10s' % (
+                'plugin', 'signal', 'calls', 'total (ms)', 'mean (ms)',
+                'p95 (ms)', 'max (ms)')
+            for plugin_name, function, histogram in self.summary():
+                print >> report, ('%-45s %-30s %8d %10.3f %10.3f %10.3f '
+                                  '%10.3f' % (plugin_name, function,
+                                              histogram.count,
+                                              1e3 * histogram.total,
+                                              1e3 * histogram.mean,
+                                              1e3 * histogram.percentile(95),
+                                              1e3 * histogram.max))
+            return report.getvalue()
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.report())
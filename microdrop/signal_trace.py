@@ -0,0 +1,228 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+
+Compact binary trace of the signals emitted through
+`plugin_manager.emit_signal()`.
+
+A trace file starts with the magic bytes `MDSIGTRC` and a format version
+(`uint16`), followed by a sequence of records, each starting with a record
+type byte:
+
+ - `RECORD_STRING`: defines a string (`uint32` id, `uint16` length, UTF-8
+   bytes).  Signal names, interface names, plugin names and string arguments
+   are written once and referenced by id afterwards.
+ - `RECORD_SIGNAL`: one emitted signal (start time relative to the start of
+   the trace, total duration, signal and interface name ids, arguments, and
+   the `(plugin name id, duration)` of each handler, in call order).
+
+Arguments of type `None`, `bool`, `int`, `float` and `str` are stored by
+value.  Other arguments are stored as a (truncated) `repr` summary and are
+read back as `TraceArgument` instances.
+
+All integers and floats are little-endian.
+"""
+
+import struct
+import threading
+from collections import namedtuple
+from timeit import default_timer
+
+MAGIC = 'MDSIGTRC'
+FORMAT_VERSION = 1
+
+RECORD_STRING = 1
+RECORD_SIGNAL = 2
+
+ARG_NONE = 0
+ARG_BOOL = 1
+ARG_INT = 2
+ARG_FLOAT = 3
+ARG_STR = 4
+ARG_SUMMARY = 5
+
+MAX_SUMMARY_LENGTH = 80
+
+SignalEvent = namedtuple('SignalEvent', 'time duration function interface '
+                         'args observers')
+
+
+class TraceArgument(object):
+    '''
+    Placeholder for a signal argument that was recorded as a summary.
+    '''
+    def __init__(self, summary):
+        self.summary = summary
+
+    def __repr__(self):
+        return 'TraceArgument(%r)' % self.summary
+
+
+class SignalTraceWriter(object):
+    '''
+    Write signals to a binary trace file.
+
+    See `plugin_manager.enable_signal_recording()`.
+
+    Args:
+        filename: path of trace file to write.
+        exclude_interfaces: names of interfaces whose signals should not be
+            recorded (e.g., `('ILoggingPlugin', )`).
+    '''
+    def __init__(self, filename, exclude_interfaces=None):
+        self.filename = filename
+        self.exclude_interfaces = set(exclude_interfaces or [])
+        self._strings = {}
+        self._lock = threading.Lock()
+        self._start = default_timer()
+        self._output = open(filename, 'wb')
+        self._output.write(MAGIC + struct.pack('<H', FORMAT_VERSION))
+
+    def _string_id(self, value, chunks):
+        if isinstance(value, unicode):
+            value = value.encode('utf8')
+        string_id = self._strings.get(value)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._strings[value] = string_id
+            data = value[:0xffff]
+            chunks.append(struct.pack('<BIH', RECORD_STRING, string_id,
+                                      len(data)) + data)
+        return string_id
+
+    def _pack_arg(self, arg, chunks):
+        if arg is None:
+            return struct.pack('<B', ARG_NONE)
+        elif isinstance(arg, bool):
+            return struct.pack('<B?', ARG_BOOL, arg)
+        elif isinstance(arg, (int, long)) and -2 ** 63 <= arg < 2 ** 63:
+            return struct.pack('<Bq', ARG_INT, arg)
+        elif isinstance(arg, float):
+            return struct.pack('<Bd', ARG_FLOAT, arg)
+        elif isinstance(arg, basestring):
+            return struct.pack('<BI', ARG_STR, self._string_id(arg, chunks))
+        summary = repr(arg)[:MAX_SUMMARY_LENGTH]
+        return struct.pack('<BI', ARG_SUMMARY, self._string_id(summary,
+                                                               chunks))
+
+    def record(self, function, interface, args, timings, start, duration):
+        '''
+        Args:
+            function: signal name.
+            interface: interface class the signal was emitted for.
+            args: list of signal arguments.
+            timings: list of `(observer name, duration)` in call order.
+            start: `timeit.default_timer()` value when the signal was emitted.
+            duration: total time spent emitting the signal.
+        '''
+        interface_name = interface.__name__
+        if interface_name in self.exclude_interfaces:
+            return
+        with self._lock:
+            if self._output is None:
+                return
+            chunks = []
+            function_id = self._string_id(function, chunks)
+            interface_id = self._string_id(interface_name, chunks)
+            body = [struct.pack('<BddIIB', RECORD_SIGNAL, start - self._start,
+                                duration, function_id, interface_id,
+                                len(args))]
+            body += [self._pack_arg(arg, chunks) for arg in args]
+            body.append(struct.pack('<H', len(timings)))
+            body += [struct.pack('<Id', self._string_id(name, chunks),
+                                 observer_duration or 0.)
+                     for name, observer_duration in timings]
+            self._output.write(''.join(chunks + body))
+
+    def close(self):
+        with self._lock:
+            if self._output is not None:
+                self._output.close()
+                self._output = None
+
+
+class _Reader(object):
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, format):
+        values = struct.unpack_from(format, self.data, self.offset)
+        self.offset += struct.calcsize(format)
+        return values
+
+    def read(self, length):
+        value = self.data[self.offset:self.offset + length]
+        self.offset += length
+        return value
+
+
+def read_trace(filename):
+    '''
+    Generate a `SignalEvent` for each signal recorded in a trace file.
+
+    Raises:
+        TypeError: file is not a signal trace.
+    '''
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise TypeError, 'File is not a signal trace: %s' % filename
+    reader = _Reader(data)
+    reader.offset = len(MAGIC)
+    version, = reader.unpack('<H')
+    if version > FORMAT_VERSION:
+        raise TypeError, 'Unsupported signal trace version: %d' % version
+
+    strings = {}
+    while reader.offset < len(data):
+        try:
+            record_type, = reader.unpack('<B')
+            if record_type == RECORD_STRING:
+                string_id, length = reader.unpack('<IH')
+                strings[string_id] = reader.read(length)
+            elif record_type == RECORD_SIGNAL:
+                start, duration, function_id, interface_id, n_args = \
+                    reader.unpack('<ddIIB')
+                args = []
+                for i in range(n_args):
+                    tag, = reader.unpack('<B')
+                    if tag == ARG_NONE:
+                        args.append(None)
+                    elif tag == ARG_BOOL:
+                        args.append(reader.unpack('<?')[0])
+                    elif tag == ARG_INT:
+                        args.append(reader.unpack('<q')[0])
+                    elif tag == ARG_FLOAT:
+                        args.append(reader.unpack('<d')[0])
+                    elif tag == ARG_STR:
+                        args.append(strings[reader.unpack('<I')[0]])
+                    else:
+                        args.append(TraceArgument(strings[reader
+                                                          .unpack('<I')[0]]))
+                n_observers, = reader.unpack('<H')
+                observers = []
+                for i in range(n_observers):
+                    name_id, observer_duration = reader.unpack('<Id')
+                    observers.append((strings[name_id], observer_duration))
+                yield SignalEvent(start, duration, strings[function_id],
+                                  strings[interface_id], args, observers)
+            else:
+                raise TypeError, 'Invalid record type: %d' % record_type
+        except struct.error:
+            # Trace was truncated (e.g., application crashed while writing).
+            return
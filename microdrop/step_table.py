@@ -0,0 +1,659 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+
+Columnar storage for protocol steps.
+
+A `StepTable` stores step options as one array per `(plugin name, field
+name)`.  Fields holding `bool`, `int` or `float` values use typed arrays;
+other fields (or fields holding a mix of types) use object arrays.  Plugin
+data that is not a `dict` is stored as-is in a per-plugin object column.
+
+A `StepTable` implements the list operations used by `Protocol` on
+`Protocol.steps`, so it can be used in place of a list of `Step` objects:
+
+    protocol.steps = StepTable.from_steps(protocol.steps)
+
+Indexing a `StepTable` with an integer returns a `StepView`, which reads and
+writes the table directly.  Since a view refers to a row by index, views
+should not be kept across insertions or deletions.  As for a `Step`,
+`get_data()` returns data that must not be modified in place (for `dict` data,
+a new `dict` on each call), and `edit_data()` returns data that may be
+modified in place: `dict` data is returned as a `dict` that writes changes
+back to the table, and values that may be shared with other steps or tables
+(e.g., after a slice or `to_frame()`) are copied first.
+"""
+
+import re
+from collections import OrderedDict
+from copy import deepcopy
+
+import numpy as np
+
+
+# Name of the `to_frame()` column holding plugin data that is not a `dict`.
+DATA_COLUMN = '__data__'
+
+
+def _value_dtype(value):
+    if isinstance(value, bool):
+        return np.dtype(bool)
+    elif isinstance(value, (int, long)) and -2 ** 63 <= value < 2 ** 63:
+        return np.dtype('int64')
+    elif isinstance(value, float):
+        return np.dtype('float64')
+    return np.dtype(object)
+
+
+def dtypes_from_forms(forms):
+    '''
+    Returns a `{(plugin name, field name): dtype}` dictionary for the step
+    fields declared in a `{plugin name: StepFields}` dictionary (e.g., as
+    returned by `emit_signal('get_step_form_class')`).
+    '''
+    from flatland import Boolean, Integer, Float
+
+    dtypes = {}
+    for plugin_name, form in forms.iteritems():
+        if form is None:
+            continue
+        for field_name, field in form.field_schema_mapping.iteritems():
+            if issubclass(field, Boolean):
+                dtypes[(plugin_name, field_name)] = np.dtype(bool)
+            elif issubclass(field, Integer):
+                dtypes[(plugin_name, field_name)] = np.dtype('int64')
+            elif issubclass(field, Float):
+                dtypes[(plugin_name, field_name)] = np.dtype('float64')
+    return dtypes
+
+
+class _Field(object):
+    '''
+    Values of one field (`values`), and whether each step defines the field
+    (`mask`).
+    '''
+    def __init__(self, length, dtype):
+        self.values = np.zeros(length, dtype=dtype)
+        if dtype == np.dtype(object):
+            self.values[:] = None
+        self.mask = np.zeros(length, dtype=bool)
+
+    def accepts(self, value):
+        dtype = self.values.dtype
+        if dtype == np.dtype(object):
+            return True
+        return _value_dtype(value) == dtype or (dtype == np.dtype('float64')
+                                                and not isinstance(value, bool)
+                                                and isinstance(value,
+                                                               (int, long)))
+
+    def set(self, index, value):
+        if not self.accepts(value):
+            self.values = self.values.astype(object)
+        self.values[index] = value
+        self.mask[index] = True
+
+    def get(self, index):
+        value = self.values[index]
+        if self.values.dtype != np.dtype(object):
+            return value.item()
+        return value
+
+    def take(self, index):
+        field = _Field(0, self.values.dtype)
+        field.values = self.values[index].copy()
+        field.mask = self.mask[index].copy()
+        return field
+
+    def insert(self, index, other):
+        self.values = np.concatenate([self.values[:index], other.values,
+                                      self.values[index:]])
+        self.mask = np.concatenate([self.mask[:index], other.mask,
+                                    self.mask[index:]])
+
+    def delete(self, index):
+        self.values = np.delete(self.values, index)
+        self.mask = np.delete(self.mask, index)
+
+
+class _PluginColumns(object):
+    def __init__(self, length):
+        self.present = np.zeros(length, dtype=bool)
+        self.data = np.empty(length, dtype=object)
+        # Whether the objects of each row may be shared with other steps
+        # (see `StepTable.edit_data()`).
+        self.shared = np.zeros(length, dtype=bool)
+        self.fields = OrderedDict()
+
+    def __len__(self):
+        return len(self.present)
+
+    def field(self, name, dtype):
+        field = self.fields.get(name)
+        if field is None:
+            field = _Field(len(self), dtype)
+            self.fields[name] = field
+        return field
+
+    def take(self, index):
+        columns = _PluginColumns(0)
+        columns.present = self.present[index].copy()
+        columns.data = self.data[index].copy()
+        # The taken rows share their objects with the rows of this table.
+        self.shared[index] = True
+        columns.shared = columns.present.copy()
+        for name, field in self.fields.iteritems():
+            columns.fields[name] = field.take(index)
+        return columns
+
+    def insert(self, index, other):
+        for name, field in other.fields.iteritems():
+            self.field(name, field.values.dtype)
+        for name, field in self.fields.iteritems():
+            other.field(name, field.values.dtype)
+            field.insert(index, other.fields[name])
+        self.present = np.concatenate([self.present[:index], other.present,
+                                       self.present[index:]])
+        self.data = np.concatenate([self.data[:index], other.data,
+                                    self.data[index:]])
+        self.shared = np.concatenate([self.shared[:index], other.shared,
+                                      self.shared[index:]])
+
+    def delete(self, index):
+        self.present = np.delete(self.present, index)
+        self.data = np.delete(self.data, index)
+        self.shared = np.delete(self.shared, index)
+        for field in self.fields.itervalues():
+            field.delete(index)
+
+
+class _RowData(dict):
+    '''
+    `dict` data of a plugin for one row of a `StepTable` (see
+    `StepTable.edit_data()`).  Items that are set or deleted are written to
+    the table.
+    '''
+    def __init__(self, table, index, plugin_name, data):
+        dict.__init__(self, data)
+        self._table = table
+        self._index = index
+        self._plugin_name = plugin_name
+
+    def __reduce__(self):
+        # Pickled (or copied) as a plain `dict`, without the table.
+        return dict, (dict(self), )
+
+    def __setitem__(self, key, value):
+        dict.__setitem__(self, key, value)
+        self._table._field(self._plugin_name, key, value).set(self._index,
+                                                              value)
+
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        field = self._table.plugins[self._plugin_name].fields[key]
+        field.mask[self._index] = False
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *default):
+        if key not in self:
+            if default:
+                return default[0]
+            raise KeyError, key
+        value = self[key]
+        del self[key]
+        return value
+
+    def popitem(self):
+        if not self:
+            raise KeyError, 'popitem(): dictionary is empty'
+        key = next(iter(self))
+        return key, self.pop(key)
+
+    def clear(self):
+        for key in self.keys():
+            del self[key]
+
+
+class StepView(object):
+    '''
+    `Step`-like view of one row of a `StepTable`.
+    '''
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def plugin_data(self):
+        return self.table.row_data(self.index)
+
+    @property
+    def plugins(self):
+        return self.table.row_plugins(self.index)
+
+    def plugin_name_lookup(self, name, re_pattern=False):
+        if not re_pattern:
+            return name
+
+        for plugin_name in self.plugins:
+            if re.search(name, plugin_name):
+                return plugin_name
+        return None
+
+    def decode_data(self, plugin_name=None):
+        # Data stored in a table is always decoded.
+        pass
+
+    @property
+    def decoded(self):
+        return True
+
+    def get_data(self, plugin_name):
+        return self.table.get_data(self.index, plugin_name)
+
+    def edit_data(self, plugin_name):
+        return self.table.edit_data(self.index, plugin_name)
+
+    def set_data(self, plugin_name, data):
+        self.table.set_data(self.index, plugin_name, data)
+
+    def remove_data(self, plugin_name):
+        self.table.remove_data(self.index, plugin_name)
+
+    def snapshot(self, shared=False):
+        '''
+        Returns the plugin data of the step, and an (empty) dictionary of
+        serialized plugin data (see `protocol._step_snapshot()`).
+
+        If `shared` is `True`, the objects of the step are marked as shared
+        with the snapshot, so `edit_data()` copies them before they are
+        modified.
+        '''
+        if shared:
+            self.table.mark_shared(self.index)
+        return self.plugin_data, {}
+
+    def copy(self):
+        return self.to_step()
+
+    def to_step(self):
+        from protocol import Step
+
+        return Step(plugin_data=self.plugin_data)
+
+
+class StepTable(object):
+    '''
+    Columnar, list-like container of protocol steps.
+
+    Args:
+        length: number of (empty) steps.
+        dtypes: optional `{(plugin name, field name): dtype}` dictionary
+            (see `dtypes_from_forms()`).  Other field types are inferred from
+            the first value set.
+    '''
+    def __init__(self, length=0, dtypes=None):
+        self._length = length
+        self.dtypes = dict(dtypes or {})
+        self.plugins = OrderedDict()
+
+    @classmethod
+    def from_steps(cls, steps, dtypes=None):
+        table = cls(dtypes=dtypes)
+        table.extend(steps)
+        return table
+
+    def to_steps(self):
+        return [StepView(self, i).to_step() for i in xrange(len(self))]
+
+    def _columns(self, plugin_name):
+        columns = self.plugins.get(plugin_name)
+        if columns is None:
+            columns = _PluginColumns(len(self))
+            self.plugins[plugin_name] = columns
+        return columns
+
+    def _field(self, plugin_name, field_name, value):
+        dtype = self.dtypes.get((plugin_name, field_name))
+        if dtype is None:
+            dtype = _value_dtype(value)
+        return self._columns(plugin_name).field(field_name, dtype)
+
+    def _index(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError, 'step index out of range'
+        return index
+
+    # Row access #
+    def get_data(self, index, plugin_name):
+        index = self._index(index)
+        columns = self.plugins.get(plugin_name)
+        if columns is None or not columns.present[index]:
+            return None
+        if columns.data[index] is not None:
+            return columns.data[index]
+        return dict([(name, field.get(index))
+                     for name, field in columns.fields.iteritems()
+                     if field.mask[index]])
+
+    def edit_data(self, index, plugin_name):
+        '''
+        Returns the data of a plugin for a step, which may be modified in
+        place.  `dict` data is returned as a `dict` that writes changes back
+        to the table.  Objects that may be shared with other steps are
+        replaced by (deep) copies first.
+        '''
+        index = self._index(index)
+        columns = self.plugins.get(plugin_name)
+        if columns is None or not columns.present[index]:
+            return None
+        if columns.shared[index]:
+            columns.shared[index] = False
+            if columns.data[index] is not None:
+                columns.data[index] = deepcopy(columns.data[index])
+            for field in columns.fields.itervalues():
+                if field.mask[index] and \
+                        field.values.dtype == np.dtype(object):
+                    field.values[index] = deepcopy(field.values[index])
+        if columns.data[index] is not None:
+            return columns.data[index]
+        return _RowData(self, index, plugin_name,
+                        self.get_data(index, plugin_name))
+
+    def mark_shared(self, index):
+        '''
+        Mark the objects of a step as shared (e.g., with a snapshot of the
+        step), so `edit_data()` copies them before they are modified.
+        '''
+        index = self._index(index)
+        for columns in self.plugins.itervalues():
+            columns.shared[index] = columns.present[index]
+
+    def set_data(self, index, plugin_name, data, shared=False):
+        '''
+        Set the data of a plugin for a step.  If `shared` is `True`, the data
+        (or the values of `dict` data) may be shared with other steps.
+        '''
+        index = self._index(index)
+        columns = self._columns(plugin_name)
+        columns.present[index] = True
+        columns.shared[index] = shared
+        for field in columns.fields.itervalues():
+            field.mask[index] = False
+        if isinstance(data, dict):
+            columns.data[index] = None
+            for name, value in data.iteritems():
+                self._field(plugin_name, name, value).set(index, value)
+        else:
+            columns.data[index] = data
+
+    def remove_data(self, index, plugin_name):
+        index = self._index(index)
+        columns = self.plugins.get(plugin_name)
+        if columns is not None:
+            columns.present[index] = False
+            columns.data[index] = None
+            columns.shared[index] = False
+            for field in columns.fields.itervalues():
+                field.mask[index] = False
+
+    def row_plugins(self, index):
+        index = self._index(index)
+        return set([plugin_name for plugin_name, columns in
+                    self.plugins.iteritems() if columns.present[index]])
+
+    def row_data(self, index):
+        return dict([(plugin_name, self.get_data(index, plugin_name))
+                     for plugin_name in self.row_plugins(index)])
+
+    # Vectorized access #
+    def fields(self, plugin_name):
+        columns = self.plugins.get(plugin_name)
+        if columns is None:
+            return []
+        return columns.fields.keys()
+
+    def get_column(self, plugin_name, field_name, index=slice(None)):
+        '''
+        Returns the values of a field for the selected steps (all steps by
+        default), as an array.  Use `get_mask()` to find which steps define
+        the field.
+        '''
+        return self.plugins[plugin_name].fields[field_name].values[index]
+
+    def get_mask(self, plugin_name, field_name, index=slice(None)):
+        columns = self.plugins.get(plugin_name)
+        if columns is None or field_name not in columns.fields:
+            return np.zeros(len(self), dtype=bool)[index]
+        return columns.fields[field_name].mask[index]
+
+    def set_column(self, plugin_name, field_name, values, index=slice(None)):
+        '''
+        Set the value of a field for the selected steps (all steps by
+        default).  `values` may be a scalar or an array-like with one value
+        per selected step.
+        '''
+        values = np.asarray(values)
+        if values.ndim == 0:
+            sample = values.item()
+        elif len(values):
+            sample = values.flat[0]
+            sample = sample.item() if hasattr(sample, 'item') else sample
+        else:
+            return
+        field = self._field(plugin_name, field_name, sample)
+        if field.values.dtype != np.dtype(object) and \
+                not np.can_cast(values.dtype, field.values.dtype,
+                                casting='safe'):
+            field.values = field.values.astype(object)
+        columns = self.plugins[plugin_name]
+        field.values[index] = values
+        field.mask[index] = True
+        columns.present[index] = True
+        columns.data[index] = None
+        if field.values.dtype == np.dtype(object):
+            # A (scalar) object may be set for several steps.
+            columns.shared[index] = True
+
+    # List interface #
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield StepView(self, i)
+
+    def _take(self, rows):
+        table = StepTable(dtypes=self.dtypes)
+        table._length = len(rows)
+        for plugin_name, columns in self.plugins.iteritems():
+            table.plugins[plugin_name] = columns.take(rows)
+        return table
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._take(np.arange(len(self))[index])
+        return StepView(self, self._index(index))
+
+    def __setitem__(self, index, value):
+        '''
+        Replace a step, or a slice of steps (e.g., `table[i:i] = steps` inserts
+        steps before `i`).  The steps may be views of this table.
+        '''
+        if not isinstance(index, slice):
+            self._set_row(self._index(index), value)
+            return
+        rows = np.arange(len(self))[index]
+        # Copy the steps before the table is changed.
+        if isinstance(value, StepTable):
+            steps = value._take(np.arange(len(value)))
+        else:
+            value = list(value)
+            if value and all([isinstance(step, StepView) and
+                              step.table is self for step in value]):
+                steps = self._take(np.array([step.index for step in value],
+                                            dtype=int))
+            else:
+                steps = StepTable._from_sequence(value, self.dtypes)
+        if index.step in (None, 1):
+            start = index.indices(len(self))[0]
+            del self[index]
+            self.insert_many(start, steps)
+        elif len(steps) != len(rows):
+            raise ValueError, 'attempt to assign sequence of size %d to ' \
+                'extended slice of size %d' % (len(steps), len(rows))
+        else:
+            for i, row in enumerate(rows):
+                self._set_row(row, StepView(steps, i))
+
+    def _set_row(self, index, step):
+        for plugin_name in self.row_plugins(index):
+            self.remove_data(index, plugin_name)
+        for plugin_name, data in step.plugin_data.iteritems():
+            self.set_data(index, plugin_name, data, shared=True)
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            rows = np.arange(len(self))[index]
+        else:
+            rows = self._index(index)
+        for columns in self.plugins.itervalues():
+            columns.delete(rows)
+        self._length -= np.size(rows)
+
+    def insert(self, index, step):
+        self.insert_many(index, [step])
+
+    def insert_many(self, index, steps):
+        '''
+        Insert a sequence of steps (`Step`, `StepView` or a `StepTable`)
+        before `index`.
+        '''
+        if not isinstance(steps, StepTable):
+            steps = StepTable._from_sequence(steps, self.dtypes)
+        if index < 0:
+            index = max(0, index + len(self))
+        index = min(index, len(self))
+        for plugin_name in steps.plugins:
+            self._columns(plugin_name)
+        for plugin_name, columns in self.plugins.iteritems():
+            other = steps.plugins.get(plugin_name)
+            if other is None:
+                other = _PluginColumns(len(steps))
+            columns.insert(index, other)
+        self._length += len(steps)
+
+    @classmethod
+    def _from_sequence(cls, steps, dtypes):
+        steps = list(steps)
+        table = cls(len(steps), dtypes=dtypes)
+        for i, step in enumerate(steps):
+            for plugin_name, data in step.plugin_data.iteritems():
+                table.set_data(i, plugin_name, data, shared=True)
+        return table
+
+    def append(self, step):
+        self.insert_many(len(self), [step])
+
+    def extend(self, steps):
+        self.insert_many(len(self), steps)
+
+    def pop(self, index=-1):
+        '''
+        Remove a step and return it as a (detached) `Step`.
+        '''
+        index = self._index(index)
+        step = StepView(self, index).to_step()
+        del self[index]
+        return step
+
+    # pandas conversion #
+    def to_frame(self):
+        '''
+        Returns a `pandas.DataFrame` with one row per step and one column per
+        `(plugin name, field name)`.  Undefined values are `None` (in object
+        columns).  Plugin data that is not a `dict` is stored in the
+        `(plugin name, DATA_COLUMN)` column.
+        '''
+        import pandas as pd
+
+        data = OrderedDict()
+        for plugin_name, columns in self.plugins.iteritems():
+            for field_name, field in columns.fields.iteritems():
+                if field.mask.all():
+                    data[(plugin_name, field_name)] = field.values.copy()
+                else:
+                    values = field.values.astype(object)
+                    values[~field.mask] = None
+                    data[(plugin_name, field_name)] = values
+            if any(d is not None for d in columns.data):
+                data[(plugin_name, DATA_COLUMN)] = columns.data.copy()
+        frame = pd.DataFrame(data, index=np.arange(len(self)),
+                             columns=data.keys())
+        if len(data):
+            frame.columns = pd.MultiIndex.from_tuples(data.keys())
+        return frame
+
+    @classmethod
+    def from_frame(cls, frame, dtypes=None):
+        '''
+        Create a `StepTable` from a `pandas.DataFrame` in the format returned
+        by `to_frame()`.  `None` (or `NaN` in object columns) values are
+        undefined.
+        '''
+        table = cls(len(frame), dtypes=dtypes)
+        for plugin_name, field_name in frame.columns:
+            values = frame[(plugin_name, field_name)].values
+            columns = table._columns(plugin_name)
+            if field_name == DATA_COLUMN:
+                defined = np.array([v is not None for v in values],
+                                   dtype=bool)
+                columns.data[defined] = values[defined]
+                columns.present |= defined
+                continue
+            if values.dtype == np.dtype(object):
+                defined = np.array([not (v is None or (isinstance(v, float)
+                                                        and np.isnan(v)))
+                                    for v in values], dtype=bool)
+            else:
+                defined = np.ones(len(values), dtype=bool)
+            if not defined.any():
+                continue
+            dtype = table.dtypes.get((plugin_name, field_name))
+            if dtype is None:
+                dtypes = set([_value_dtype(v.item() if hasattr(v, 'item')
+                                           else v)
+                              for v in values[defined]])
+                dtype = dtypes.pop() if len(dtypes) == 1 else \
+                    np.dtype(object)
+            field = columns.field(field_name, dtype)
+            field.values[defined] = values[defined]
+            field.mask[:] = defined
+            columns.present |= defined
+        # Objects are shared with the frame.
+        for columns in table.plugins.itervalues():
+            columns.shared[:] = columns.present
+        return table
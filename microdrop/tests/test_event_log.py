@@ -0,0 +1,49 @@
+import logging
+
+from nose.tools import eq_, ok_
+
+from event_log import EventLog, LoggingSink
+
+
+def test_capacity():
+    log = EventLog(capacity=3)
+    for i in range(5):
+        log.record('step', step_number=i)
+    eq_([e.get('step_number') for e in log.events()], [2, 3, 4])
+
+
+def test_lazy_fields():
+    calls = []
+
+    def expensive():
+        calls.append(1)
+        return 'value'
+
+    log = EventLog()
+    event = log.record('step', values=expensive)
+    eq_(calls, [])
+    eq_(event.get('values'), 'value')
+    eq_(event.get('values'), 'value')
+    eq_(calls, [1])
+
+
+def test_logging_sink_disabled_level():
+    calls = []
+    logger = logging.getLogger('test_event_log')
+    logger.setLevel(logging.INFO)
+    log = EventLog()
+    log.add_sink(LoggingSink(logger))
+    log.record('step', values=lambda: calls.append(1))
+    eq_(calls, [])
+
+
+def test_dump():
+    log = EventLog()
+    log.record('a', x=1)
+    log.record('b', y=lambda: 1 / 0)
+    lines = log.dump().splitlines()
+    eq_(len(lines), 2)
+    ok_(lines[0].endswith('a x=1'))
+    ok_('ZeroDivisionError' in lines[1])
+    eq_(len(log.dump(1).splitlines()), 1)
+    eq_(len(log.events('a')), 1)
@@ -0,0 +1,34 @@
+from nose.tools import eq_, raises
+
+from protocol import Protocol, Step
+from execution_plan import ExecutionPlan
+
+
+def test_execution_plan():
+    """
+    test that the steps of a protocol are unrolled for each repetition
+    """
+    protocol = Protocol()
+    protocol.steps[0].set_data('plugin', {'a': 0})
+    protocol.steps.append(Step({'plugin': {'a': 1}, 'other': {}}))
+    protocol.n_repeats = 3
+    plan = ExecutionPlan(protocol, ['plugin'])
+    eq_(len(plan), 6)
+    eq_([(e.step_number, e.repetition) for e in plan],
+        [(0, 0), (1, 0), (0, 1), (1, 1), (0, 2), (1, 2)])
+    eq_(plan[plan.index(1, 2)].plugins, ('other', 'plugin'))
+    eq_(plan.get_values(1), {'plugin': {'a': 1}, 'other': {}})
+
+    protocol.steps[1].remove_data('other')
+    plan.update_step(1, protocol.steps[1])
+    eq_(plan[5].plugins, ('plugin', ))
+
+
+@raises(IndexError)
+def test_execution_plan_index():
+    """
+    test that entries past the end of the plan cannot be accessed
+    """
+    protocol = Protocol()
+    plan = ExecutionPlan(protocol, [])
+    plan[plan.index(0) + 1]
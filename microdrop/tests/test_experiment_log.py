@@ -1,7 +1,7 @@
 from path_helpers import path
 from nose.tools import raises
 
-from experiment_log import ExperimentLog
+from experiment_log import ExperimentLog, is_segment
 from microdrop_utility import Version
 
 def test_load_experiment_log():
@@ -34,3 +34,203 @@ def test_load_non_existant_experiment_log():
     ExperimentLog.load(path(__file__).parent /
                        path('experiment_logs') /
                        path('no log'))
+
+
+def test_stream_experiment_log():
+    """
+    test streaming an experiment log to a segment file
+    """
+    import shutil
+    import tempfile
+
+    directory = path(tempfile.mkdtemp())
+    try:
+        log = ExperimentLog(directory, stream=True)
+        log.add_data({'software version': '1.0'})
+        for i in range(3):
+            log.add_step(i)
+            log.add_data({'voltage': i}, plugin_name='plugin')
+        filename = directory.joinpath(str(log.experiment_id), 'data')
+        assert(is_segment(filename))
+
+        # The log can be read while it is being written.
+        log.flush()
+        loaded = ExperimentLog.load(filename)
+        assert(loaded.data == log.data)
+        assert(loaded.experiment_id == log.experiment_id)
+
+        # A partly written record is ignored.
+        log.add_step(3)
+        log.flush()
+        size = filename.getsize()
+        log.add_data({'voltage': 3}, plugin_name='plugin')
+        log.save()
+        with open(filename, 'r+b') as f:
+            f.truncate(filename.getsize() - 1)
+        loaded = ExperimentLog.load(filename)
+        assert(loaded.data == log.data[:-1] + [{'core': log.data[-1]['core']}])
+
+        # Records are appended after the last complete record.
+        loaded.open_segment(filename)
+        assert(filename.getsize() == size)
+        loaded.add_data({'notes': 'notes'})
+        loaded.close_segment()
+        assert(ExperimentLog.load(filename).get('notes')[-1] == 'notes')
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_stream_without_steps():
+    """
+    test that a log directory is only created once a step is added
+    """
+    import shutil
+    import tempfile
+
+    directory = path(tempfile.mkdtemp())
+    try:
+        log = ExperimentLog(directory, stream=True)
+        log.add_data({'software version': '1.0'})
+        assert(log.segment is None)
+        assert(not directory.dirs())
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_experiment_log_index():
+    """
+    test that the column index matches the log data
+    """
+    log = ExperimentLog()
+    log.add_data({'software version': '1.0'})
+    for i in range(5):
+        log.add_step(i)
+        if i % 2:
+            log.add_data({'voltage': i}, plugin_name='plugin')
+    assert(log.get('step') == [None] + range(5))
+    assert(log.get('voltage', 'plugin') == [None, None, 1, None, 3, None])
+    assert(log.get_values('voltage', 'plugin') == [1, 3])
+    assert(log.get('voltage') == [None] * 6)
+    assert(log.start_time() == log.get_values('start time')[0])
+
+    # Entries added to `data` directly are indexed when it is queried.
+    log.data.append({'core': {'step': 5}})
+    assert(log.get_values('step') == range(6))
+
+
+def test_experiment_log_to_frame():
+    """
+    test converting an experiment log to a `pandas.DataFrame`
+    """
+    import numpy as np
+
+    log = ExperimentLog()
+    log.add_data({'software version': '1.0', 'plugins': {'plugin': '1.0'}})
+    for i in range(4):
+        log.add_step(i)
+        if i % 2:
+            log.add_data({'voltage': 10. * i, 'name': 'x'}, 'plugin')
+    frame = log.to_frame()
+    assert(list(frame.columns[:3]) == [('core', 'step'), ('core', 'attempt'),
+                                       ('core', 'time')])
+    # Non-scalar values are not exported.
+    assert(('core', 'plugins') not in frame.columns)
+    assert(np.isnan(frame[('core', 'step')][0]))
+    assert(frame[('core', 'step')][1:].tolist() == range(4))
+    assert(frame[('plugin', 'voltage')].fillna(-1).tolist() ==
+           [-1, -1, 10., -1, 30.])
+    assert(frame[('plugin', 'name')].tolist() == [None, None, 'x', None, 'x'])
+
+
+def test_stream_max_entries():
+    """
+    test that only the last entries of a streamed log are kept in memory
+    """
+    import shutil
+    import tempfile
+
+    directory = path(tempfile.mkdtemp())
+    try:
+        log = ExperimentLog(directory, stream=True)
+        log.max_entries = 2
+        log.add_data({'software version': '1.0'})
+        for i in range(10):
+            log.add_step(i)
+            log.add_data({'voltage': i}, plugin_name='plugin')
+        assert(len(log.data) == 11)
+        assert(len(log.data._entries) == 2)
+
+        # Older entries are read from the segment file.
+        assert(log.data[0]['core']['software version'] == '1.0')
+        assert(log.get('step') == [None] + range(10))
+        assert(log.get_values('voltage', 'plugin') == range(10))
+        assert(log.to_frame()[('plugin', 'voltage')][1:].tolist() ==
+               range(10))
+        log.flush()
+        filename = directory.joinpath(str(log.experiment_id), 'data')
+        assert(ExperimentLog.load(filename).data == list(log.data))
+
+        # Entries added after the log was saved are appended to the segment
+        # file.
+        log.save()
+        assert(log.segment is None)
+        log.add_step(10)
+        log.save()
+        assert(ExperimentLog.load(filename).get('step')[-1] == 10)
+        assert(log.get('step')[-1] == 10)
+
+        # Saving to another file writes all entries.
+        other = directory.joinpath('other')
+        log.save(other)
+        assert(ExperimentLog.load(other).get('step') == [None] + range(11))
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_stream_sync():
+    """
+    test that streamed records are synced to disk as they are added, unless
+    a sync interval is set
+    """
+    import os
+    import shutil
+    import tempfile
+
+    synced = []
+    fsync = os.fsync
+
+    def _fsync(fd):
+        synced.append(fd)
+        fsync(fd)
+
+    directory = path(tempfile.mkdtemp())
+    os.fsync = _fsync
+    try:
+        log = ExperimentLog(directory, stream=True)
+        log.add_step(0)
+        for i in range(1, 10):
+            n = len(synced)
+            log.add_step(i)
+            assert(len(synced) == n + 1)
+        log.close_segment()
+
+        log = ExperimentLog(directory, stream=True, sync_interval=60.)
+        log.add_step(0)
+        # The header is synced when the segment is opened...
+        filename = directory.joinpath(str(log.experiment_id), 'data')
+        assert(is_segment(filename))
+        del synced[:]
+        # ...but records are only synced when the segment is flushed.
+        for i in range(1, 100):
+            log.add_step(i)
+        log.flush()
+        assert(len(synced) == 1)
+        assert(ExperimentLog.load(filename).get('step')[-1] == 99)
+        writer = log.segment
+        log.close_segment()
+        # Nothing was written since the last sync.
+        assert(len(synced) == 1)
+        assert(not writer._thread.is_alive())
+    finally:
+        os.fsync = fsync
+        shutil.rmtree(directory)
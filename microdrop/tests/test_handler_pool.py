@@ -0,0 +1,37 @@
+import threading
+
+from nose.tools import eq_, raises
+
+from handler_pool import HandlerPool
+
+
+def test_submit():
+    pool = HandlerPool(n_workers=2)
+    calls = [pool.submit(lambda x, y: x + y, i, 1) for i in range(10)]
+    eq_([c.wait() for c in calls], range(1, 11))
+
+
+def test_concurrent():
+    # Both calls must be running at the same time for either to complete.
+    pool = HandlerPool(n_workers=2)
+    barrier = [threading.Event(), threading.Event()]
+
+    def rendezvous(i):
+        barrier[i].set()
+        return barrier[1 - i].wait(5)
+
+    calls = [pool.submit(rendezvous, i) for i in range(2)]
+    eq_([c.wait() for c in calls], [True, True])
+
+
+@raises(ValueError)
+def test_exception():
+    def fail():
+        raise ValueError
+    HandlerPool().submit(fail).wait()
+
+
+def test_in_worker():
+    pool = HandlerPool(n_workers=1)
+    assert not pool.in_worker()
+    assert pool.submit(pool.in_worker).wait()
@@ -0,0 +1,200 @@
+import gzip
+import logging
+import tempfile
+import threading
+import time
+from contextlib import closing
+
+from nose.tools import eq_
+from path_helpers import path
+
+from logger import QueueHandler, AsyncRotatingFileHandler
+from plugin_manager import (ILoggingPlugin, Plugin, PluginGlobals, implements,
+                            invalidate_dispatch_table,
+                            invalidate_service_registry)
+
+
+PluginGlobals.push_env('microdrop')
+
+
+class LogPlugin(Plugin):
+    implements(ILoggingPlugin)
+
+    def __init__(self):
+        self.name = 'test.log'
+        self.log_level = logging.WARNING
+        self.records = []
+
+    def on_info(self, record):
+        self.records.append(record)
+
+    def on_warning(self, record):
+        self.records.append(record)
+
+
+PluginGlobals.pop_env()
+
+
+class ThreadFormatter(logging.Formatter):
+    '''
+    Record the thread each record is formatted on.
+    '''
+    def __init__(self):
+        logging.Formatter.__init__(self, '%(message)s')
+        self.threads = set()
+
+    def format(self, record):
+        self.threads.add(threading.current_thread())
+        return logging.Formatter.format(self, record)
+
+
+def _record(level, msg, *args):
+    return logging.makeLogRecord({'levelno': level,
+                                  'levelname': logging.getLevelName(level),
+                                  'msg': msg, 'args': args})
+
+
+class _LogPlugin(object):
+    def __enter__(self):
+        self.plugin = LogPlugin()
+        invalidate_service_registry()
+        invalidate_dispatch_table()
+        return self.plugin
+
+    def __exit__(self, *args):
+        self.plugin.disable()
+        PluginGlobals.env('microdrop').services.discard(self.plugin)
+        invalidate_service_registry()
+        invalidate_dispatch_table()
+
+
+def test_queue_handler_level():
+    """
+    test that records below the level of every logging plugin are dropped
+    """
+    with _LogPlugin() as plugin:
+        handler = QueueHandler()
+        handler.handle(_record(logging.INFO, 'info'))
+        handler.handle(_record(logging.DEBUG, 'debug'))
+        # Nothing was queued, so the background thread was not started.
+        eq_(handler._thread, None)
+        handler.handle(_record(logging.WARNING, 'warning'))
+        handler.flush()
+        eq_([r.message for r in plugin.records], ['warning'])
+        handler.close()
+
+
+def test_queue_handler_format():
+    """
+    test that records are formatted on the background thread
+    """
+    with _LogPlugin() as plugin:
+        handler = QueueHandler()
+        formatter = ThreadFormatter()
+        handler.setFormatter(formatter)
+        handler.handle(_record(logging.WARNING, 'value=%d', 1))
+        handler.flush()
+        eq_(formatter.threads, set([handler._thread]))
+        record = plugin.records[0]
+        eq_(record.message, 'value=1')
+        # References to the arguments are dropped once formatted.
+        eq_(record.args, None)
+        handler.close()
+
+
+def test_queue_handler_order():
+    """
+    test that records are delivered in the order they were logged
+    """
+    with _LogPlugin() as plugin:
+        handler = QueueHandler()
+        threads = [threading.Thread(target=handler.handle,
+                                    args=(_record(logging.WARNING, 'record '
+                                                  '%d', i), ))
+                   for i in range(100)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        handler.flush()
+        eq_([r.message for r in plugin.records],
+            ['record %d' % i for i in range(100)])
+        handler.close()
+
+
+def _read_gzip(filename):
+    with closing(gzip.open(filename, 'rb')) as f:
+        return f.read()
+
+
+class _LogDirectory(object):
+    def __enter__(self):
+        self.directory = path(tempfile.mkdtemp(prefix='microdrop_log_'))
+        return self.directory
+
+    def __exit__(self, *args):
+        self.directory.rmtree()
+
+
+def test_rotate_size():
+    """
+    test that the log file is compressed and rotated once it is too large
+    """
+    with _LogDirectory() as directory:
+        filename = directory / 'microdrop.log'
+        handler = AsyncRotatingFileHandler(filename, max_bytes=20)
+        for i in range(3):
+            # 12 bytes per record.
+            handler.handle(_record(logging.INFO, 'record %04d', i))
+        handler.close()
+        eq_(_read_gzip(filename + '.1.gz'), 'record 0000\nrecord 0001\n')
+        eq_(filename.bytes(), 'record 0002\n')
+
+
+def test_rotate_time():
+    """
+    test that the log file is rotated once it has been open long enough
+    """
+    with _LogDirectory() as directory:
+        filename = directory / 'microdrop.log'
+        handler = AsyncRotatingFileHandler(filename, rotate_interval=0.5)
+        handler.handle(_record(logging.INFO, 'before'))
+        handler.flush()
+        eq_(filename.bytes(), 'before\n')
+        time.sleep(0.6)
+        # The file is rotated after the next record is written.
+        handler.handle(_record(logging.INFO, 'after'))
+        handler.close()
+        eq_(_read_gzip(filename + '.1.gz'), 'before\nafter\n')
+        eq_(filename.bytes(), '')
+
+
+def test_rotate_backup_count():
+    """
+    test that only `backup_count` rotated files are kept
+    """
+    with _LogDirectory() as directory:
+        filename = directory / 'microdrop.log'
+        handler = AsyncRotatingFileHandler(filename, max_bytes=1,
+                                           backup_count=2)
+        for i in range(5):
+            handler.handle(_record(logging.INFO, 'record %d', i))
+        handler.close()
+        eq_(sorted([f.name for f in directory.files()]),
+            ['microdrop.log', 'microdrop.log.1.gz', 'microdrop.log.2.gz'])
+        # Most recent first.
+        eq_(_read_gzip(filename + '.1.gz'), 'record 4\n')
+        eq_(_read_gzip(filename + '.2.gz'), 'record 3\n')
+
+
+def test_flush_on_close():
+    """
+    test that queued records are written when the handler is closed
+    """
+    with _LogDirectory() as directory:
+        filename = directory / 'microdrop.log'
+        handler = AsyncRotatingFileHandler(filename, flush_interval=60.)
+        for i in range(100):
+            handler.handle(_record(logging.INFO, 'record %d', i))
+        handler.close()
+        eq_(filename.lines(retain=False),
+            ['record %d' % i for i in range(100)])
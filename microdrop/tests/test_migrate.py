@@ -0,0 +1,136 @@
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import tempfile
+
+from nose.tools import eq_
+from path_helpers import path
+import yaml
+
+from microdrop.bin.migrate import (find_files, read_version,
+                                   _migrate_protocol, _migrate_log, _read_raw)
+from microdrop.experiment_log import ExperimentLog
+from microdrop.protocol import Protocol, Step
+from microdrop.protocol_journal import ProtocolJournal, journal_paths
+
+
+def _touch(filename):
+    filename.parent.makedirs_p()
+    filename.write_bytes('')
+    return filename
+
+
+def _write_pickle(filename, obj):
+    with open(filename, 'wb') as f:
+        pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+
+
+def _yaml_protocol():
+    '''
+    Returns a protocol with step data serialized as YAML (as written by
+    protocols upgraded from version 0).
+    '''
+    protocol = Protocol()
+    protocol.steps[0].set_data('plugin', yaml.dump({'a': 1}))
+    protocol.steps.append(Step({'plugin': pickle.dumps({'a': 2})}))
+    protocol.journal_id = 'base'
+    return protocol
+
+
+def test_find_files():
+    """
+    test that devices, protocols and logs are found, but not journals
+    """
+    root = path(tempfile.mkdtemp(prefix='migrate_'))
+    try:
+        device_dir = root / 'device 1'
+        device = _touch(device_dir / 'device')
+        protocol = _touch(device_dir / 'protocols' / 'protocol')
+        _touch(device_dir / 'protocols' / 'protocol.journal-0')
+        _touch(device_dir / 'protocols' / 'protocol.tmp')
+        log = _touch(device_dir / 'logs' / '1' / 'data')
+        log_device = _touch(device_dir / 'logs' / '1' / 'device')
+        log_protocol = _touch(device_dir / 'logs' / '1' / 'protocol')
+        _touch(root / 'device 2' / 'notes.txt')
+        eq_(find_files(root), [('device', device), ('protocol', protocol),
+                               ('log', log), ('device', log_device),
+                               ('protocol', log_protocol)])
+    finally:
+        root.rmtree()
+
+
+def test_read_version():
+    """
+    test reading the version of pickled and container protocol files
+    """
+    root = path(tempfile.mkdtemp(prefix='migrate_'))
+    try:
+        protocol = Protocol()
+        protocol.version = '0.1'
+        _write_pickle(root / 'pickle', protocol)
+        eq_(read_version(root / 'pickle'), '0.1')
+        Protocol().save(root / 'container', format='container')
+        eq_(read_version(root / 'container'), Protocol.class_version)
+        log = ExperimentLog()
+        del log.version
+        _write_pickle(root / 'log', log)
+        eq_(read_version(root / 'log'), '0')
+    finally:
+        root.rmtree()
+
+
+def test_migrate_protocol():
+    """
+    test that YAML step data is re-serialized using pickle, and that the
+    journal of the protocol still applies
+    """
+    root = path(tempfile.mkdtemp(prefix='migrate_'))
+    try:
+        filename = root / 'protocol'
+        _write_pickle(filename, _yaml_protocol())
+        journal = ProtocolJournal(journal_paths(filename)[0], 'base')
+        journal.append(('set_attribute', 'n_repeats', 3))
+        journal.close()
+        journal_bytes = journal.filename.bytes()
+
+        # Dry runs do not write the protocol.
+        protocol_bytes = filename.bytes()
+        eq_(_migrate_protocol(filename, False, True), 1)
+        eq_(filename.bytes(), protocol_bytes)
+
+        eq_(_migrate_protocol(filename, False, False), 1)
+        steps = _read_raw(filename).steps
+        eq_([pickle.loads(s.plugin_data['plugin']) for s in steps],
+            [{'a': 1}, {'a': 2}])
+        eq_(journal.filename.bytes(), journal_bytes)
+        protocol = Protocol.load(filename, warm=False)
+        eq_(protocol.n_replayed, 1)
+        eq_(protocol.n_repeats, 3)
+
+        # Step data is only re-serialized once.
+        eq_(_migrate_protocol(filename, False, False), 0)
+    finally:
+        root.rmtree()
+
+
+def test_migrate_log():
+    """
+    test that YAML log data is re-serialized using pickle
+    """
+    root = path(tempfile.mkdtemp(prefix='migrate_'))
+    try:
+        filename = root / 'data'
+        log = ExperimentLog()
+        log.data = [{'core': yaml.dump({'step': 0})},
+                    {'core': yaml.dump({'step': 1}),
+                     'plugin': pickle.dumps({'voltage': 100})}]
+        _write_pickle(filename, log)
+        _migrate_log(filename, False)
+        eq_([dict([(k, pickle.loads(v)) for k, v in d.iteritems()])
+             for d in _read_raw(filename).data],
+            [{'core': {'step': 0}},
+             {'core': {'step': 1}, 'plugin': {'voltage': 100}}])
+        eq_(ExperimentLog.load(filename).get('step'), [0, 1])
+    finally:
+        root.rmtree()
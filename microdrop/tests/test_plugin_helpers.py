@@ -0,0 +1,56 @@
+from nose.tools import eq_
+
+import plugin_helpers
+from plugin_helpers import StepOptionsController
+from protocol import Protocol, Step
+
+
+class Options(StepOptionsController):
+    name = 'test.options'
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    def get_step(self, step_number):
+        return self.steps[step_number]
+
+    def get_default_step_options(self):
+        return {'a': 0}
+
+
+class _App(object):
+    def __init__(self, protocol):
+        self.protocol = protocol
+
+
+def test_step_options_copy_on_write():
+    """
+    test that reading step options does not copy them, and that edited
+    options do not change copies of a step
+    """
+    step = Step({'test.options': {'a': 1}})
+    steps = [step, step.copy()]
+    controller = Options(steps)
+    assert(controller.get_step_options(1) is step.get_data('test.options'))
+    controller.edit_step_options(1)['a'] = 2
+    eq_(step.get_data('test.options'), {'a': 1})
+    eq_(steps[1].get_data('test.options'), {'a': 2})
+
+
+def test_default_step_options():
+    """
+    test that default step options are set through the protocol (so they are
+    recorded in its journal)
+    """
+    protocol = Protocol()
+    recorded = []
+    protocol.record_step_data = lambda *args: recorded.append(args)
+    controller = Options(protocol.steps)
+    get_app = plugin_helpers.get_app
+    plugin_helpers.get_app = lambda: _App(protocol)
+    try:
+        eq_(controller.get_step_options(0), {'a': 0})
+    finally:
+        plugin_helpers.get_app = get_app
+    eq_(protocol.steps[0].get_data('test.options'), {'a': 0})
+    eq_(recorded, [(0, 'test.options')])
@@ -0,0 +1,185 @@
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+from nose.plugins.skip import SkipTest
+from nose.tools import eq_
+from path_helpers import path
+
+from plugin_manager import (IPlugin, Plugin, PluginGlobals, implements,
+                            emit_signal, invalidate_dispatch_table,
+                            invalidate_service_registry)
+
+
+HOSTED_PLUGIN = '''
+from microdrop.plugin_manager import (IPlugin, Plugin, PluginGlobals,
+                                      implements, emit_signal)
+
+PluginGlobals.push_env('microdrop.managed')
+
+
+class HostedPlugin(Plugin):
+    implements(IPlugin)
+
+    def __init__(self):
+        self.name = 'test.hosted'
+        self.pongs = 0
+
+    def on_test_ping(self):
+        emit_signal('on_test_pong', [self.name])
+
+    def on_test_pong(self, plugin_name):
+        self.pongs += 1
+
+    def get_pongs(self):
+        return self.pongs
+
+
+PluginGlobals.pop_env()
+'''
+
+
+PluginGlobals.push_env('microdrop')
+
+
+class PongPlugin(Plugin):
+    implements(IPlugin)
+
+    def __init__(self):
+        self.name = 'test.pong'
+        self.pongs = []
+
+    def on_test_pong(self, plugin_name):
+        self.pongs.append(plugin_name)
+
+
+PluginGlobals.pop_env()
+
+
+class MainLoop(object):
+    '''
+    Stand-in for the `gobject` module: sources are only dispatched by
+    `iterate()`.
+    '''
+    IO_IN = 1
+
+    def __init__(self):
+        self.sources = {}
+        self._next_id = 1
+
+    def _add(self, f, args):
+        source_id = self._next_id
+        self._next_id += 1
+        self.sources[source_id] = (f, args)
+        return source_id
+
+    def io_add_watch(self, fd, condition, f, *args):
+        return self._add(f, (fd, condition) + args)
+
+    def timeout_add(self, interval, f, *args):
+        return self._add(f, args)
+
+    def idle_add(self, f, *args):
+        return self._add(f, args)
+
+    def source_remove(self, source_id):
+        return self.sources.pop(source_id, None) is not None
+
+    def iterate(self):
+        for source_id, (f, args) in self.sources.items():
+            if source_id in self.sources and not f(*args):
+                self.sources.pop(source_id, None)
+
+    def module(self):
+        module = types.ModuleType('gobject')
+        for name in ('IO_IN', 'io_add_watch', 'timeout_add', 'idle_add',
+                     'source_remove'):
+            setattr(module, name, getattr(self, name))
+        return module
+
+
+def _run_hosted(test, gobject=None):
+    try:
+        from plugin_host import start_plugin_host
+    except ImportError:
+        raise SkipTest('pyzmq is not installed')
+
+    temp_dir = path(tempfile.mkdtemp(prefix='microdrop_test'))
+    plugins_dir = temp_dir.joinpath('test_plugins')
+    plugins_dir.joinpath('hosted_plugin').makedirs()
+    plugins_dir.joinpath('__init__.py').write_text('')
+    plugins_dir.joinpath('hosted_plugin', '__init__.py') \
+        .write_text(HOSTED_PLUGIN)
+    pong = PongPlugin()
+    host = None
+    old_gobject = sys.modules.get('gobject')
+    # Without `gobject` (i.e., if `None`), signals are forwarded
+    # synchronously.
+    sys.modules['gobject'] = gobject
+    try:
+        host = start_plugin_host(plugins_dir, 'hosted_plugin')
+        host.enable()
+        invalidate_service_registry()
+        invalidate_dispatch_table()
+        eq_(host.name, 'test.hosted')
+        test(host, pong)
+    finally:
+        if old_gobject is None:
+            del sys.modules['gobject']
+        else:
+            sys.modules['gobject'] = old_gobject
+        if host is not None:
+            host.disable()
+            host.stop()
+            PluginGlobals.env('microdrop.managed').services.discard(host)
+        pong.disable()
+        PluginGlobals.env('microdrop').services.discard(pong)
+        invalidate_service_registry()
+        invalidate_dispatch_table()
+        shutil.rmtree(temp_dir)
+
+
+def test_forwarded_signal():
+    """
+    test that a signal emitted by a hosted plugin is delivered once
+    """
+    def test(host, pong):
+        emit_signal('on_test_ping')
+        # The signal emitted in the child process is re-emitted in the
+        # parent...
+        eq_(pong.pongs, ['test.hosted'])
+        # ...but not sent back to the hosted plugin, which handled it in the
+        # child process.
+        eq_(host.call('get_pongs', []), 1)
+
+    _run_hosted(test)
+
+
+def test_async_signal():
+    """
+    test that notification signals are forwarded to a hosted plugin without
+    waiting for its reply, which is handled by the main loop
+    """
+    loop = MainLoop()
+
+    def test(host, pong):
+        eq_(emit_signal('on_test_ping'), {'test.hosted': None})
+        eq_(pong.pongs, [])
+        start = time.time()
+        while not pong.pongs and time.time() - start < 10:
+            loop.iterate()
+            time.sleep(0.01)
+        eq_(pong.pongs, ['test.hosted'])
+
+        emit_signal('on_test_ping')
+        emit_signal('on_test_ping')
+        # Synchronous calls are made after pending calls complete.
+        eq_(host.call('get_pongs', []), 3)
+        eq_(len(pong.pongs), 3)
+        # The main loop sources are removed once no reply is awaited.
+        loop.iterate()
+        eq_(loop.sources, {})
+
+    _run_hosted(test, loop.module())
@@ -0,0 +1,197 @@
+import sys
+import threading
+import types
+
+from nose.tools import eq_
+
+import plugin_manager
+from plugin_manager import (IPlugin, Plugin, PluginGlobals, implements,
+                            emit_signal, invalidate_dispatch_table,
+                            invalidate_service_registry, set_coalescible,
+                            flush_coalesced_signals)
+from handler_pool import HandlerPool
+
+
+PluginGlobals.push_env('microdrop')
+
+
+class OuterPlugin(Plugin):
+    implements(IPlugin)
+    concurrent_signals = ('on_test_outer', 'on_test_inner')
+
+    def __init__(self):
+        self.name = 'test.outer'
+        self.threads = []
+
+    def on_test_outer(self):
+        self.threads.append(threading.current_thread())
+        # Nested signal, emitted from a worker thread.
+        return emit_signal('on_test_inner')
+
+    def on_test_inner(self):
+        self.threads.append(threading.current_thread())
+        return 'inner'
+
+
+class StepPlugin(Plugin):
+    implements(IPlugin)
+    concurrent_signals = ('on_test_step_run', )
+
+    def __init__(self):
+        self.name = 'test.step'
+        self.completed = []
+
+    def on_test_step_run(self):
+        emit_signal('on_step_complete', [self.name, None])
+
+    def on_step_complete(self, plugin_name, return_value=None):
+        self.completed.append(threading.current_thread())
+
+
+class OrderPlugin(Plugin):
+    implements(IPlugin)
+
+    def __init__(self):
+        self.name = 'test.order'
+        self.signals = []
+
+    def on_test_changed(self, step_number):
+        self.signals.append(('on_test_changed', step_number))
+
+    def on_steps_removed(self, step_numbers, steps):
+        self.signals.append(('on_steps_removed', step_numbers))
+
+
+PluginGlobals.pop_env()
+
+
+class _FakeGobject(object):
+    '''
+    Replace the `gobject` module with one that queues idle callbacks.
+    '''
+    def __enter__(self):
+        self.calls = []
+        gobject = types.ModuleType('gobject')
+        gobject.idle_add = lambda f, *args: (self.calls.append((f, args)) or
+                                             len(self.calls))
+        gobject.timeout_add = lambda delay, f, *args: gobject.idle_add(f,
+                                                                       *args)
+        gobject.source_remove = lambda source_id: None
+        self.original = sys.modules.get('gobject')
+        sys.modules['gobject'] = gobject
+        return self.calls
+
+    def __exit__(self, *args):
+        if self.original is None:
+            del sys.modules['gobject']
+        else:
+            sys.modules['gobject'] = self.original
+
+
+class _Plugins(object):
+    def __enter__(self):
+        self.pool = plugin_manager._handler_pool
+        # A single worker deadlocks if a nested signal waits for the pool.
+        plugin_manager._handler_pool = HandlerPool(n_workers=1)
+        self.plugins = [OuterPlugin(), StepPlugin(), OrderPlugin()]
+        invalidate_service_registry()
+        invalidate_dispatch_table()
+        return self.plugins
+
+    def __exit__(self, *args):
+        for plugin in self.plugins:
+            plugin.disable()
+            PluginGlobals.env('microdrop').services.discard(plugin)
+        plugin_manager._handler_pool = self.pool
+        invalidate_service_registry()
+        invalidate_dispatch_table()
+
+
+def test_nested_concurrent_signal():
+    with _Plugins() as (outer, step, order):
+        return_codes = emit_signal('on_test_outer')
+        eq_(return_codes, {'test.outer': {'test.outer': 'inner'}})
+        # The nested handler ran inline, on the same worker thread.
+        eq_(len(outer.threads), 2)
+        assert outer.threads[0] is outer.threads[1]
+        assert outer.threads[0] is not threading.current_thread()
+
+
+def test_main_thread_signal():
+    with _FakeGobject() as calls:
+        with _Plugins() as (outer, step, order):
+            emit_signal('on_test_step_run')
+            # `on_step_complete` is queued for the GTK main loop, rather than
+            # handled on the worker thread.
+            eq_(step.completed, [])
+            eq_(len(calls), 1)
+            f, args = calls[0]
+            f(*args)
+            eq_(step.completed, [threading.current_thread()])
+
+
+def test_coalesced_signal_order():
+    set_coalescible('on_test_changed')
+    try:
+        with _FakeGobject():
+            with _Plugins() as (outer, step, order):
+                emit_signal('on_test_changed', [3])
+                emit_signal('on_test_changed', [3])
+                eq_(order.signals, [])
+                # Queued signals are delivered before steps are removed.
+                emit_signal('on_steps_removed', [[1], [None]])
+                eq_(order.signals, [('on_test_changed', 3),
+                                    ('on_steps_removed', [1])])
+    finally:
+        set_coalescible('on_test_changed', False)
+        flush_coalesced_signals()
+
+
+def test_service_lookup_cached():
+    builds = []
+    build_service_index = plugin_manager._build_service_index
+
+    def counting_build(env):
+        builds.append(env)
+        return build_service_index(env)
+
+    with _Plugins() as (outer, step, order):
+        plugin_manager._build_service_index = counting_build
+        try:
+            for i in range(1000):
+                # Core plugin (not in the managed environment).
+                eq_(plugin_manager.get_enabled_service('test.outer'), outer)
+                eq_(plugin_manager.get_enabled_service('test.missing'), None)
+                eq_(plugin_manager.get_service_instance(OrderPlugin,
+                                                        env='microdrop'),
+                    order)
+            eq_(sorted(set(builds)), ['microdrop', 'microdrop.managed'])
+            eq_(len(builds), 2)
+
+            # The index is rebuilt when a plugin is disabled.
+            plugin_manager.disable('test.order', env='microdrop')
+            eq_(plugin_manager.get_enabled_service('test.order'), None)
+            eq_(len(builds), 4)
+        finally:
+            plugin_manager._build_service_index = build_service_index
+
+
+def test_dispatch_new_service():
+    """
+    test that a service created without invalidating the dispatch table (e.g.,
+    on import) is sent signals
+    """
+    with _Plugins() as (outer, step, order):
+        emit_signal('on_test_changed', [1])
+        other = OrderPlugin()
+        other.name = 'test.other_order'
+        try:
+            emit_signal('on_test_changed', [2])
+            eq_(order.signals, [('on_test_changed', 1),
+                                ('on_test_changed', 2)])
+            eq_(other.signals, [('on_test_changed', 2)])
+        finally:
+            other.disable()
+            PluginGlobals.env('microdrop').services.discard(other)
+            invalidate_service_registry()
+            invalidate_dispatch_table()
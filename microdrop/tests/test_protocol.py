@@ -1,7 +1,18 @@
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+import logging
+import tempfile
+
 from path_helpers import path
 from nose.tools import raises
 
-from protocol import Protocol
+from event_log import event_log
+from protocol import Protocol, Step
+from step_table import StepTable
+from protocol_journal import journal_paths
+from protocol_container import is_container, read_header, ContainerReader
 from microdrop_utility import Version
 
 def test_load_protocol():
@@ -35,3 +46,323 @@ def test_load_non_existant_protocol():
     Protocol.load(path(__file__).parent /
                    path('protocols') /
                    path('no protocol'))
+
+
+def test_lazy_step_data():
+    """
+    test that serialized step data is decoded on first access
+    """
+    step = Step()
+    step.set_encoded_data({'plugin': pickle.dumps({'a': 1})})
+    assert step.plugins == set(['plugin'])
+    assert not step.decoded
+    assert step.get_data('plugin') == {'a': 1}
+    assert step.decoded
+    copy = pickle.loads(pickle.dumps(step))
+    assert copy.get_data('plugin') == {'a': 1}
+
+
+def test_container_format():
+    """
+    test saving and loading a protocol in the container format
+    """
+    protocol = Protocol()
+    protocol.name = 'container'
+    protocol.n_repeats = 3
+    protocol.steps[0].set_data('plugin', {'a': 0})
+    for i in range(1, 5):
+        protocol.steps.append(Step({'plugin': {'a': i}}))
+    protocol.steps[2].set_data('other', [1, 2])
+
+    for compress in (False, True):
+        filename = path(tempfile.mktemp(prefix='protocol_'))
+        try:
+            protocol.save(filename, format='container', compress=compress)
+            assert is_container(filename)
+            header = read_header(filename)
+            assert header['name'] == 'container'
+            assert header['n_steps'] == 5
+            assert header['plugins'] == ['other', 'plugin']
+            reader = ContainerReader(filename)
+            assert pickle.loads(reader.step_data(3)['plugin']) == {'a': 3}
+        finally:
+            if filename.isfile():
+                filename.remove()
+
+
+def test_copy_on_write_step():
+    """
+    test that step copies share plugin data until it is changed
+    """
+    step = Step({'plugin': {'a': 1}, 'other': [1, 2]})
+    copy = step.copy()
+    assert copy.get_data('plugin') is step.get_data('plugin')
+
+    copy.set_data('plugin', {'a': 2})
+    assert step.get_data('plugin') == {'a': 1}
+    assert copy.get_data('plugin') == {'a': 2}
+
+    copy.edit_data('other').append(3)
+    assert step.get_data('other') == [1, 2]
+    assert copy.get_data('other') == [1, 2, 3]
+    assert pickle.loads(pickle.dumps(copy)).get_data('other') == [1, 2, 3]
+
+
+def test_save_background_snapshot():
+    """
+    test that step data edited while a protocol is saved in the background
+    does not change the file being written
+    """
+    protocol = Protocol()
+    protocol.steps[0].set_data('plugin', {'a': [1]})
+    data = protocol.steps[0].get_data('plugin')
+    filename = path(tempfile.mktemp(prefix='protocol_'))
+    try:
+        # Synchronous saves do not share the step data.
+        protocol.save(filename)
+        assert protocol.steps[0].edit_data('plugin') is data
+
+        # Take the snapshot of a background save, but write it after the
+        # step data was edited.
+        write = protocol._get_writer(filename, background=True)
+        protocol.steps[0].edit_data('plugin')['a'].append(2)
+        write()
+        # Data of plugins that are not enabled is not decoded on load.
+        assert pickle.loads(Protocol.load(filename).steps[0]
+                            .get_data('plugin')) == {'a': [1]}
+        assert protocol.steps[0].get_data('plugin') == {'a': [1, 2]}
+    finally:
+        if filename.isfile():
+            filename.remove()
+
+
+def test_insert_steps_count():
+    """
+    test that steps inserted using a count are distinct
+    """
+    protocol = Protocol()
+    protocol.insert_steps(0, count=3)
+    protocol.steps[0].set_data('plugin', {'a': 1})
+    assert [s.get_data('plugin') for s in protocol.steps] == \
+        [{'a': 1}, None, None, None]
+
+
+def test_protocol_journal():
+    """
+    test that edits recorded in the journal are applied when loading
+    """
+    dirname = path(tempfile.mkdtemp(prefix='protocol_'))
+    try:
+        filename = dirname / 'protocol'
+        protocol = Protocol()
+        protocol.compact_journal(filename)
+        protocol.set_n_repeats(3)
+        protocol.insert_step(1, Step())
+        protocol.set_step_data(1, 'plugin', {'a': 1})
+        protocol.delete_step(0)
+        protocol.close_journal()
+
+        loaded = Protocol.load(filename, warm=False)
+        assert loaded.n_replayed == 4
+        assert loaded.n_repeats == 3
+        assert len(loaded) == 1
+        assert loaded[0].plugins == set(['plugin'])
+
+        # Opening the journal saves the edits to the protocol file.
+        loaded.open_journal(filename)
+        loaded.close_journal()
+        loaded = Protocol.load(filename, warm=False)
+        assert loaded.n_replayed == 0
+        assert loaded.n_repeats == 3
+    finally:
+        dirname.rmtree()
+
+
+def test_discard_journal():
+    """
+    test that discarded edits are not applied when loading
+    """
+    dirname = path(tempfile.mkdtemp(prefix='protocol_'))
+    try:
+        filename = dirname / 'protocol'
+        protocol = Protocol()
+        protocol.compact_journal(filename)
+        protocol.set_n_repeats(3)
+        protocol.discard_journal()
+        assert protocol.journal is None
+        assert not [p for p in journal_paths(filename) if p.isfile()]
+
+        loaded = Protocol.load(filename, warm=False)
+        assert loaded.n_replayed == 0
+        assert loaded.n_repeats == 1
+    finally:
+        dirname.rmtree()
+
+
+def test_save_as_journal():
+    """
+    test that saving to another file does not leave unsaved edits in the
+    journal of the original file
+    """
+    dirname = path(tempfile.mkdtemp(prefix='protocol_'))
+    try:
+        src = dirname / 'protocol'
+        dest = dirname / 'copy'
+        protocol = Protocol()
+        protocol.compact_journal(src)
+        protocol.set_n_repeats(3)
+        protocol.compact_journal(dest)
+        protocol.set_n_repeats(4)
+        protocol.close_journal()
+        assert not [p for p in journal_paths(src) if p.isfile()]
+
+        loaded = Protocol.load(src, warm=False)
+        assert loaded.n_replayed == 0
+        assert loaded.n_repeats == 1
+        loaded = Protocol.load(dest, warm=False)
+        assert loaded.n_replayed == 1
+        assert loaded.n_repeats == 4
+    finally:
+        dirname.rmtree()
+
+
+def test_insert_delete_steps():
+    """
+    test inserting and removing several steps at once
+    """
+    protocol = Protocol()
+    protocol.insert_steps(1, values=[Step({'plugin': i}) for i in range(5)])
+    assert [s.get_data('plugin') for s in protocol.steps] == \
+        [None, 0, 1, 2, 3, 4]
+    protocol.goto_step(5)
+    protocol.delete_steps([4, 0, 2, 4])
+    assert [s.get_data('plugin') for s in protocol.steps] == [0, 2, 4]
+    assert protocol.current_step_number == 2
+    protocol.delete_steps(range(3))
+    assert len(protocol) == 1
+
+
+def test_container_dedup():
+    """
+    test that identical step data is stored once in the container format
+    """
+    step = Step({'plugin': {'states': range(1000)}})
+    protocol = Protocol()
+    protocol.steps = [step.copy() for i in range(100)]
+    protocol.steps[50].set_data('plugin', {'states': range(1000)})
+
+    filename = path(tempfile.mktemp(prefix='protocol_'))
+    try:
+        protocol.save(filename, format='container')
+        reader = ContainerReader(filename)
+        assert reader.step_data(0)['plugin'] is \
+            reader.step_data(50)['plugin']
+        assert filename.size < 2 * len(pickle.dumps(step.plugin_data, 2))
+    finally:
+        if filename.isfile():
+            filename.remove()
+
+
+def test_goto_step_event_values():
+    """
+    test that step field values are recorded when the step is swapped, but
+    only looked up when the event is formatted
+    """
+    protocol = Protocol()
+    protocol.plugin_fields = {'test.fields': ['a']}
+    protocol.steps[0].set_data('test.fields', {'a': 1})
+    # Events are only formatted by the logging sink at the debug level.
+    logger = logging.getLogger()
+    level = logger.level
+    logger.setLevel(logging.INFO)
+    try:
+        protocol.goto_step(0)
+    finally:
+        logger.setLevel(level)
+    protocol.steps[0].edit_data('test.fields')['a'] = 2
+    event = event_log.events('protocol.goto_step')[-1]
+    assert callable(event._fields['field_values'])
+    assert event.get('field_values') == {'test.fields': [1]}
+    assert protocol.steps[0].get_data('test.fields') == {'a': 2}
+
+
+def test_step_table_protocol():
+    """
+    test inserting, removing and advancing steps stored in a `StepTable`
+    """
+    protocol = Protocol()
+    protocol.steps = StepTable.from_steps([Step({'plugin': {'a': i}})
+                                           for i in range(3)])
+    protocol.insert_step(1, Step({'plugin': {'a': 10}}))
+    protocol.insert_steps(0, count=2)
+    assert [s.get_data('plugin') for s in protocol.steps] == \
+        [None, None, {'a': 0}, {'a': 10}, {'a': 1}, {'a': 2}]
+    protocol.delete_step(0)
+    protocol.delete_steps([0, 2])
+    assert [s.get_data('plugin') for s in protocol.steps] == \
+        [{'a': 0}, {'a': 1}, {'a': 2}]
+    protocol.goto_step(1)
+    protocol.next_step()
+    assert protocol.current_step_number == 2
+    # Going past the last step adds a copy of the last step.
+    protocol.next_step()
+    assert protocol.current_step_number == 3
+    assert [s.get_data('plugin') for s in protocol.steps] == \
+        [{'a': 0}, {'a': 1}, {'a': 2}, {'a': 2}]
+
+
+def test_step_table_edit_data():
+    """
+    test editing, journaling and saving the data of steps stored in a
+    `StepTable`
+    """
+    dirname = path(tempfile.mkdtemp(prefix='protocol_'))
+    try:
+        filename = dirname / 'protocol'
+        protocol = Protocol()
+        protocol.steps = StepTable.from_steps([Step({'plugin': {'a': [i]}})
+                                               for i in range(3)])
+        protocol.decode_steps()
+        assert all([step.decoded for step in protocol.steps])
+        protocol.compact_journal(filename)
+        protocol.steps[1].edit_data('plugin')['a'].append(10)
+        protocol.record_step_data(1, 'plugin')
+        protocol.set_step_data(2, 'plugin', {'a': [20]})
+        protocol.close_journal()
+        loaded = Protocol.load(filename, warm=False)
+        assert loaded.n_replayed == 2
+        # Data of plugins that are not enabled is not decoded on load.
+        assert [pickle.loads(s.get_data('plugin')) for s in loaded.steps] == \
+            [{'a': [0]}, {'a': [1, 10]}, {'a': [20]}]
+
+        # Step data edited after the snapshot of a background save is taken
+        # does not change the file being written.
+        write = protocol._get_writer(filename, background=True)
+        protocol.steps[0].edit_data('plugin')['a'].append(1)
+        write()
+        assert pickle.loads(Protocol.load(filename).steps[0]
+                            .get_data('plugin')) == {'a': [0]}
+        assert protocol.steps[0].get_data('plugin') == {'a': [0, 1]}
+    finally:
+        dirname.rmtree()
+
+
+def test_compact_journal_format():
+    """
+    test that protocols are only saved in the container format if it is
+    requested
+    """
+    dirname = path(tempfile.mkdtemp(prefix='protocol_'))
+    try:
+        filename = dirname / 'protocol'
+        protocol = Protocol()
+        protocol.compact_journal(filename)
+        protocol.wait_for_compaction()
+        assert not is_container(filename)
+        protocol.compact_journal(filename, format='container')
+        protocol.wait_for_compaction()
+        assert is_container(filename)
+        protocol.close_journal()
+        assert len(Protocol.load(filename, warm=False)) == 1
+    finally:
+        dirname.rmtree()
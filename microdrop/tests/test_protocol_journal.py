@@ -0,0 +1,48 @@
+import tempfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from path_helpers import path
+
+from protocol_journal import (ProtocolJournal, journal_paths, read_journal,
+                              pending_journals)
+
+
+def test_read_truncated_journal():
+    """
+    test that a partly written record is ignored
+    """
+    dirname = path(tempfile.mkdtemp(prefix='journal_'))
+    try:
+        filename = journal_paths(dirname / 'protocol')[0]
+        journal = ProtocolJournal(filename, 'base')
+        journal.append(('delete', 0))
+        journal.append(('delete', 1))
+        journal.close()
+        data = filename.bytes()
+        filename.write_bytes(data[:-2])
+        header, records = read_journal(filename)
+        assert header == ('journal', 'base', None)
+        assert records == [('delete', 0)]
+    finally:
+        dirname.rmtree()
+
+
+def test_pending_journals():
+    """
+    test the order in which journals are applied to a protocol file
+    """
+    dirname = path(tempfile.mkdtemp(prefix='journal_'))
+    try:
+        filename = dirname / 'protocol'
+        first, second = journal_paths(filename)
+        ProtocolJournal(second, 'new', parent_id='old').close()
+        ProtocolJournal(first, 'old').close()
+        assert [j[0] for j in pending_journals(filename, 'old')] == \
+            [first, second]
+        assert [j[0] for j in pending_journals(filename, 'new')] == [second]
+        assert pending_journals(filename, None) == []
+    finally:
+        dirname.rmtree()
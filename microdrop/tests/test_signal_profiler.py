@@ -0,0 +1,32 @@
+from nose.tools import eq_
+
+from signal_profiler import LatencyHistogram, SignalProfiler
+
+
+def test_histogram_is_fixed_size():
+    histogram = LatencyHistogram(n_bins=8)
+    for duration in [1e-7, 1e-6, 3e-6, 1e-3, 1e3]:
+        histogram.record(duration)
+    eq_(len(histogram.bins), 8)
+    eq_(histogram.count, 5)
+    eq_(sum(histogram.bins), 5)
+    eq_(histogram.max, 1e3)
+
+
+def test_histogram_percentile():
+    histogram = LatencyHistogram()
+    for i in range(99):
+        histogram.record(1e-6)
+    histogram.record(1.)
+    assert histogram.percentile(50) <= 1e-6
+    eq_(histogram.percentile(100), 1.)
+
+
+def test_profiler_report():
+    profiler = SignalProfiler()
+    profiler.record('plugin_a', 'on_step_run', 0.5)
+    profiler.record('plugin_b', 'on_step_run', 0.1)
+    profiler.record('plugin_b', 'on_step_run', 0.1)
+    eq_(profiler.get('plugin_b', 'on_step_run').count, 2)
+    eq_([x[0] for x in profiler.summary()], ['plugin_a', 'plugin_b'])
+    assert 'plugin_a' in profiler.report()
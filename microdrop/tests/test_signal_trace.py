@@ -0,0 +1,55 @@
+import tempfile
+
+from path_helpers import path
+from nose.tools import eq_, raises
+
+from signal_trace import SignalTraceWriter, TraceArgument, read_trace
+
+
+class IFoo(object):
+    pass
+
+
+class IBar(object):
+    pass
+
+
+def test_round_trip():
+    temp_dir = path(tempfile.mkdtemp(prefix='microdrop_test'))
+    try:
+        trace_path = temp_dir.joinpath('trace.bin')
+        writer = SignalTraceWriter(trace_path, exclude_interfaces=['IBar'])
+        writer.record('on_step_swapped', IFoo, [0, 1], [('a', 0.5),
+                                                        ('b', 0.25)], 1., 1.)
+        writer.record('on_debug', IBar, ['message'], [('a', 0.1)], 2., 1.)
+        writer.record('on_step_options_changed', IFoo,
+                      ['a', 3, None, True, 1.5, object()], [], 3., 0.)
+        writer.close()
+
+        events = list(read_trace(trace_path))
+        eq_(len(events), 2)
+        eq_(events[0].function, 'on_step_swapped')
+        eq_(events[0].interface, 'IFoo')
+        eq_(events[0].args, [0, 1])
+        eq_(events[0].observers, [('a', 0.5), ('b', 0.25)])
+        eq_(events[1].args[:5], ['a', 3, None, True, 1.5])
+        assert isinstance(events[1].args[5], TraceArgument)
+        assert events[1].time > events[0].time
+
+        # A truncated trace yields all complete records.
+        data = trace_path.bytes()
+        trace_path.write_bytes(data[:-3])
+        eq_(len(list(read_trace(trace_path))), 1)
+    finally:
+        temp_dir.rmtree()
+
+
+@raises(TypeError)
+def test_invalid_trace():
+    temp_dir = path(tempfile.mkdtemp(prefix='microdrop_test'))
+    try:
+        trace_path = temp_dir.joinpath('trace.bin')
+        trace_path.write_bytes('not a trace')
+        list(read_trace(trace_path))
+    finally:
+        temp_dir.rmtree()
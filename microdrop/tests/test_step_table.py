@@ -0,0 +1,117 @@
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy as np
+from nose.tools import eq_, ok_
+
+from step_table import StepTable
+
+
+class FakeStep(object):
+    def __init__(self, plugin_data):
+        self.plugin_data = plugin_data
+
+
+def _steps(n):
+    return [FakeStep({'a': {'duration': 100 * i, 'voltage': 1.5 * i,
+                            'enabled': i % 2 == 0, 'label': 'step %d' % i},
+                      'b': [i]})
+            for i in range(n)]
+
+
+def test_round_trip():
+    steps = _steps(5)
+    table = StepTable.from_steps(steps)
+    eq_(len(table), 5)
+    for i, step in enumerate(steps):
+        eq_(table[i].plugin_data, step.plugin_data)
+    eq_(table.get_column('a', 'duration').dtype, np.dtype('int64'))
+    eq_(table.get_column('a', 'enabled').dtype, np.dtype(bool))
+    eq_(table.get_column('a', 'label').dtype, np.dtype(object))
+
+
+def test_set_column():
+    table = StepTable.from_steps(_steps(10))
+    table.set_column('a', 'duration', 5, index=slice(2, 4))
+    eq_(list(table.get_column('a', 'duration')[1:5]), [100, 5, 5, 400])
+    table.set_column('a', 'new', np.arange(10))
+    eq_(table[3].get_data('a')['new'], 3)
+    eq_(table.get_column('a', 'duration').sum(), 4500 - 500 + 10)
+
+
+def test_mixed_types():
+    table = StepTable.from_steps(_steps(3))
+    table[1].set_data('a', {'duration': 'long'})
+    eq_(table[1].get_data('a'), {'duration': 'long'})
+    eq_(table[2].get_data('a')['duration'], 200)
+    eq_(table.get_column('a', 'duration').dtype, np.dtype(object))
+
+
+def test_list_interface():
+    table = StepTable.from_steps(_steps(4))
+    table.insert(1, FakeStep({'c': {'x': 1}}))
+    eq_(len(table), 5)
+    eq_(table[1].plugins, set(['c']))
+    eq_(table[2].get_data('b'), [1])
+    del table[1]
+    eq_(len(table), 4)
+    eq_(table[1].get_data('c'), None)
+    sliced = table[1:3]
+    eq_(len(sliced), 2)
+    eq_(sliced[0].get_data('b'), [1])
+    eq_([s.get_data('b') for s in table], [[0], [1], [2], [3]])
+
+
+def test_slice_assignment():
+    table = StepTable.from_steps(_steps(4))
+    table[1:1] = [FakeStep({'c': {'x': 1}})]
+    eq_(len(table), 5)
+    eq_(table[1].get_data('c'), {'x': 1})
+    # Steps may be views of the table itself.
+    table[:] = [step for i, step in enumerate(table) if i % 2 == 0]
+    eq_([s.get_data('b') for s in table], [[0], [1], [3]])
+    table[::2] = [FakeStep({'c': {'x': 2}}), FakeStep({})]
+    eq_([s.plugins for s in table], [set(['c']), set(['a', 'b']), set()])
+    eq_(table[0].get_data('c'), {'x': 2})
+
+
+def test_frame_round_trip():
+    table = StepTable.from_steps(_steps(4))
+    table[2].set_data('c', {'x': 1})
+    frame = table.to_frame()
+    eq_(frame.shape[0], 4)
+    copy = StepTable.from_frame(frame)
+    for i in range(4):
+        eq_(copy[i].plugin_data, table[i].plugin_data)
+
+
+def test_edit_data():
+    steps = _steps(3)
+    table = StepTable.from_steps(steps)
+    # Changes to edited data are written to the table.
+    data = table[1].edit_data('a')
+    data['duration'] = 5
+    data.update(label='edited', new=[1])
+    del data['enabled']
+    eq_(table[1].get_data('a'), {'duration': 5, 'voltage': 1.5,
+                                 'label': 'edited', 'new': [1]})
+    eq_(table.get_column('a', 'duration')[1], 5)
+    table[1].edit_data('a')['new'].append(2)
+    eq_(table[1].get_data('a')['new'], [1, 2])
+    # Non-`dict` data is shared with the steps it was created from, until it
+    # is edited.
+    table[2].edit_data('b').append(3)
+    eq_(table[2].get_data('b'), [2, 3])
+    eq_(steps[2].plugin_data['b'], [2])
+    # Slices are copies.
+    sliced = table[1:]
+    sliced[0].edit_data('a')['new'].append(3)
+    sliced[1].edit_data('b').append(4)
+    eq_(table[1].get_data('a')['new'], [1, 2])
+    eq_(table[2].get_data('b'), [2, 3])
+    eq_(sliced[1].get_data('b'), [2, 3, 4])
+    # Edited `dict` data is pickled as a plain `dict`.
+    eq_(type(pickle.loads(pickle.dumps(table[0].edit_data('a')))), dict)
+    eq_(table[0].edit_data('c'), None)
@@ -0,0 +1,212 @@
+import sys
+import types
+
+from nose.plugins.skip import SkipTest
+from nose.tools import eq_
+
+from microdrop.plugin_manager import (IPlugin, Plugin, SingletonPlugin,
+                                      PluginGlobals, implements, emit_signal,
+                                      get_service_instance,
+                                      invalidate_dispatch_table,
+                                      invalidate_service_registry)
+from microdrop.protocol import Protocol, Step
+from trampoline import Trampoline
+
+
+def _stack_depth():
+    depth = 0
+    frame = sys._getframe(1)
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+PluginGlobals.push_env('microdrop')
+
+
+class App(SingletonPlugin):
+    '''
+    Application state used by `ProtocolController` (see `get_app()`).
+    '''
+    def __init__(self):
+        self.name = 'test.app'
+        self.protocol = None
+        self.dmf_device = None
+        self.experiment_log = None
+        self.realtime_mode = False
+        self.running = False
+
+
+class SyncStepPlugin(Plugin):
+    '''
+    Plugin that completes each step synchronously from within `on_step_run`.
+    '''
+    implements(IPlugin)
+
+    def __init__(self):
+        self.name = 'test.sync_step'
+        self.steps_run = 0
+        self.max_depth = 0
+
+    def on_step_run(self):
+        self.steps_run += 1
+        self.max_depth = max(self.max_depth, _stack_depth())
+        emit_signal('on_step_complete', [self.name, None])
+
+
+PluginGlobals.pop_env()
+
+
+class _Widget(object):
+    def set_text(self, text):
+        pass
+
+    def set_image(self, image):
+        pass
+
+    def get_object(self, name):
+        return None
+
+
+class _Stub(object):
+    '''
+    Stand-in for any object of a stubbed module: calls and attribute lookups
+    return stubs.
+    '''
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __call__(self, *args, **kwargs):
+        return _Stub()
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError, name
+        return _Stub()
+
+
+class _StubModule(types.ModuleType):
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError, name
+        # A class, so it may also be used as a base class.
+        return type(name, (_Stub, ), {})
+
+
+# GUI modules imported by `ProtocolController`.  Modules that cannot be
+# imported (e.g., on a headless test machine) are stubbed, since the protocol
+# run loop does not use the GUI.
+GUI_MODULES = ['gtk', 'gtk.gdk', 'gobject', 'textbuffer_with_undo',
+               'microdrop_utility.gui']
+
+
+def _import_protocol_controller():
+    stubs = []
+    for name in GUI_MODULES:
+        if name in sys.modules:
+            continue
+        try:
+            __import__(name)
+        except Exception:
+            # e.g., `ImportError`, or `RuntimeError` if there is no display.
+            sys.modules[name] = _StubModule(name)
+            stubs.append(name)
+    try:
+        from microdrop.gui.protocol_controller import ProtocolController
+    except ImportError, why:
+        raise SkipTest('could not import ProtocolController: %s' % why)
+    finally:
+        # Only `ProtocolController` uses the stubs (e.g., other tests check
+        # whether `gobject` is available).
+        for name in stubs:
+            del sys.modules[name]
+    return ProtocolController
+
+
+def _run_protocol(n_steps, n_repeats):
+    '''
+    Run a protocol using `ProtocolController` (run step -> `on_step_run` ->
+    `on_step_complete` -> `Protocol.next_step` -> run step ...).
+
+    Returns the `SyncStepPlugin` that handled the steps.
+    '''
+    ProtocolController = _import_protocol_controller()
+
+    controller = get_service_instance(ProtocolController, env='microdrop')
+    for name in ('label_step_number', 'textentry_protocol_repeats',
+                 'button_run_protocol', 'builder'):
+        setattr(controller, name, _Widget())
+    app = get_service_instance(App, env='microdrop')
+    app.protocol = Protocol()
+    app.protocol.steps.extend([Step() for i in xrange(n_steps - 1)])
+    app.protocol.n_repeats = n_repeats
+    app.dmf_device = object()
+    plugin = SyncStepPlugin()
+    invalidate_service_registry()
+    invalidate_dispatch_table()
+    try:
+        controller.run_protocol()
+        eq_(app.running, False)
+        eq_(app.protocol.current_step_number, n_steps - 1)
+        eq_(app.protocol.current_repetition, n_repeats - 1)
+    finally:
+        app.running = False
+        app.protocol = None
+        plugin.disable()
+        PluginGlobals.env('microdrop').services.discard(plugin)
+        invalidate_service_registry()
+        invalidate_dispatch_table()
+    return plugin
+
+
+# Stack frames allowed above the deepest `on_step_run` handler of a short
+# protocol run (a run needs about 20 frames for the handlers of a step).
+STACK_HEADROOM = 50
+
+
+def test_long_protocol_constant_stack_depth():
+    short_plugin = _run_protocol(n_steps=2, n_repeats=1)
+    eq_(short_plugin.steps_run, 2)
+    # Equivalent to running 10,000 steps x 100 repeats under the default
+    # recursion limit (1000 frames), i.e., the run fails if the stack grows by
+    # one frame every 1000 steps, but runs 20 times fewer steps: the limit
+    # only leaves `STACK_HEADROOM` frames for 50,000 steps.  Errors raised by
+    # handlers are logged, so a failed run stops before the last step.
+    recursion_limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(short_plugin.max_depth + STACK_HEADROOM)
+    try:
+        plugin = _run_protocol(n_steps=10000, n_repeats=5)
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+    eq_(plugin.steps_run, 10000 * 5)
+    eq_(plugin.max_depth, short_plugin.max_depth)
+
+
+def test_nested_calls_are_queued():
+    trampoline = Trampoline()
+    calls = []
+
+    def outer():
+        trampoline.call(calls.append, 'inner')
+        calls.append('outer')
+
+    trampoline.call(outer)
+    eq_(calls, ['outer', 'inner'])
+    eq_(trampoline.running, False)
+
+
+def test_exception_clears_queue():
+    trampoline = Trampoline()
+    calls = []
+
+    def fail():
+        trampoline.call(calls.append, 'queued')
+        raise ValueError
+
+    try:
+        trampoline.call(fail)
+    except ValueError:
+        pass
+    trampoline.call(calls.append, 'next')
+    eq_(calls, ['next'])
@@ -0,0 +1,49 @@
+"""
+Copyright 2011 Ryan Fobel
+
+This file is part of Microdrop.
+
+Microdrop is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Microdrop is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Microdrop.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import deque
+
+
+class Trampoline(object):
+    '''
+    Run chained calls iteratively instead of recursively.
+
+    A call made through `call()` while another call is running (e.g., from
+    inside a signal handler called by the running call) is queued, and is run
+    once the running call has returned.  Chains of calls like
+    `on_step_complete -> next step -> on_step_run -> on_step_complete` then
+    run in constant stack depth.
+    '''
+    def __init__(self):
+        self._queue = deque()
+        self.running = False
+
+    def call(self, f, *args):
+        self._queue.append((f, args))
+        if self.running:
+            return
+        self.running = True
+        try:
+            while self._queue:
+                f, args = self._queue.popleft()
+                f(*args)
+        finally:
+            # Drop queued calls if a call raised an exception.
+            self._queue.clear()
+            self.running = False